@@ -35,15 +35,32 @@ class NAlgorithm(object):
     NcarChem.watcher.attachAlgorithm() function. The variables, setup and
     process objects need to be added to the algorithm through dot notation
     after instantiation of the class.
+
+    With run_mode "new data" process(tm, data) is called for every new row,
+    with "every update" also with (tm, None) for every update without one,
+    and with "batch" process(times, columns) is called once with all of the
+    new rows, as the times in epoch seconds (see data.toEpoch) and a list of
+    values for each variable (see NVarSet.columns). Their positions in the
+    variables are then in `batch`, as (start, stop).
     """
     def __init__(self, run_mode="new data", desc="No Description"):
         self.last_date = None
+        self._pos = None  # Position of the row after last_date
+        self.batch = None
         self.variables = None
         self.updated = False
         self.new_data = None
         self._flight_start_time = None
         self.desc = desc
 
+        ## Optional function giving the time up to which the data of the
+        ## variables is complete (None when none is yet). Newer rows wait.
+        self.watermark = None
+
+        ## Function giving the gaps in the data (satcom outages), with the
+        ## arguments of NVarSet.gaps. Set by the watcher.
+        self.gaps = lambda start=None, stop=None, min_length=None: []
+
         self.setup = lambda: None
         self.process = lambda: None
         self._run_mode = run_mode
@@ -58,36 +75,65 @@ class NAlgorithm(object):
         self._flight_start_time = value
 
     def run(self):
-        ## In case we start the server before any values are in it.
-        try:
-            new_date = self._time.getTimeFromPos(-1)
-        except KeyError:
+        ## In case we start the server before any values are in it. New rows
+        ## are found by position, which is cheaper than comparing times.
+        stop = len(self._time)
+        if stop == 0:
             return
 
+        if self.watermark is not None:
+            limit = self.watermark()
+            if limit is None:
+                self.updated = False
+                return
+            if limit < self._time.getTimeFromPos(-1):
+                stop = self._time.getPosFromTime(limit) + 1
+
         ## In case we start the server before any values are in it.
-        if self.last_date is None:
-            self.last_date = new_date
+        if self._pos is None:
+            self._pos = stop
+            self.last_date = self._time.getTimeFromPos(stop - 1)
 
-        if new_date > self.last_date:
+        if stop > self._pos:
             self.updated = True
-            self._process_update()
-            self.last_date = new_date
+            self._process_update(self._pos, stop)
+            self._pos = stop
+            self.last_date = self._time.getTimeFromPos(stop - 1)
         else:
             self.updated = False
             if self._run_mode == "every update":
-                self.process(new_date, None)
+                self.process(self._time.getTimeFromPos(stop - 1), None)
+
+    def _process_update(self, start, stop):
+        if self._run_mode == "batch":
+            if len(self.variables._aggregators) != 0:
+                for point in self.variables.sliceWithTime(start, stop):
+                    self.variables.feedAggregators(point[0], point[1:])
+            self.batch = (start, stop)
+            self.process(*self.variables.columns(start, stop))
+            return
 
-    def _process_update(self):
-        new_data = self.variables.sliceWithTime(self.last_date, None)[1:]
+        new_data = self.variables.sliceWithTime(start, stop)
 
         for point in new_data:
             tm = point[0]
             update = point[1:]
+            self.variables.feedAggregators(tm, update)
             try:
                 self.process(tm, update)
             except Exception, e:
                 raise e
 
+    def resume(self):
+        """
+        Carry on with the rows after last_date, such as after the state of
+        the algorithm was restored from a checkpoint.
+        """
+        try:
+            self._pos = self._time.getPosFromTime(self.last_date) + 1
+        except KeyError:
+            self._pos = None
+
     def reset(self):
         try:
             self.setup()
@@ -98,5 +144,7 @@ class NAlgorithm(object):
         self._time = self.variables.getNVar(self.variables.keys()[0])
         try:
             self.last_date = self._time.getTimeFromPos(-1)
+            self._pos = len(self._time)
         except KeyError, e:
             self.last_date = None
+            self._pos = None
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Replay many archived flights through NWatcher at once, for regression
+## testing algorithm changes. Every flight file is replayed in its own worker
+## process against a database.NMemoryDatabase, so no PostgreSQL server (or
+## simulated database per run) is needed. The log messages of every flight are
+## collected into one report that can be compared between runs.
+##
+## The algorithm configuration is a function that takes the NWatcher and
+## attaches algorithms to it, just like a monitoring script would. As it is
+## sent to the worker processes it must be defined at the top level of a
+## module (see examples/batch_replay.py).
+##
+##     results = replayFlights(glob.glob('samples/*.asc'), configure)
+##     print formatReport(results)
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:00:15
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+
+## Intrapackage
+from database import NMemoryDatabase
+from watch import NWatcher
+
+## Worker processes
+import multiprocessing
+
+## General
+import datetime
+import difflib
+import os
+import tempfile
+import time
+import traceback
+
+## Simulated time to keep running after the last row of a file, long enough
+## for the landing of the last flight to be seen and its file written.
+REPLAY_TAIL = datetime.timedelta(minutes=10)
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def replayFlight(file_name, configure=None, variables=None,
+                simulate_start_time=None, output_file_path=None):
+    """
+    Replay one flight file in this process. Returns a dictionary with the
+    file name, the formatted log messages, the replay time in seconds, the
+    time taken to parse the file, the NWatcher.timing break down and the
+    error (a traceback string) if the replay failed.
+    """
+    messages = []
+
+    def collect(msg, tm):
+        if tm is not None:
+            formatted_msg = "[%sZ] %s" % (tm, msg)
+        else:
+            formatted_msg = msg
+        messages.append(formatted_msg)
+        return formatted_msg
+
+    remove_output = output_file_path is None
+    if remove_output:
+        fd, output_file_path = tempfile.mkstemp(suffix=os.extsep + "asc")
+        os.close(fd)
+
+    result = {'file': file_name, 'messages': messages,
+              'seconds': None, 'parse': None, 'timing': None, 'error': None}
+    start = time.time()
+    try:
+        server = NMemoryDatabase(simulate_file=file_name,
+                                 simulate_start_time=simulate_start_time)
+        result['parse'] = time.time() - start
+        watcher = NWatcher(server=server,
+                           print_msg_fn=collect,
+                           output_file_path=output_file_path,
+                           variables=variables)
+        if configure is not None:
+            configure(watcher)
+
+        if server.last_time is not None:
+            watcher.runTillTime(server.last_time + REPLAY_TAIL)
+        result['timing'] = dict(watcher.timing)
+    except Exception:
+        result['error'] = traceback.format_exc()
+
+    result['seconds'] = time.time() - start
+
+    if remove_output:
+        try:
+            os.remove(output_file_path)
+        except OSError:
+            pass
+
+    return result
+
+
+def _replayWorker(args):
+    """ Unpack the arguments sent to a worker process. """
+    file_name, configure, variables = args
+    return replayFlight(file_name, configure=configure, variables=variables)
+
+
+def replayFlights(file_names, configure=None, variables=None,
+                  processes=None):
+    """
+    Replay every flight file in `file_names`, each in its own worker process
+    (by default one per core). Returns the replayFlight results in the order
+    of `file_names`.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(file_names)))
+
+    jobs = [(file_name, configure, variables) for file_name in file_names]
+    if processes == 1:
+        return [_replayWorker(job) for job in jobs]
+
+    pool = multiprocessing.Pool(processes=processes)
+    try:
+        results = pool.map(_replayWorker, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return results
+
+
+def formatReport(results, timing=False):
+    """
+    Format replay results as text, one section per flight file. Without
+    `timing` the report only depends on the algorithm output, so reports from
+    two runs can be compared line for line.
+    """
+    lines = []
+    for result in results:
+        lines.append("== %s" % os.path.basename(result['file']))
+        if timing:
+            lines.append("-- replayed in %.2f s" % result['seconds'])
+        lines += result['messages']
+        if result['error'] is not None:
+            lines.append("!! replay failed")
+            lines += result['error'].rstrip('\n').split('\n')
+
+    return "\n".join(lines)
+
+
+def compareReports(expected, actual):
+    """
+    Compare two reports from formatReport. Returns a list of unified diff
+    lines, which is empty when the reports are the same.
+    """
+    return list(difflib.unified_diff(expected.split('\n'),
+                                     actual.split('\n'),
+                                     'expected', 'actual', lineterm=''))
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## A cache of data already fetched from the real time database. Rows of
+## raf_lrt never change once written, so NDatabase.getData can answer the
+## part of a query that lies in the past from here: the hour of history
+## fetched at every flight start or restart, the backfills of variables an
+## NLazyVarSet starts using and the fills of slowly polled variables.
+##
+## Data is kept in chunks, the values of one variable over one `bucket` of
+## time, keyed on (database, variable, start of the bucket). Rows can arrive
+## late, such as the backlog sent after a satcom outage, so a bucket is only
+## cached once it is complete: it ended at least `settle` before the current
+## time, a newer row is in the database and no two of its rows are more than
+## `max_gap` apart (by default the DataRate, so not one row is missing). The
+## chunks are held in memory up to `max_bytes`, dropping the least recently
+## used first, and with a `directory` also on disk, so other processes and
+## later runs share them.
+##
+##     cache = NChunkCache(max_bytes=128 << 20, directory="/tmp/rt-cache")
+##     watcher = NWatcher(database="GV", cache=cache)
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:35:21
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+## Intrapackage imports
+from utils import fromEpoch, toSeconds, writePickle
+
+from collections import OrderedDict
+import cPickle as pickle
+import datetime
+import os
+import re
+import sys
+import threading
+
+## Rough size in bytes of a chunk, and of each of its values.
+_CHUNK_BYTES = 200
+_VALUE_BYTES = 40
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NChunkCache(object):
+    """
+    Chunks of (times, values) of one variable over a time bucket, see the
+    module description. One cache can be shared by many NDatabases.
+    """
+
+    def __init__(self, bucket=datetime.timedelta(minutes=5),
+                       max_bytes=64 << 20, directory=None,
+                       settle=datetime.timedelta(minutes=1),
+                       max_gap=None):
+        self.bucket = bucket
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.settle = settle
+        self.max_gap = max_gap
+
+        self.hits = 0
+        self.misses = 0
+
+        self._chunks = OrderedDict()  # {key: (times, values)}, oldest first
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._bucket_seconds = (bucket.days * 86400 + bucket.seconds +
+                                bucket.microseconds / 1e6)
+
+    @property
+    def size(self):
+        """ Bytes of chunks held in memory (an estimate). """
+        return self._bytes
+
+    def bucketStart(self, tm):
+        """ Start of the bucket the datetime `tm` falls in. """
+        ## Buckets are counted from the epoch.
+        seconds = toSeconds(tm)
+        return fromEpoch(seconds - seconds % self._bucket_seconds)
+
+    def get(self, database, variable, start):
+        """ The (times, values) of a bucket, None if it is not cached. """
+        key = (database, variable, start)
+        self._lock.acquire()
+        try:
+            chunk = self._chunks.pop(key, None)
+            if chunk is not None:
+                self._chunks[key] = chunk  # Now the most recently used
+        finally:
+            self._lock.release()
+
+        if chunk is None and self.directory is not None:
+            chunk = self._read(key)
+            if chunk is not None:
+                self._hold(key, chunk)
+
+        if chunk is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return chunk
+
+    def put(self, database, variable, start, times, values):
+        """ Cache the complete data of a variable over a bucket. """
+        key = (database, variable, start)
+        chunk = (tuple(times), tuple(values))
+        self._hold(key, chunk)
+        if self.directory is not None:
+            self._write(key, chunk)
+
+    def _hold(self, key, chunk):
+        """ Keep a chunk in memory, dropping old ones to stay in budget. """
+        self._lock.acquire()
+        try:
+            old = self._chunks.pop(key, None)
+            if old is not None:
+                self._bytes -= self._chunkBytes(old)
+            self._chunks[key] = chunk
+            self._bytes += self._chunkBytes(chunk)
+
+            while self._bytes > self.max_bytes and len(self._chunks) > 1:
+                dropped = self._chunks.popitem(last=False)[1]
+                self._bytes -= self._chunkBytes(dropped)
+        finally:
+            self._lock.release()
+
+    def _chunkBytes(self, chunk):
+        return _CHUNK_BYTES + _VALUE_BYTES * len(chunk[0])
+
+    def clear(self):
+        """ Forget the chunks in memory (those on disk stay). """
+        self._lock.acquire()
+        try:
+            self._chunks.clear()
+            self._bytes = 0
+        finally:
+            self._lock.release()
+
+    def _fileName(self, key):
+        database, variable, start = key
+        return os.path.join(self.directory,
+                            re.sub(r"[^\w.-]+", "_", str(database)),
+                            start.strftime("%Y%m%dT%H%M%S"),
+                            "%s%schunk" % (variable, os.extsep))
+
+    def _read(self, key):
+        file_name = self._fileName(key)
+        if not os.path.exists(file_name):
+            return None
+        try:
+            f = open(file_name, 'rb')
+            try:
+                return pickle.load(f)
+            finally:
+                f.close()
+        except Exception, e:
+            print >>sys.stderr, ("%s: Could not read %s: %s"
+                                 % (self.__class__.__name__, file_name, e))
+            return None
+
+    def _write(self, key, chunk):
+        """ Write a chunk file atomically, so readers never see part of it. """
+        file_name = self._fileName(key)
+        try:
+            directory = os.path.dirname(file_name)
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    pass  # Made by another process meanwhile
+            writePickle(file_name, chunk)
+        except Exception, e:
+            print >>sys.stderr, ("%s: Could not write %s: %s"
+                                 % (self.__class__.__name__, file_name, e))
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## A cache of the catalog of a real time database: the raf_lrt columns, the
+## missing value, sample rate and units of every variable and the flight
+## information. Reading the catalog takes several queries over what can be a
+## slow link, while it only changes when the server starts a new database or
+## alters the tables, so NDatabase reads a cheap fingerprint of the schema
+## instead and only loads the catalog when the fingerprint is new.
+##
+## Catalogs are shared in memory by every NCatalogCache in the process, so
+## any number of watchers on one database load it once. With a `directory`
+## they are also kept on local disk, so a restarted watcher starts without
+## reading the catalog again.
+##
+##     cache = NCatalogCache("/var/cache/ncarflightmonitor")
+##     catalog = cache.get(("eol-rt-data", "real-time-GV"), fingerprint, load)
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:24:30
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+## Intrapackage imports
+from utils import writePickle
+
+import cPickle as pickle
+import os
+import re
+import sys
+
+## Catalogs in memory, {key: NCatalog}, shared by all caches.
+_catalogs = {}
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NCatalog(object):
+    """
+    The catalog of a database as of the schema `fingerprint`. `columns` is
+    the tuple of raf_lrt columns other than datetime, `missing_values`,
+    `sample_rates` (in Hz) and `units` are dictionaries by the (upper case)
+    variable name as in variable_list, and `flight_info` is the
+    global_attributes table.
+    """
+
+    def __init__(self, columns=(), missing_values=None, sample_rates=None,
+                       units=None, flight_info=None, fingerprint=None):
+        self.columns = tuple(columns)
+        self.missing_values = missing_values or {}
+        self.sample_rates = sample_rates or {}
+        self.units = units or {}
+        self.flight_info = flight_info or {}
+        self.fingerprint = fingerprint
+
+
+class NCatalogCache(object):
+    """
+    Catalogs by a key identifying the database, such as (host, database),
+    kept in memory and, given a `directory` (created if needed), on disk.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def get(self, key, fingerprint, load):
+        """
+        The catalog of `key` with the schema `fingerprint`, from memory,
+        from disk or, when neither has it, from `load()` (which returns an
+        NCatalog and is then cached).
+        """
+        catalog = _catalogs.get(key)
+        if catalog is None or catalog.fingerprint != fingerprint:
+            catalog = self._read(key)
+            if catalog is None or catalog.fingerprint != fingerprint:
+                catalog = load()
+                catalog.fingerprint = fingerprint
+                self._write(key, catalog)
+            _catalogs[key] = catalog
+        return catalog
+
+    def _fileName(self, key):
+        name = re.sub(r"[^\w.-]+", "_", "-".join([str(part) for part in key]))
+        return os.path.join(self.directory, "%s%scatalog" % (name, os.extsep))
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        file_name = self._fileName(key)
+        if not os.path.exists(file_name):
+            return None
+
+        try:
+            f = open(file_name, 'rb')
+            try:
+                return NCatalog(**pickle.load(f))
+            finally:
+                f.close()
+        except Exception, e:
+            print >>sys.stderr, ("%s: Could not read %s: %s"
+                                 % (self.__class__.__name__, file_name, e))
+            return None
+
+    def _write(self, key, catalog):
+        """ Replace the file of a catalog atomically. """
+        if self.directory is None:
+            return
+        file_name = self._fileName(key)
+        try:
+            writePickle(file_name, dict(catalog.__dict__))
+        except Exception, e:
+            print >>sys.stderr, ("%s: Could not write %s: %s"
+                                 % (self.__class__.__name__, file_name, e))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Crash safe checkpoints of a flight in progress, so that a watcher that is
+## restarted mid-flight carries on where it left off instead of starting a
+## new flight with only the last hour of data.
+##
+## A checkpoint directory holds two files:
+##
+## - `rows`, a spool the flight's data is appended to, one pickled chunk of
+##   (names, rows) per checkpoint, so each checkpoint only writes the rows
+##   that are new since the last one.
+## - `state`, a pickle of everything else (the algorithms' state, the log
+##   and how many rows of the spool it covers), replaced atomically with a
+##   rename so it is always either the old or the new state.
+##
+## A crash between appending to the spool and saving the state leaves rows
+## in the spool that the state does not cover; load() cuts them off so the
+## spool always continues from the loaded state.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:22:40
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+## Intrapackage imports
+from utils import writePickle
+
+import cPickle as pickle
+import os
+import sys
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NCheckpoint(object):
+    """
+    The checkpoint files of one watcher in `directory` (created if needed).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._state_file = os.path.join(directory, "state")
+        self._rows_file = os.path.join(directory, "rows")
+
+    def appendRows(self, names, rows):
+        """
+        Add rows of (datetime or epoch seconds, value, ...) for `names` to
+        the spool.
+        """
+        if len(rows) == 0:
+            return
+        f = open(self._rows_file, 'ab')
+        try:
+            pickle.dump((list(names), rows), f, pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+    def saveState(self, state):
+        """ Replace the state (a picklable dictionary) atomically. """
+        writePickle(self._state_file, state, sync=True)
+
+    def load(self):
+        """
+        The saved state and the spooled chunks it covers, as (state,
+        [(names, rows), ...]). The state's 'rows' entry must be the number of
+        rows spooled when it was saved. None if there is no checkpoint.
+        """
+        if not os.path.exists(self._state_file):
+            return None
+
+        try:
+            f = open(self._state_file, 'rb')
+            try:
+                state = pickle.load(f)
+            finally:
+                f.close()
+        except Exception, e:
+            print >>sys.stderr, ("%s: Could not read checkpoint state: %s"
+                                 % (self.__class__.__name__, e))
+            return None
+
+        chunks = []
+        remaining = state['rows']
+        end = 0  # End of the last whole chunk the state covers
+        partial = None
+        if os.path.exists(self._rows_file):
+            f = open(self._rows_file, 'rb')
+            try:
+                while remaining > 0:
+                    try:
+                        names, rows = pickle.load(f)
+                    except Exception:
+                        break  # The end, or a partly written chunk
+                    if len(rows) > remaining:
+                        partial = (names, rows[:remaining])
+                        chunks.append(partial)
+                        remaining = 0
+                        break
+                    chunks.append((names, rows))
+                    remaining -= len(rows)
+                    end = f.tell()
+            finally:
+                f.close()
+
+            f = open(self._rows_file, 'r+b')
+            try:
+                f.truncate(end)
+            finally:
+                f.close()
+            if partial is not None:
+                self.appendRows(*partial)
+
+        if remaining > 0:
+            print >>sys.stderr, ("%s: Checkpoint is missing %d rows"
+                                 % (self.__class__.__name__, remaining))
+        return state, chunks
+
+    def clear(self):
+        """ Remove the checkpoint, such as when a flight has ended. """
+        for file_name in (self._state_file, self._rows_file):
+            if os.path.exists(file_name):
+                os.remove(file_name)
@@ -19,7 +19,16 @@
 ## The NVarSet holds a set of NVar objects and allows the entire set to be
 ## sliced in the same manner as mentioned above, returning a list of tuples
 ## where each column represents one NVar. The order is determined by entry
-## into the set.
+## into the set. The NLazyVarSet knows all of its variable names but only
+## fetches and stores a variable once it is first used. A set holding every
+## variable of a whole flight can be compressed (NVarSet.compress), keeping
+## its data in the columns of encoding.py.
+##
+## The times of every NVar are kept as epoch seconds in an NTimeColumn (see
+## encoding.py), shared by the variables of a set, and datetimes are only
+## made when they are asked for: by time keys, slices and sliceWithTime.
+## Rows for addData and fillData can start with either a datetime or epoch
+## seconds, which is how NDatabaseLiveUpdater fetches them.
 ##
 ## Both classes are designed to act like a tuple in the fact that they are
 ## READ ONLY! If you would like to add data to a NVar or NVarSet (for NVar
@@ -39,11 +48,17 @@
 
 ## Intrapackage imports
 from datafile import NRTFile
+from encoding import NTimeColumn, NValueColumn
+from stats import NRollup, ROLLUP_PERIODS
+from utils import fromEpoch, toEpoch, toSeconds
 
 ## New data type, not supported below python 2.7
 from collections import OrderedDict
 
+from array import array
+import bisect
 import datetime
+import itertools
 
 ## --------------------------------------------------------------------------
 ## Functions
@@ -53,15 +68,216 @@ import datetime
 def createOrderedList(variables):
     """
     Creates a list where col[0] is the variable name and
-    col[1] is an NVar object.
+    col[1] is an NVar object. The NVars will always have the same times,
+    so they share one column of them.
     """
     var_list = []
+    times = NTimeColumn()
     for var in variables:
         var_list.append((var.lower(), NVar(var)))
+        var_list[-1][1]._times = times
 
     return var_list
 
 
+def _mergePlan(left, right, duplicates="right"):
+    """
+    Plan the merge of two sorted lists of datetimes. Returns a list of
+    (is_right, start, stop) runs which, taken in order, give the merged
+    list. Runs of one list that do not overlap the other are taken whole, so
+    when one list lies entirely after the other the plan is two runs long.
+    """
+    if duplicates not in ("right", "left", "error"):
+        raise ValueError('duplicates must be "right", "left" or "error"')
+
+    n = len(left)
+    m = len(right)
+    if m == 0 or n == 0:
+        return [(False, 0, n), (True, 0, m)]
+
+    ## Fast path, one lies entirely after the other.
+    if left[-1] < right[0]:
+        return [(False, 0, n), (True, 0, m)]
+    if right[-1] < left[0]:
+        return [(True, 0, m), (False, 0, n)]
+
+    plan = []
+    i = bisect.bisect_left(left, right[0])
+    j = 0
+    if i != 0:
+        plan.append((False, 0, i))
+
+    while i < n and j < m:
+        lt = left[i]
+        rt = right[j]
+        if lt < rt:
+            k = bisect.bisect_left(left, rt, i, n)
+            plan.append((False, i, k))
+            i = k
+        elif rt < lt:
+            k = bisect.bisect_left(right, lt, j, m)
+            plan.append((True, j, k))
+            j = k
+        else:
+            if duplicates == "error":
+                raise ValueError('Both contain data for %s' % lt)
+            elif duplicates == "left":
+                plan.append((False, i, i + 1))
+            else:
+                plan.append((True, j, j + 1))
+            i += 1
+            j += 1
+
+    if i < n:
+        plan.append((False, i, n))
+    if j < m:
+        plan.append((True, j, m))
+
+    return plan
+
+
+def _applyPlan(plan, left, right):
+    """ Build a merged list from a plan made by _mergePlan. """
+    merged = []
+    for is_right, start, stop in plan:
+        source = right if is_right else left
+        if stop - start == 1:
+            merged.append(source[start])
+        else:
+            merged.extend(source[start:stop])
+    return merged
+
+
+def mergeNVarSets(sets, duplicates="right"):
+    """
+    Merge a list of NVarSets with the same variables (such as the sets of
+    consecutive flights) into one new NVarSet, see NVarSet.merge.
+    """
+    if len(sets) == 0:
+        raise ValueError('mergeNVarSets needs at least one NVarSet')
+
+    merged = sets[0]
+    for nset in sets[1:]:
+        merged = merged.merge(nset, duplicates=duplicates)
+
+    if len(sets) == 1:
+        merged = merged.merge([], duplicates=duplicates)
+    return merged
+
+
+def _alignPositions(source, target):
+    """
+    For each datetime in `target`, the position of the last datetime in
+    `source` at or before it (-1 if there is none). Both lists are sorted, so
+    this is one pass over each.
+    """
+    positions = []
+    pos = -1
+    last = len(source) - 1
+    for tm in target:
+        while pos < last and source[pos + 1] <= tm:
+            pos += 1
+        positions.append(pos)
+    return positions
+
+
+def _alignValues(times, values, target, positions, method,
+                 tolerance=None, missing_value=None):
+    """
+    Values of one variable (with its own `times`) on the `target` times,
+    using the positions from _alignPositions.
+    """
+    aligned = []
+    last = len(times) - 1
+    for tm, pos in zip(target, positions):
+        value = missing_value
+
+        if method == "asof":
+            if pos != -1 and (tolerance is None or
+                              tm - times[pos] <= tolerance):
+                value = values[pos]
+
+        elif method == "nearest":
+            best = pos
+            if pos < last and (pos == -1 or
+                               times[pos + 1] - tm < tm - times[pos]):
+                best = pos + 1
+            if best != -1 and (tolerance is None or
+                               abs(times[best] - tm) <= tolerance):
+                value = values[best]
+
+        elif method == "linear":
+            if pos != -1 and times[pos] == tm:
+                value = values[pos]
+            elif pos != -1 and pos < last:
+                before = values[pos]
+                after = values[pos + 1]
+                span = times[pos + 1] - times[pos]
+                if (before is not None and after is not None and
+                    before != missing_value and after != missing_value and
+                    (tolerance is None or span <= tolerance)):
+                    weight = ((tm - times[pos]).total_seconds() /
+                              span.total_seconds())
+                    value = before + (after - before) * weight
+
+        else:
+            raise ValueError('method must be "asof", "nearest" or "linear"')
+
+        aligned.append(value)
+    return aligned
+
+
+def alignNVarSets(sets, times=None, method="asof", tolerance=None,
+                  missing_value=None):
+    """
+    Align the variables of several NVarSets (of any sample rates) onto one
+    time base, returning a new NVarSet with every variable in order. Each
+    variable is aligned on its own timestamps, so sets whose columns do not
+    share a time axis are still correct. `times` is a sorted list of
+    datetimes and defaults to the times of the first set.
+
+    The methods are "asof" (the last value at or before each time),
+    "nearest" (the closest value, the earlier one on a tie) and "linear"
+    (linear interpolation between the samples either side). Times with no
+    value, or further than the timedelta `tolerance` from one, get
+    `missing_value`.
+    """
+    if len(sets) == 0:
+        raise ValueError('alignNVarSets needs at least one NVarSet')
+
+    if times is None:
+        times = sets[0]._time._times[:]
+
+    variables = []
+    for nset in sets:
+        variables += [nset.getNVar(name) for name in nset.keys()]
+
+    names = [var.name for var in variables]
+    if len(set(names)) != len(names):
+        raise ValueError('alignNVarSets: variable names must be unique, '
+                         'got %s' % names)
+
+    aligned = NVarSet(names)
+    plans = {}
+    for var in variables:
+        var_times = var._times[:]
+
+        ## Variables from the same set normally share their times, so only
+        ## work out the positions once per distinct time axis.
+        key = (len(var_times), var_times[0] if var_times else None,
+               var_times[-1] if var_times else None)
+        if key not in plans or plans[key][0] != var_times:
+            plans[key] = (var_times, _alignPositions(var_times, times))
+
+        values = _alignValues(var_times, var._values[:], times,
+                              plans[key][1], method,
+                              tolerance=tolerance,
+                              missing_value=missing_value)
+        aligned.getNVar(var.name)._appendSorted(times, values)
+
+    return aligned
+
+
 def createOrderedListFromFile(file_name):
     nfile = NRTFile(file_name)
     olist = NVarSet(nfile.labels[1:])
@@ -86,6 +302,14 @@ class NVarSet(OrderedDict):
         variable listed as a parameter.
         """
         self._str = None
+        self._aggregators = []  # [(column position, aggregator), ...]
+        self._rollups = OrderedDict()  # {period: NRollup}
+        self._gap_threshold = None  # Set by indexGaps
+        self._gap_befores = array('d')  # Epoch of the last row before each
+        self._gap_afters = array('d')  # and of the first row after it
+        self._gap_last = None  # Epoch of the last row indexed
+        self._missing_values = None  # Set by maskMissing
+        self._block_size = None  # Set by compress
 
         def _isNVar():
             var_list = []
@@ -117,18 +341,20 @@ class NVarSet(OrderedDict):
 
     def __getitem__(self, item):
         if isinstance(item, slice):
-            data = []
-
             start, stop = self.__sliceToIndex(item)
-            for counter in xrange(start, stop):
-                data += (self.__getLine(pos=counter, add_time=False), )
-
-            return data
+            columns = self.columns(start, stop, times=False)
+            if len(columns) == 0:  # No variables in use
+                return [()] * len(self._time.epochs(start, stop))
+            return zip(*columns)
 
         else:
             return self.__getLine(pos=item, add_time=False)
 
-    def sliceWithTime(self, *args):
+    def sliceWithTime(self, *args, **kwds):
+        """
+        Rows of (datetime, value, ...) for a stop or start, stop slice. With
+        epoch=True the times are epoch seconds instead (see toEpoch).
+        """
         if len(args) == 1:
             slc = slice(None, args[0], None)
         elif len(args) == 2:
@@ -136,13 +362,25 @@ class NVarSet(OrderedDict):
         else:
             raise ValueError('sliceWithTime only accepts stop '
                              'or start, stop arguments')
-        data = []
 
         start, stop = self.__sliceToIndex(slc)
-        for counter in xrange(start, stop):
-            data += (self.__getLine(pos=counter, add_time=True), )
+        if kwds.get('epoch', False):
+            times = self._time.epochs(start, stop)
+        else:
+            times = self._time._times[start:stop]
+        return zip(times, *self.columns(start, stop, times=False))
 
-        return data
+    def columns(self, start=0, stop=None, times=True):
+        """
+        The data of the positions `start` to `stop` a column at a time, as
+        (epoch seconds, [values of each variable]) or with times=False just
+        the values. This is what "batch" algorithms are given.
+        """
+        values = [OrderedDict.__getitem__(self, var)._values[start:stop]
+                  for var in OrderedDict.__iter__(self)]
+        if not times:
+            return values
+        return self._time.epochs(start, stop), values
 
     def __getLine(self, pos=None, add_time=False):
         if add_time is False:
@@ -170,7 +408,7 @@ class NVarSet(OrderedDict):
                     start = item.start
 
         if isinstance(item.stop, datetime.datetime):
-            stop = self._pos_of_date[item.stop]
+            stop = self._time.getPosFromTime(item.stop)
         else:
             if item.stop is None:
                 stop = len(self._time)
@@ -185,14 +423,281 @@ class NVarSet(OrderedDict):
     def addData(self, data):
         """
         Adds data to the set. Must match the variable order of the set and the
-        number of variables in the set.
+        number of variables in the set. The rows start with a datetime or
+        with epoch seconds (see toEpoch).
         """
         if len(data) != 0:
-            pos = 1
-            for var in OrderedDict.__iter__(self):
-                (OrderedDict.__getitem__(self, var).
-                 addData([(column[0], column[pos]) for column in data]))
-                pos += 1
+            times = [row[0] for row in data]
+            epoch = not isinstance(times[0], datetime.datetime)
+            ## Take the rows apart before any column changes, and the shared
+            ## times are checked before any values are added, so a bad row
+            ## leaves the set as it was.
+            variables = [OrderedDict.__getitem__(self, name)
+                         for name in OrderedDict.__iter__(self)]
+            columns = [[row[pos + 1] for row in data]
+                       for pos in xrange(len(variables))]
+            for var, values in zip(variables, columns):
+                var._appendSorted(times, values, epoch)
+
+            ## Only the aggregators and rollups need datetimes.
+            if epoch and (len(self._aggregators) != 0 or
+                          len(self._rollups) != 0):
+                data = [(fromEpoch(row[0]),) + tuple(row[1:])
+                        for row in data]
+
+            if len(self._aggregators) != 0:
+                for row in data:
+                    self.feedAggregators(row[0], row[1:])
+
+            if len(self._rollups) != 0:
+                names = self.keys()
+                for rollup in self._rollups.itervalues():
+                    rollup.addRows(data, names)
+
+            if self._gap_threshold is not None:
+                self._indexGaps(self._time.epochs(len(self._time) -
+                                                  len(data)))
+
+    def indexGaps(self, threshold):
+        """
+        Keep an index of the gaps in the data longer than `threshold` (a
+        timedelta, such as a few times the DataRate), which are satcom
+        outages in live data. The rows already in the set are indexed now,
+        the rest by addData.
+        """
+        self._gap_threshold = threshold
+        self._gap_befores = array('d')
+        self._gap_afters = array('d')
+        self._gap_last = None
+        self._indexGaps(self._time.epochs())
+
+    def _indexGaps(self, epochs):
+        threshold = self._gap_threshold.total_seconds()
+        last = self._gap_last
+        for seconds in epochs:
+            if last is not None and seconds - last > threshold:
+                self._gap_befores.append(last)
+                self._gap_afters.append(seconds)
+            last = seconds
+        self._gap_last = last
+
+    def gaps(self, start=None, stop=None, min_length=None):
+        """
+        The gaps found since indexGaps as (last time before, first time
+        after) tuples, oldest first: those that overlap the datetimes
+        `start` to `stop` (by default all of them) and, with `min_length`,
+        are at least that long. A gap is only known once data is back, so
+        one of gaps(tm, tm) ending at `tm` is an outage that has just ended.
+        Rows added to a gap by insertData shorten or remove it.
+        """
+        befores = self._gap_befores
+        afters = self._gap_afters
+
+        ## The gaps do not overlap, so both ends are in order.
+        lo = 0
+        if start is not None:
+            lo = bisect.bisect_left(afters, toSeconds(start))
+        hi = len(befores)
+        if stop is not None:
+            hi = bisect.bisect_right(befores, toSeconds(stop))
+        if min_length is not None:
+            min_length = min_length.total_seconds()
+
+        gaps = []
+        for pos in xrange(lo, hi):
+            if min_length is None or afters[pos] - befores[pos] >= min_length:
+                gaps.append((fromEpoch(befores[pos]), fromEpoch(afters[pos])))
+        return gaps
+
+    def insertData(self, data):
+        """
+        Add rows in the format of addData that can be before the last row of
+        the set, such as rows that arrive late from inside a satcom outage.
+        Rows at times already in the set are left out. The columns are
+        rebuilt in place, so the rows after the first one added move to new
+        positions (see NAlgorithm.resume). The rollups and the gap index are
+        updated; the aggregators, which take values in time order, are not.
+        Returns the number of rows added.
+        """
+        if len(data) == 0:
+            return 0
+        rows = sorted(data, key=lambda x: x[0])
+        times = [row[0] for row in rows]
+        if isinstance(times[0], datetime.datetime):
+            times = [toSeconds(tm) for tm in times]
+
+        epochs = self._time.epochs()
+        if len(epochs) == 0 or times[0] > epochs[-1]:
+            self.addData(rows)
+            return len(rows)
+
+        plan = _mergePlan(epochs, times, duplicates="left")
+        variables = [OrderedDict.__getitem__(self, name)
+                     for name in OrderedDict.__iter__(self)]
+        columns = [[row[pos + 1] for row in rows]
+                   for pos in xrange(len(variables))]
+        if not any(var is self._time for var in variables):
+            ## The times of an NLazyVarSet
+            variables.append(self._time)
+            columns.append([None] * len(rows))
+
+        for var, column in zip(variables, columns):
+            values = _applyPlan(plan, var._values[:], column)
+            if var.compressed:
+                var._values = NValueColumn(values, var._values.block_size)
+            else:
+                var._values = values
+            if var._valid is not None:
+                var.maskMissing(var._missing_value)
+        self._time._times.setEpochs(_applyPlan(plan, epochs, times))
+
+        added = []  # [(epoch, row), ...]
+        for is_right, start, stop in plan:
+            if is_right:
+                added.extend(zip(times[start:stop], rows[start:stop]))
+        if len(self._rollups) != 0:
+            added_rows = [(fromEpoch(tm),) + tuple(row[1:])
+                          for tm, row in added]
+            names = self.keys()
+            for rollup in self._rollups.itervalues():
+                rollup.addRows(added_rows, names)
+
+        if self._gap_threshold is not None:
+            self.indexGaps(self._gap_threshold)
+        return len(added)
+
+    def maskMissing(self, missing_values):
+        """
+        Keep a validity mask of every variable (see NVar.maskMissing), with
+        `missing_values` the bad data flags keyed on the variable name in
+        any case, as from NDatabase.getBadDataValues.
+        """
+        self._missing_values = dict([(name.lower(), value)
+                                     for name, value
+                                     in missing_values.iteritems()])
+        for name in OrderedDict.__iter__(self):
+            OrderedDict.__getitem__(self, name).maskMissing(
+                self._missing_values.get(name))
+
+    def missingCounts(self, start=0, stop=None):
+        """
+        {variable: number of missing values} over the positions `start` to
+        `stop`, from the masks of maskMissing.
+        """
+        return dict([(name, OrderedDict.__getitem__(self, name).
+                              missingCount(start, stop))
+                     for name in OrderedDict.__iter__(self)])
+
+    def compress(self, block_size=1024):
+        """
+        Keep the data of every variable compressed, `block_size` rows to a
+        block (see NVar.compress), so a set of every variable over a whole
+        flight fits in memory. Rows added afterwards are compressed a block
+        at a time.
+        """
+        if self._block_size is not None:
+            return
+        self._block_size = block_size
+        self._time.compress(block_size)
+        for name in OrderedDict.__iter__(self):
+            OrderedDict.__getitem__(self, name).compress(block_size)
+
+    @property
+    def size(self):
+        """ Bytes of the compressed data (an estimate), None if it is not. """
+        if self._block_size is None:
+            return None
+        return self._time._times.size + sum(
+            [OrderedDict.__getitem__(self, name)._values.size
+             for name in OrderedDict.__iter__(self)])
+
+    def attachRollups(self, periods=ROLLUP_PERIODS, missing_values=None):
+        """
+        Keep a stats.NRollup of every variable for each of the `periods`,
+        starting with the data already in the set and updated by every
+        addData. `missing_values` are the bad data flags to leave out, as
+        from NDatabase.getBadDataValues.
+        """
+        data = self.sliceWithTime(None, None)
+        for period in periods:
+            rollup = NRollup(period, self.keys(), missing_values)
+            rollup.addRows(data)
+            self._rollups[period] = rollup
+
+    def getRollup(self, period):
+        """ The NRollup for `period`, for overviews of the set. """
+        try:
+            return self._rollups[period]
+        except KeyError:
+            raise KeyError('%s: no rollup attached for %s'
+                           % (self.__class__.__name__, period))
+
+    @property
+    def rollups(self):
+        """ The attached NRollups, shortest period first. """
+        return sorted(self._rollups.values(), key=lambda x: x.period)
+
+    def attachAggregator(self, name, aggregator):
+        """
+        Attach an incremental aggregator (see the stats module) to a column.
+        Every row that passes through the set afterwards is added to it. The
+        aggregator is returned so it can be stored by the caller.
+        """
+        try:
+            pos = self.keys().index(name.lower())
+        except ValueError:
+            raise KeyError('%s: no variable named %s in set'
+                           % (self.__class__.__name__, name))
+
+        self._aggregators.append((pos, aggregator))
+        return aggregator
+
+    def fillData(self, data, names):
+        """
+        Set the values of the variables `names` from rows of (datetime,
+        value, ...) at times already in the set, such as to fill in values
+        that were None when their rows were added. The rows can start with
+        epoch seconds instead, as for addData. Rows at other times are left
+        out. The rollups are updated; the aggregators, which take values in
+        time order, are not. Returns the time of the last row used, as
+        given, None if there was none.
+        """
+        if len(data) == 0:
+            return None
+        length = len(self._time)
+        if isinstance(data[0][0], datetime.datetime):
+            find = self._time._times.find
+        else:
+            find = self._time._times.findEpoch
+
+        positions = []
+        rows = []
+        for row in data:
+            pos = find(row[0])
+            if pos != -1 and pos < length:
+                positions.append(pos)
+                rows.append(row)
+        if len(rows) == 0:
+            return None
+
+        times = None
+        if len(self._rollups) != 0:
+            times = [self._time._times[pos] for pos in positions]
+        for pos, name in enumerate(names):
+            var = OrderedDict.__getitem__(self, name.lower())
+            values = [row[pos + 1] for row in rows]
+            var._setPositions(positions, values)
+            for rollup in self._rollups.itervalues():
+                rollup.addValues(name, times, values)
+        return rows[-1][0]
+
+    def feedAggregators(self, tm, line):
+        """
+        Add one row (without the datetime) to the attached aggregators. This
+        is done by addData and by NAlgorithm for each point it processes.
+        """
+        for pos, aggregator in self._aggregators:
+            aggregator.add(tm, line[pos])
 
     @property
     def labels(self):
@@ -202,6 +707,198 @@ class NVarSet(OrderedDict):
     def getNVar(self, name):
         return OrderedDict.__getitem__(self, name)
 
+    def __add__(self, other):
+        return self.merge(other)
+
+    def join(self, other, method="asof", tolerance=None,
+                   missing_value=None):
+        """
+        Join with another NVarSet (which can have a different sample rate)
+        on the times of this set, returning a new NVarSet with the variables
+        of both. See alignNVarSets for the methods.
+        """
+        return alignNVarSets([self, other], method=method,
+                             tolerance=tolerance,
+                             missing_value=missing_value)
+
+    def resample(self, period, method="linear", start=None, stop=None,
+                       tolerance=None, missing_value=None):
+        """
+        Resample the set onto regular times `period` (a timedelta) apart,
+        from `start` (default first time) up to and including `stop`
+        (default last time). See alignNVarSets for the methods.
+        """
+        if period <= datetime.timedelta(0):
+            raise ValueError('%s: period must be positive'
+                             % self.__class__.__name__)
+
+        if len(self._time) == 0:
+            return alignNVarSets([self], times=[])
+
+        if start is None:
+            start = self._time.getTimeFromPos(0)
+        if stop is None:
+            stop = self._time.getTimeFromPos(-1)
+
+        times = []
+        tm = start
+        while tm <= stop:
+            times.append(tm)
+            tm += period
+
+        return alignNVarSets([self], times=times, method=method,
+                             tolerance=tolerance,
+                             missing_value=missing_value)
+
+    def merge(self, other, duplicates="right"):
+        """
+        Merge with another NVarSet holding the same variables, or with a list
+        of rows in the format of addData, into a new NVarSet sorted by
+        datetime. The times are merged once in a single linear pass and every
+        column follows the same plan; see NVar.merge for `duplicates`.
+        """
+        names = self.keys()
+        left_times = self._time._times[:]
+
+        if isinstance(other, NVarSet):
+            if sorted(other.keys()) != sorted(names):
+                raise ValueError('%s: can only merge sets with the same '
+                                 'variables' % self.__class__.__name__)
+            right_times = other._time._times[:]
+            right_columns = [other.getNVar(name)._values[:]
+                             for name in names]
+        else:
+            rows = list(other)
+            if any(rows[pos][0] > rows[pos + 1][0]
+                   for pos in xrange(len(rows) - 1)):
+                rows.sort(key=lambda x: x[0])
+            right_times = [row[0] for row in rows]
+            right_columns = [[row[pos] for row in rows]
+                             for pos in xrange(1, len(names) + 1)]
+
+        plan = _mergePlan(left_times, right_times, duplicates)
+        times = _applyPlan(plan, left_times, right_times)
+
+        merged = NVarSet(names)
+        for name, right_values in zip(names, right_columns):
+            values = _applyPlan(plan, self.getNVar(name)._values[:],
+                                right_values)
+            merged.getNVar(name)._appendSorted(times, values)
+
+        return merged
+
+
+class NLazyVarSet(NVarSet):
+    """
+    An NVarSet that knows the names of all of its variables but only fetches
+    and stores a variable once it is first used through getNVar (as
+    NWatcher.resetAlgos does for the attached algorithms). Until then the
+    variable costs no memory, and as keys() only lists the variables in use,
+    NDatabaseLiveUpdater does not fetch it either.
+
+    The history of a variable is filled in when it is first used with
+    `backfill(names, start_time)`, which must return rows of
+    (datetime or epoch seconds, value, ...) for `names` from the datetime
+    `start_time` on, such as
+    NDatabase.getData or a reader of an archived flight file. Times the
+    backfill has no row for are None.
+
+    Only the variables in use are checked by anything that goes through
+    keys(), such as maskMissing and missingCounts; a variable that is never
+    used is never looked at.
+    """
+
+    def __init__(self, names, backfill, active=()):
+        ## The times of every row added, whichever variables are in use, are
+        ## kept in a variable of their own that is not in the set.
+        NVarSet.__init__(self, ['datetime'])
+        OrderedDict.clear(self)
+        self._backfill = backfill
+        self.names = tuple([name.lower() for name in names])
+        self._str = str(list(self.names))
+
+        if len(active) != 0:
+            self.materialize(active)
+
+    def isMaterialized(self, name):
+        """ True if the variable is being fetched and stored. """
+        return OrderedDict.__contains__(self, name.lower())
+
+    def materialize(self, names):
+        """
+        Start storing the variables in `names`, backfilling their history in
+        one request.
+        """
+        names = [name.lower() for name in names
+                 if not self.isMaterialized(name)]
+        for name in names:
+            if name not in self.names:
+                raise KeyError('%s: no variable named %s in set'
+                               % (self.__class__.__name__, name))
+        if len(names) == 0:
+            return
+
+        epochs = self._time.epochs()
+        rows = []
+        if len(epochs) != 0:
+            rows = sorted(self._backfill(names, fromEpoch(epochs[0])),
+                          key=lambda x: x[0])
+
+        row_times = [row[0] for row in rows]
+        if len(rows) != 0 and isinstance(row_times[0], datetime.datetime):
+            row_times = [toSeconds(tm) for tm in row_times]
+        positions = _alignPositions(row_times, epochs)
+        times = None
+        if len(self._rollups) != 0:
+            times = self._time._times[:len(epochs)]
+        for pos, name in enumerate(names):
+            ## Only take values at exactly the times already in the set, so
+            ## every column keeps the same positions.
+            values = _alignValues(row_times, [row[pos + 1] for row in rows],
+                                  epochs, positions, "asof", tolerance=0)
+            var = NVar(name)
+            var._times = self._time._times  # The same times
+            if self._block_size is not None:
+                var.compress(self._block_size)
+            if self._missing_values is not None:
+                var.maskMissing(self._missing_values.get(name))
+            var._appendSorted(epochs, values, epoch=True)
+            OrderedDict.__setitem__(self, name, var)
+            for rollup in self._rollups.itervalues():
+                rollup.addColumn(name, times, values)
+
+    def materializeAll(self):
+        """
+        Fetch and store every variable, for example to write a file. The
+        variables are then in the order of `names`, as in an NVarSet.
+        """
+        self.materialize(self.names)
+
+        order = self.keys()
+        variables = [(name, OrderedDict.__getitem__(self, name))
+                     for name in self.names]
+        OrderedDict.clear(self)
+        for name, var in variables:
+            OrderedDict.__setitem__(self, name, var)
+        self._aggregators = [(self.names.index(order[pos]), aggregator)
+                             for pos, aggregator in self._aggregators]
+
+    def addData(self, data):
+        """
+        Adds data to the set, in the format of NVarSet.addData for the
+        variables in use.
+        """
+        if len(data) != 0:
+            self._time._appendSorted(
+                [row[0] for row in data], [None] * len(data),
+                not isinstance(data[0][0], datetime.datetime))
+            NVarSet.addData(self, data)
+
+    def getNVar(self, name):
+        if not self.isMaterialized(name):
+            self.materialize([name])
+        return OrderedDict.__getitem__(self, name.lower())
+
 
 class NVar(OrderedDict):
     """
@@ -209,31 +906,79 @@ class NVar(OrderedDict):
     dictionary where the datetime is the key. It will also ordered, so using an
     integer as the key will give the Nth value in the list. Only accepts one
     data value per datetime.
+
+    The times are in increasing order, kept as epoch seconds (to the
+    microsecond once one has a fraction) in an NTimeColumn, so nothing is
+    stored in the dictionary itself and the datetime keys are made as they
+    are asked for.
     """
 
     def __init__(self, name=None):
         self.name = name.lower()
-        self._time_of_pos = {}  # {position: datetime}
-        self._pos_of_time = {}  # {datetime: position}
+        self._times = NTimeColumn()  # Times by position, can be shared
+        self._values = []  # Values by position
+        self._valid = None  # Validity mask by position, see maskMissing()
+        self._missing_value = None
         super(NVar, self).__init__()
 
     def __getitem__(self, item):
         if isinstance(item, slice):
-            data = []
-
             start, stop = self.__sliceToIndex(item)
-            for point in xrange(start, stop):
-                data += [self.__getitem__(point)]
-
-            return data
-        if isinstance(item, int):
-            if item < 0:
-                return (OrderedDict.__getitem__(self,
-                        self._time_of_pos[(OrderedDict.__len__(self)) + item]))
-            else:
-                return OrderedDict.__getitem__(self, self._time_of_pos[item])
-        else:
-            return OrderedDict.__getitem__(self, item)
+            return self._values[start:stop]
+        if isinstance(item, (int, long)):
+            try:
+                return self._values[item]
+            except IndexError:
+                raise KeyError(item)
+        return self._values[self.getPosFromTime(item)]
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, tm):
+        pos = self._times.find(tm)
+        return pos != -1 and pos < len(self._values)
+
+    def __iter__(self):
+        return iter(self._times[:len(self._values)])
+
+    def __reversed__(self):
+        return reversed(self._times[:len(self._values)])
+
+    def get(self, tm, default=None):
+        try:
+            return self[tm]
+        except KeyError:
+            return default
+
+    def has_key(self, tm):
+        return tm in self
+
+    def __eq__(self, other):
+        if isinstance(other, NVar):
+            return (len(self) == len(other) and
+                    self.epochs() == other.epochs() and
+                    self._values[:] == other._values[:])
+        if isinstance(other, OrderedDict):
+            return self.items() == other.items()
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def compressed(self):
+        return isinstance(self._values, NValueColumn)
+
+    def compress(self, block_size=1024):
+        """
+        Keep the values in the compressed column of encoding.py instead of a
+        list, `block_size` values to a block (the times are always kept in
+        an NTimeColumn).
+        """
+        if self.compressed:
+            return
+        self._values = NValueColumn(self._values, block_size)
 
     def sliceWithTime(self, *args):
         if len(args) == 1:
@@ -244,59 +989,138 @@ class NVar(OrderedDict):
             raise ValueError('sliceWithTime only accepts '
                              'stop or start, stop arguments')
 
-        data = []
-
         start, stop = self.__sliceToIndex(slc)
-        for point in xrange(start, stop):
-            data += [(self.getTimeFromPos(point), self.__getitem__(point))]
+        return zip(self._times[start:stop], self._values[start:stop])
 
-        return data
+    def epochs(self, start=0, stop=None):
+        """
+        The times of the positions `start` to `stop` as epoch seconds, see
+        encoding.NTimeColumn.epochs.
+        """
+        start, stop, step = slice(start, stop).indices(len(self._values))
+        return self._times.epochs(start, max(start, stop))
+
+    def maskMissing(self, missing_value):
+        """
+        Keep a validity mask of the values, a bytearray with a 0 for each
+        value that is `missing_value` (the variable's bad data flag) and a 1
+        for the others. Values are only compared with the flag once, as
+        they are added, and the counts, runs and valid values of any window
+        then come from the mask. NULL values (None) are not missing data
+        in this sense, as for the watcher's bad data checks.
+        """
+        self._missing_value = missing_value
+        self._valid = bytearray()
+        self._maskValues(self._values)
+
+    def _maskValues(self, values):
+        missing_value = self._missing_value
+        self._valid.extend([value is None or value != missing_value
+                            for value in values])
+
+    def __maskRange(self, start, stop):
+        if self._valid is None:
+            raise ValueError('%s: %s has no missing value mask'
+                             % (self.__class__.__name__, self.name))
+        start, stop, step = slice(start, stop).indices(len(self._valid))
+        return start, max(start, stop)
+
+    def isMissing(self, pos):
+        """ Whether the value at the position `pos` is missing. """
+        self.__maskRange(0, None)
+        return self._valid[pos] == 0
+
+    def missingCount(self, start=0, stop=None):
+        """ The number of missing values in the positions start to stop. """
+        start, stop = self.__maskRange(start, stop)
+        return self._valid.count('\x00', start, stop)
+
+    def missingRuns(self, start=0, stop=None):
+        """
+        The runs of missing values in the positions `start` to `stop`, as
+        (first position, position after) tuples.
+        """
+        start, stop = self.__maskRange(start, stop)
+        valid = self._valid
+        runs = []
+        pos = start
+        while pos < stop:
+            first = valid.find('\x00', pos, stop)
+            if first == -1:
+                break
+            pos = valid.find('\x01', first, stop)
+            if pos == -1:
+                pos = stop
+            runs.append((first, pos))
+        return runs
+
+    def validValues(self, start=0, stop=None):
+        """
+        The values in the positions `start` to `stop` that are neither
+        missing nor None, such as for statistics.
+        """
+        start, stop = self.__maskRange(start, stop)
+        return [value for value in
+                itertools.compress(self._values[start:stop],
+                                   self._valid[start:stop])
+                if value is not None]
 
     def __sliceToIndex(self, item):
         start = stop = None
 
         if isinstance(item.start, datetime.datetime):
-            start = self._pos_of_time[item.start]
+            start = self.getPosFromTime(item.start)
         else:
             if item.start is None:
                 start = 0
             else:
                 if item.start < 0:
-                    start = OrderedDict.__len__(self) + item.start
+                    start = len(self._values) + item.start
                 else:
                     start = item.start
 
         if isinstance(item.stop, datetime.datetime):
-            stop = self._pos_of_time[item.stop]
+            stop = self.getPosFromTime(item.stop)
         else:
             if item.stop is None:
-                stop = OrderedDict.__len__(self)
+                stop = len(self._values)
             else:
                 if item.stop < 0:
-                    stop = OrderedDict.__len__(self) + item.stop
+                    stop = len(self._values) + item.stop
                 else:
                     stop = item.stop
 
         return start, stop
 
     def __add__(self, y):
-        data = []
+        return self.merge(y)
 
+    def merge(self, y, duplicates="right"):
+        """
+        Merge with another NVar of the same name, or a list of
+        (datetime, value) tuples, into a new NVar sorted by datetime. Both are
+        already in time order so this is a single linear pass, and just a
+        copy when one lies entirely after the other.
+
+        `duplicates` decides what happens when both have a value for the
+        same datetime: "right" keeps the value of `y`, "left" keeps the value
+        of this NVar and "error" raises a ValueError.
+        """
         name = None
         x_name = self.name
         y_name = None
 
-        for k, v in self.iteritems():
-            data += [(k, v)]
-
         if isinstance(y, NVar):
             y_name = y.name
-            for k, v in y.iteritems():
-                data += [(k, v)]
+            y_times = y._times[:len(y._values)]
+            y_values = y._values[:]
         else:
-            data += y
-
-        data.sort(key=lambda x: x[0])
+            y = list(y)
+            if any(y[pos][0] > y[pos + 1][0]
+                   for pos in xrange(len(y) - 1)):
+                y.sort(key=lambda x: x[0])
+            y_times = [row[0] for row in y]
+            y_values = [row[1] for row in y]
 
         if x_name == y_name and (x_name is not None and y_name is not None):
             name = x_name
@@ -307,20 +1131,25 @@ class NVar(OrderedDict):
         else:
             raise ValueError('NVar: can only add NVars of the same name.')
 
-        if name is not None:
-            var = NVar(name)
-            var.addData(data)
-            return var
+        x_times = self._times[:len(self._values)]
+        plan = _mergePlan(x_times, y_times, duplicates)
+        var = NVar(name)
+        var._appendSorted(_applyPlan(plan, x_times, y_times),
+                          _applyPlan(plan, self._values[:], y_values))
+        return var
 
     def getTimeFromPos(self, index):
         """ Returns the date associated with an integer index. """
-        if index < 0:
-            return self._time_of_pos[(OrderedDict.__len__(self)) + index]
-        else:
-            return self._time_of_pos[index]
+        try:
+            return self._times[index]
+        except IndexError:
+            raise KeyError(index)
 
     def getPosFromTime(self, tm):
-        return self._pos_of_time[tm]
+        pos = self._times.find(tm)
+        if pos == -1 or pos >= len(self._values):
+            raise KeyError(tm)
+        return pos
 
     def addData(self, data=[]):
         """
@@ -342,7 +1171,41 @@ class NVar(OrderedDict):
             raise ValueError('NVar: Data must be formatted as '
                              '[(datetime, value), ...]')
 
-        for row in data:
-            self._time_of_pos[OrderedDict.__len__(self)] = row[0]
-            self._pos_of_time[row[0]] = OrderedDict.__len__(self)
-            OrderedDict.__setitem__(self, row[0], row[1])
+        self._appendSorted([row[0] for row in data],
+                           [row[1] for row in data])
+
+    def _setValues(self, times, values):
+        """
+        Change the values at the datetimes `times`, which must be there.
+        """
+        self._setPositions([self.getPosFromTime(tm) for tm in times], values)
+
+    def _setPositions(self, positions, values):
+        """ Change the values at `positions`. """
+        if self.compressed:
+            self._values.setValues(positions, values)
+        else:
+            for pos, value in zip(positions, values):
+                self._values[pos] = value
+
+        if self._valid is not None:
+            missing_value = self._missing_value
+            for pos, value in zip(positions, values):
+                self._valid[pos] = value is None or value != missing_value
+
+    def _appendSorted(self, times, values, epoch=False):
+        """
+        Add already checked data, as lists of datetimes (or with `epoch` of
+        epoch seconds) and values that come after any data already in the
+        variable.
+        """
+        ## The times are shared, so only the first variable of a set to get
+        ## the rows adds them.
+        if len(self._times) == len(self._values):
+            if epoch:
+                self._times.extendEpochs(times)
+            else:
+                self._times.extend(times)
+        self._values.extend(values)
+        if self._valid is not None:
+            self._maskValues(values)
@@ -17,6 +17,7 @@
 #### Intrapackage
 import datafile
 import data
+from catalog import NCatalog, NCatalogCache
 
 ## PostGreSQL module, http://www.initd.org/psycopg/
 import psycopg2
@@ -26,14 +27,37 @@ import datetime
 import time
 import random
 
+## Searching the replay table
+import bisect
+import re
+
+## Waiting for notifications
+import select
+
 ## Used for sys.stderr
 import sys
+import os
 
 import math
 
 ## Unload server at program exit.
 import atexit
 
+## Channel notified by the trigger installNotifyTrigger() puts on raf_lrt, and
+## the name of that trigger.
+NOTIFY_CHANNEL = "raf_lrt"
+_NOTIFY_TRIGGER = "raf_lrt_notify"
+
+## Rows fetched at once while catching up on missed data, by default (an
+## hour at a DataRate of three seconds).
+CATCHUP_ROWS = 1200
+
+## Units understood when an interval such as "-60 MINUTE" is answered from
+## the replay table instead of the server.
+_INTERVAL_UNITS = {'second': 'seconds', 'sec': 'seconds',
+                   'minute': 'minutes', 'min': 'minutes',
+                   'hour': 'hours', 'day': 'days'}
+
 ## --------------------------------------------------------------------------
 ## Functions
 ## --------------------------------------------------------------------------
@@ -44,6 +68,7 @@ def __ending__(server):
         server._conn.close()
     except:
         pass
+    server._closeListener()
 
     if server._simulate_start_db is not None and server._running is True:
         try:
@@ -64,6 +89,83 @@ def __ending__(server):
     server._running = False
 
 
+def _parseInterval(interval):
+    """
+    Turn a SQL style interval string ("-60 MINUTE") into a timedelta. Returns
+    None if the string is not understood.
+    """
+    match = re.match(r"^\s*([+-])\s*(\d+(?:\.\d*)?)\s*([a-zA-Z]+)\s*$",
+                     interval)
+    if match is None:
+        return None
+
+    sign, amount, unit = match.groups()
+    unit = unit.lower()
+    if unit.endswith('s'):
+        unit = unit[:-1]
+    if unit not in _INTERVAL_UNITS:
+        return None
+
+    delta = datetime.timedelta(**{_INTERVAL_UNITS[unit]: float(amount)})
+    return -delta if sign == '-' else delta
+
+
+def _parseTimestamp(timestamp):
+    """
+    Turn a SQL style timestamp string into a datetime. Returns None if the
+    string is not understood.
+    """
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M:%S.%f'):
+        try:
+            return datetime.datetime.strptime(timestamp.strip(), fmt)
+        except ValueError:
+            pass
+    return None
+
+
+def _parseSampleRates(rows):
+    """
+    Turn (name, sampleratetable) rows into {name: rate in Hz}, leaving out
+    rows without a rate.
+    """
+    rates = {}
+    for name, table in rows:
+        match = re.search(r"(\d+)\s*$", table or "")
+        if match is not None:
+            rates[name] = int(match.group(1))
+    return rates
+
+
+def _bucketComplete(times, start, stop, max_gap):
+    """
+    Whether the sorted `times` of the rows in [start, stop) are no more than
+    `max_gap` apart, counting rows just before the start and at the end of
+    the bucket. With a `max_gap` of the DataRate a single missing row is a
+    gap.
+    """
+    last = start - max_gap
+    for tm in times:
+        if tm - last > max_gap:
+            return False
+        last = tm
+    return stop - last <= max_gap
+
+
+def _sameTimes(chunks):
+    """ Whether the (times, values) `chunks` all have the same times. """
+    times = chunks[0][0]
+    for chunk in chunks[1:]:
+        if chunk[0] is not times and chunk[0] != times:
+            return False
+    return True
+
+
+def _epochRows(rows):
+    """ Rows with their datetime turned into epoch seconds. """
+    toEpoch = data.toEpoch
+    return [(toEpoch(row[0]),) + tuple(row[1:]) for row in rows]
+
+
 def _loadFile(file_path, dbname, host, user, password, dbstart):
     """
     Loads a .asc file with a header into a sql database for testing.
@@ -116,16 +218,147 @@ def _loadFile(file_path, dbname, host, user, password, dbstart):
 ## --------------------------------------------------------------------------
 
 
+class NMemoryTable(object):
+    """
+    An in memory copy of the rows of the raf_lrt table, in datetime order.
+    Used to answer NDatabase.getData queries without a round trip to the
+    server. The first label must be the datetime column.
+    """
+
+    def __init__(self, labels):
+        self.labels = tuple([label.lower() for label in labels])
+        self._column_of_label = dict([(label, pos) for pos, label
+                                      in enumerate(self.labels)])
+        self._times = []
+        self._rows = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def hasColumn(self, name):
+        return name.lower() in self._column_of_label
+
+    def addData(self, data):
+        """
+        Add rows (with the datetime first) that all come after the rows
+        already in the table.
+        """
+        for row in data:
+            if len(self._times) != 0 and row[0] <= self._times[-1]:
+                raise ValueError('%s: rows must be added in datetime order'
+                                 % self.__class__.__name__)
+            self._times.append(row[0])
+            self._rows.append(tuple(row))
+
+    def lastTime(self):
+        """ Time of the last row, None if the table is empty. """
+        return self._times[-1] if len(self._times) != 0 else None
+
+    def nextTime(self, after):
+        """ Time of the first row after `after`, None if there is none. """
+        pos = bisect.bisect_right(self._times, after)
+        return self._times[pos] if pos < len(self._times) else None
+
+    def count(self, after=None, upto=None):
+        """ Number of rows with after < datetime <= upto. """
+        lo, hi = self._bounds(after, upto)
+        return hi - lo
+
+    def select(self, variables=(), after=None, upto=None,
+                     limit=None, descending=False):
+        """
+        Rows with after < datetime <= upto as tuples of the datetime followed
+        by the requested variables. Mirrors the ORDER BY/LIMIT behaviour of
+        the SQL queries built in NDatabase.getData.
+        """
+        lo, hi = self._bounds(after, upto)
+        if descending:
+            if limit is not None:
+                lo = max(lo, hi - limit)
+            rows = reversed(self._rows[lo:hi])
+        else:
+            if limit is not None:
+                hi = min(hi, lo + limit)
+            rows = self._rows[lo:hi]
+
+        columns = [self._column_of_label[var.lower()] for var in variables]
+        return [(row[0],) + tuple([row[col] for col in columns])
+                for row in rows]
+
+    def _bounds(self, after, upto):
+        lo = (bisect.bisect_right(self._times, after)
+              if after is not None else 0)
+        hi = (bisect.bisect_right(self._times, upto)
+              if upto is not None else len(self._times))
+        return lo, max(lo, hi)
+
+
 class NDatabaseLiveUpdater(object):
     """
     Used to update the data inside an NVarSet with the newest data from the
     server. This provides easy server use without knowing server/NVar
-    functions.
+    functions. Rows are fetched with their times as epoch seconds, which is
+    how the set keeps them.
+
+    By default every variable is fetched every update. `cadences` gives
+    variables (or tuples of variables) their own: fetched every update (1),
+    every N updates (N) or only by fillAll(), such as after landing (0).
+    Variables not listed have the `default_cadence`, and if none is fetched
+    every update the first variable of the set is. Each update adds the
+    new rows with the variables fetched every update and None for the
+    rest; those are filled in when their cadence comes round, up to what
+    watermark() reports for them.
+
+    With `max_rows` no query fetches more than that many rows, so after an
+    outage (or a restart, from `start_time`) the missed rows are caught up
+    in batches, one per update without waiting in between, while `behind`
+    is True. The algorithms and the writer then keep up with each batch
+    rather than stalling on one large query.
+
+    Once caught up, each update also looks for rows that arrived late
+    inside one of the gaps of the set (see NVarSet.indexGaps), such as the
+    data of a satcom outage sent on later, fetching at most `max_rows` (or
+    CATCHUP_ROWS) of them. A gap is looked at as soon as data is back, and
+    all of them again in turn at most every `gap_sweep` updates. The rows
+    are put in place with NVarSet.insertData and kept in `late` until the
+    next update; the listeners, which take rows in time order, do not get
+    them.
     """
 
-    def __init__(self, server=None, variables=None):
+    def __init__(self, server=None, variables=None, listeners=(),
+                       cadences=None, default_cadence=1, max_rows=None,
+                       start_time=None, gap_sweep=10):
         self.server = server
-        self._last_update_time = server.getTime()
+        self._last_update_time = (start_time if start_time is not None
+                                  else server.getTime())
+        self._listeners = list(listeners)
+        self._max_rows = max_rows
+        self.behind = False  # The last query was cut off at max_rows
+        self.late = []  # Rows the last update put in a gap
+        self._gap_sweep = gap_sweep
+        self._gap_cursor = None  # Time up to which the gaps were looked at
+        self._gap_tick = 0  # Update the last look at all of them started
+
+        ## Tiered polling, {variable: cadence} and {cadence: time filled to}
+        self._cadences = {}
+        for names, cadence in (cadences or {}).iteritems():
+            if isinstance(names, basestring):
+                names = (names,)
+            for name in names:
+                self._cadences[name.lower()] = cadence
+        self._default_cadence = default_cadence
+        self._watermarks = {}
+        self._ticks = 0
+        self._tiered = (0, {}, {})  # Columns, tiers and their variables
+
+        ## Notifications seen by the last query (see NDatabase notify), and
+        ## the growing poll interval used when they are unavailable.
+        self._notifications = None
+        self._interval = None
+
+        ## Rows added and seconds spent fetching and storing them.
+        self.rows = 0
+        self.seconds = 0.0
 
         ## Get all the variables is they are not specified
         if variables is None:
@@ -138,19 +371,230 @@ class NDatabaseLiveUpdater(object):
         if current_time is None:
             self._last_update_time = current_time[0][0]
 
-    def update(self):
+    def _tiers(self):
+        """
+        {cadence: [variable, ...]} of the variables not fetched every
+        update. Worked out again when variables are added to the set.
+        """
+        if len(self._cadences) == 0 and self._default_cadence == 1:
+            return {}
+
+        names = self._vars.keys()
+        if self._tiered[0] != len(names):
+            slow = [name for name in names
+                    if self._cadences.get(name, self._default_cadence) != 1]
+            if len(slow) == len(names):
+                slow = slow[1:]  # The first is fetched every update
+
+            tiers = {}
+            cadence_of = {}
+            for name in slow:
+                cadence = self._cadences.get(name, self._default_cadence)
+                tiers.setdefault(cadence, []).append(name)
+                cadence_of[name] = cadence
+            self._tiered = (len(names), tiers, cadence_of)
+
+            ## New variables (such as materialized by an NLazyVarSet) come
+            ## with their history, but rows restored from a checkpoint may
+            ## have been saved before their tier was filled in.
+            for cadence in tiers:
+                if cadence not in self._watermarks:
+                    self._watermarks[cadence] = self._filledTo(tiers[cadence])
+        return self._tiered[1]
+
+    def _filledTo(self, names):
+        """
+        The time of the row before the first None of any of `names`, the
+        last row if there is none and None if the first row is missing.
+        """
+        first = len(self._vars._time)
+        for name in names:
+            values = self._vars.getNVar(name)[:first]
+            try:
+                first = values.index(None)
+            except ValueError:
+                pass
+        if first == 0:
+            return None
+        return self._vars._time.getTimeFromPos(first - 1)
+
+    def watermark(self, names):
+        """
+        The time up to which the data of `names` is complete, datetime.max
+        if they are all fetched every update and None if not yet known.
+        """
+        self._tiers()
+        cadence_of = self._tiered[2]
+        marks = [self._watermarks.get(cadence_of[name])
+                 for name in names if name in cadence_of]
+        if len(marks) == 0:
+            return datetime.datetime.max
+        if None in marks:
+            return None
+        return min(marks)
+
+    def fillAll(self):
+        """ Fill in every variable not fetched every update. """
+        for cadence, names in self._tiers().iteritems():
+            while self._fill(cadence, names):
+                pass
+
+    def _fill(self, cadence, names):
+        """ Returns True if there may be more to fill in (see max_rows). """
+        start = time.time()
+        start_time = self._watermarks.get(cadence)
+        if start_time is None:
+            start_time = self._vars._time.getTimeFromPos(0) - \
+                           datetime.timedelta(seconds=1)
+        rows = self.server.getData(start_time=start_time, variables=names,
+                                   number_entries=self._max_rows, epoch=True)
+        last_time = self._vars.fillData(rows, names)
+        if last_time is not None:
+            last_time = data.fromEpoch(last_time)
+            self._watermarks[cadence] = last_time
+        self.seconds += time.time() - start
+        return (self._max_rows is not None and
+                len(rows) == self._max_rows and
+                last_time is not None and last_time > start_time)
+
+    def _fetch(self):
+        """
+        New rows for every variable of the set, with None for those that
+        are not fetched this update. The rows start with epoch seconds.
+        """
+        names = self._vars.keys()
+        tiers = self._tiers()
+        if len(tiers) == 0:
+            return self.server.getData(start_time=self._last_update_time,
+                                       variables=names,
+                                       number_entries=self._max_rows,
+                                       epoch=True)
+
+        slow = set(sum(tiers.values(), []))
+        fast = [name for name in names if name not in slow]
+        rows = self.server.getData(start_time=self._last_update_time,
+                                   variables=fast,
+                                   number_entries=self._max_rows,
+                                   epoch=True)
+        positions = [fast.index(name) + 1 if name not in slow else None
+                     for name in names]
+        return [(row[0],) + tuple([row[pos] if pos is not None else None
+                                   for pos in positions])
+                for row in rows]
+
+    def update(self, blocking=True):
         """
         Update attached variables with new data, and then sleep the server so
-        it polls less frequently.
+        it polls less frequently. Returns the seconds left to wait, see
+        NDatabase.sleep.
+
+        When the server listens for notifications the query is skipped if
+        none arrived since the last one, and the wait ends as soon as one
+        arrives (a non blocking wait is 0 seconds when one is waiting, the
+        data rate otherwise). If the server was asked to listen but cannot,
+        the wait doubles after each update without data, up to the
+        server's notify_timeout, and drops back to the data rate when data
+        arrives. There is no wait while catching up (see max_rows).
         """
-        data = self.server.getData(start_time=self._last_update_time,
-                                   variables=self._vars.keys())
-
-        if len(data) != 0:
-            self._last_update_time = data[-1][0]
-            self._vars.addData(data)
-
-        self.server.sleep()
+        start = time.time()
+        rows = []
+        notifications = self.server.pollNotifications()
+        if (self.behind or notifications is None or
+            notifications != self._notifications):
+            self._notifications = notifications
+            rows = self._fetch()
+        self.behind = (self._max_rows is not None and
+                       len(rows) == self._max_rows)
+
+        if len(rows) != 0:
+            self._last_update_time = data.fromEpoch(rows[-1][0])
+            self._vars.addData(rows)
+            self.rows += len(rows)
+            if len(self._listeners) != 0:
+                names = self._vars.keys()
+                for listener in self._listeners:
+                    listener(names, rows)
+        self.seconds += time.time() - start
+
+        ## Fill in the variables whose cadence has come round.
+        self._ticks += 1
+        for cadence, names in self._tiers().iteritems():
+            if cadence > 0 and self._ticks % cadence == 0:
+                self._fill(cadence, names)
+
+        self.late = []
+        if not self.behind:
+            self._fillGap()
+
+        if self.behind:
+            return 0
+        return self._wait(len(rows) != 0, blocking)
+
+    def _fillGap(self):
+        """
+        Insert a batch of the late rows of the oldest gap not yet filled.
+        Returns True if the gap may hold more.
+        """
+        cursor = self._gap_cursor
+        gaps = [gap for gap in self._vars.gaps(cursor)
+                if cursor is None or gap[1] > cursor]
+        if (len(gaps) == 0 and cursor is not None and
+            self._ticks - self._gap_tick >= self._gap_sweep):
+            cursor = None
+            gaps = self._vars.gaps()
+        if len(gaps) == 0:
+            return False
+        if cursor is None:
+            self._gap_tick = self._ticks
+
+        start = time.time()
+        before, after = gaps[0]
+        if cursor is not None and cursor > before:
+            before = cursor
+        max_rows = self._max_rows or CATCHUP_ROWS
+        late = self.server.getData(start_time=before, end_time=after,
+                                   variables=self._vars.keys(),
+                                   number_entries=max_rows,
+                                   epoch=True) or []
+        more = len(late) == max_rows
+        self._gap_cursor = data.fromEpoch(late[-1][0]) if more else after
+
+        if len(late) != 0:
+            self._vars.insertData(late)
+            self.late = late
+            self.rows += len(late)
+        self.seconds += time.time() - start
+        return more
+
+    def addListener(self, listener):
+        """
+        Call listener(names, rows) with every batch of new rows, which start
+        with epoch seconds, such as fanout.NFanoutServer.publish.
+        """
+        self._listeners.append(listener)
+
+    def _wait(self, arrived, blocking):
+        server = self.server
+        if not server.notify or server._simulate_fast:
+            return server.sleep(blocking=blocking)
+
+        if server.listening:
+            if not blocking:
+                if server.pollNotifications() != self._notifications:
+                    return 0
+                return server.getDataRate()
+            server.pollNotifications(timeout=server.notify_timeout,
+                                     seen=self._notifications)
+            return 0
+
+        ## Notifications are unavailable, poll less often while idle.
+        rate = server.getDataRate()
+        if arrived or self._interval is None:
+            self._interval = rate
+        else:
+            self._interval = min(self._interval * 2,
+                                 max(server.notify_timeout, rate))
+        return server.sleep(self._interval, blocking=blocking)
 
 
 class NDatabase(object):
@@ -166,7 +610,36 @@ class NDatabase(object):
                        database=None,
                        simulate_start_time=None,
                        simulate_fast=False,
-                       simulate_file=None):
+                       simulate_file=None,
+                       replay_chunk=datetime.timedelta(minutes=30),
+                       catalog_dir=None,
+                       notify=False,
+                       notify_timeout=30,
+                       cache=None,
+                       connect=True):
+        """
+        The catalog of the database (variable list, missing values, sample
+        rates, units and flight information) is only read when its schema
+        has changed since it was last read by this process or, with
+        `catalog_dir`, by any process using that directory; see
+        catalog.NCatalogCache. After a reconnect() this is checked again
+        when the next flight starts.
+
+        With `notify` the server is sent LISTEN on NOTIFY_CHANNEL, so that
+        NDatabaseLiveUpdater only queries once new rows have been notified
+        and wakes up as soon as they are, waiting at most `notify_timeout`
+        seconds. This needs the trigger of installNotifyTrigger() on
+        raf_lrt; without it the updater falls back to polling, less often
+        while no data arrives. Fast simulations always poll.
+
+        With `cache`, a cache.NChunkCache (which can be shared), getData
+        answers the settled past part of a query from the cache, fetching
+        only what it is missing.
+
+        Without `connect` nothing is loaded or connected to and the catalog
+        is left empty, for subclasses that supply their own data (see
+        NMemoryDatabase).
+        """
         ## Database related
         self._database = database
         self._user = user
@@ -175,7 +648,20 @@ class NDatabase(object):
         self.variable_list = ()
         self._flight_info = None
         self._bad_data_values = None
+        self._catalog = None
+        self._catalog_stale = False  # Checked again when a flight starts
+        self._catalogs = NCatalogCache(catalog_dir)
         self._conn = None
+
+        ## Data already fetched
+        self._cache = cache
+        self._newest = None  # Time of the newest row getData has returned
+
+        ## Notifications of new rows
+        self.notify = notify
+        self.notify_timeout = notify_timeout
+        self._listen_conn = None
+        self._notifications = 0
         self._running = True
         self._sql_bad_attempts = 0
 
@@ -192,6 +678,20 @@ class NDatabase(object):
                                if simulate_start_time is not None
                                else False)
 
+        ## Replay engine. When simulating quickly the rows of raf_lrt are
+        ## pulled across in chunks of `replay_chunk` of simulated time and
+        ## kept in a NMemoryTable, which then answers the queries made every
+        ## tick. The table holds every row in (_replay_from, _replay_until].
+        self._replay = None
+        self._replay_chunk = replay_chunk if self._simulate_fast else None
+        self._replay_from = None
+        self._replay_until = None
+        self._replay_last = None
+        if self._replay_chunk is not None:
+            self._replay_from = (self._simulate_start_time
+                                 - datetime.timedelta(hours=1))
+            self._replay_until = self._replay_from
+
         self._flying = False
         self._fake_flying = False
 
@@ -203,6 +703,9 @@ class NDatabase(object):
         if database == "C130" or database == "GV":
             self._database = "real-time-" + database
 
+        if not connect:
+            return
+
         ## If we are simulating from a file, load the file with
         ## a random database name
         if simulate_file is not None:
@@ -216,27 +719,11 @@ class NDatabase(object):
         ## Create first connection to database
         self.reconnect()
 
-        ## Grab variable list from server
-        cursor = self._conn.cursor()
-        cursor.execute("SELECT column_name FROM Information_Schema.Columns "
-                       "WHERE table_name='raf_lrt'")
-        variable_list = cursor.fetchall()
-        try:
-            variable_list.remove(('datetime',))
-        except ValueError:
-            pass
-
-        self._bad_data_values = self.getBadDataValues()
-
-        ## Variable list is a list of single entry tuples, make into tuple
-        self.variable_list = tuple([col[0] for col in variable_list])
-
-        ## Get flight information
-        cursor.execute("SELECT * FROM global_attributes;")
-        self._flight_info = dict(cursor.fetchall())
+        ## Variable list, bad data values and flight information
+        self._refreshCatalog()
+        self._flight_info = dict(self._catalog.flight_info)
 
         ## We are done
-        cursor.close()
         atexit.register(__ending__, self)
 
     def __del__(self):
@@ -253,6 +740,7 @@ class NDatabase(object):
             self._conn.close()
         except Exception, e:
             pass
+        self._closeListener()
         self._running = False
 
     def reconnect(self):
@@ -269,6 +757,187 @@ class NDatabase(object):
                                           password=self._password)
         except Exception, e:
             print e
+            return
+
+        ## The database may have been replaced with a fresh one, which is
+        ## checked for when the catalog is next needed.
+        if self._catalog is not None:
+            self._catalog_stale = True
+
+        if self.notify and not self._simulate_fast:
+            self._listen()
+
+    @property
+    def listening(self):
+        """ Whether new rows are being notified, see notify. """
+        return self._listen_conn is not None
+
+    def installNotifyTrigger(self):
+        """
+        Put a trigger on raf_lrt that notifies NOTIFY_CHANNEL after every
+        insert. Meant for a local database, such as one fed with a recorded
+        flight; the real time server needs the same trigger installed by
+        its administrators.
+        """
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("CREATE OR REPLACE FUNCTION %s() RETURNS trigger "
+                           "AS $$ BEGIN NOTIFY %s; RETURN NULL; END; $$ "
+                           "LANGUAGE plpgsql;"
+                           % (_NOTIFY_TRIGGER, NOTIFY_CHANNEL))
+            cursor.execute("DROP TRIGGER IF EXISTS %s ON raf_lrt;"
+                           % _NOTIFY_TRIGGER)
+            cursor.execute("CREATE TRIGGER %s AFTER INSERT ON raf_lrt "
+                           "FOR EACH STATEMENT EXECUTE PROCEDURE %s();"
+                           % (_NOTIFY_TRIGGER, _NOTIFY_TRIGGER))
+            self._conn.commit()
+        finally:
+            cursor.close()
+
+        if self.notify and not self._simulate_fast:
+            self._listen()
+
+    def _listen(self):
+        """
+        Open the connection that listens for notifications, if the trigger
+        that sends them is there.
+        """
+        self._closeListener()
+        try:
+            cursor = self._conn.cursor()
+            try:
+                cursor.execute("SELECT count(*) FROM pg_trigger "
+                               "WHERE tgname = '%s';" % _NOTIFY_TRIGGER)
+                installed = cursor.fetchone()[0] != 0
+            finally:
+                cursor.close()
+                self._conn.rollback()
+            if not installed:
+                return
+
+            conn = psycopg2.connect(database=self._database,
+                                    user=self._user,
+                                    host=self._host,
+                                    password=self._password)
+            conn.set_isolation_level(0)
+            cursor = conn.cursor()
+            cursor.execute("LISTEN %s;" % NOTIFY_CHANNEL)
+            cursor.close()
+            self._listen_conn = conn
+        except Exception, e:
+            print >>sys.stderr, ("%s: Could not listen for new data, "
+                                 "polling instead: %s"
+                                 % (self.__class__.__name__, e))
+
+    def _closeListener(self):
+        if self._listen_conn is not None:
+            try:
+                self._listen_conn.close()
+            except Exception:
+                pass
+            self._listen_conn = None
+
+    def pollNotifications(self, timeout=0, seen=None):
+        """
+        The number of notifications of new rows received so far, None when
+        not listening. If the number is still `seen`, wait up to `timeout`
+        seconds on the connection for another one.
+        """
+        conn = self._listen_conn
+        if conn is None:
+            return None
+
+        try:
+            conn.poll()
+            if timeout > 0 and not conn.notifies and \
+               self._notifications == seen:
+                select.select([conn], [], [], timeout)
+                conn.poll()
+            if conn.notifies:
+                self._notifications += len(conn.notifies)
+                del conn.notifies[:]
+        except Exception, e:
+            print >>sys.stderr, ("%s: Lost notifications, polling instead: %s"
+                                 % (self.__class__.__name__, e))
+            self._closeListener()
+            return None
+        return self._notifications
+
+    def _refreshCatalog(self):
+        """ Get the catalog, from the cache unless the schema changed. """
+        self._catalog = self._catalogs.get((self._host, self._database),
+                                           self._schemaFingerprint(),
+                                           self._loadCatalog)
+        self.variable_list = self._catalog.columns
+        self._bad_data_values = self._catalog.missing_values
+
+    def _checkCatalog(self):
+        """ Refresh the catalog if it may have changed since it was read. """
+        if not self._catalog_stale:
+            return
+        self._catalog_stale = False
+        try:
+            self._refreshCatalog()
+        except Exception, e:
+            print e
+
+    def _schemaFingerprint(self):
+        """
+        Changes whenever the catalog does: a new database gets new table
+        oids, altering a table changes its pg_class row, and inserting,
+        updating or deleting rows of variable_list or global_attributes
+        changes their count or the newest transaction id (xmin) of a row.
+        """
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("SELECT relname, oid, relnatts, xmin::text "
+                           "FROM pg_class WHERE relname IN "
+                           "('raf_lrt', 'variable_list', 'global_attributes') "
+                           "ORDER BY relname;")
+            tables = [tuple(row) for row in cursor.fetchall()]
+            cursor.execute("SELECT "
+                           "(SELECT count(*) FROM variable_list), "
+                           "(SELECT max(xmin::text::bigint) "
+                           "FROM variable_list), "
+                           "(SELECT count(*) FROM global_attributes), "
+                           "(SELECT max(xmin::text::bigint) "
+                           "FROM global_attributes);")
+            return tuple(tables) + (tuple(cursor.fetchone()),)
+        finally:
+            cursor.close()
+
+    def _loadCatalog(self):
+        """ Read the catalog from the server. """
+        cursor = self._conn.cursor()
+        try:
+            ## Grab variable list from server
+            cursor.execute("SELECT column_name "
+                           "FROM Information_Schema.Columns "
+                           "WHERE table_name='raf_lrt'")
+            variable_list = cursor.fetchall()
+            try:
+                variable_list.remove(('datetime',))
+            except ValueError:
+                pass
+
+            cursor.execute('SELECT name, missing_value, sampleratetable, '
+                           'units FROM variable_list ;')
+            variables = cursor.fetchall()
+
+            ## Get flight information
+            cursor.execute("SELECT * FROM global_attributes;")
+            flight_info = dict(cursor.fetchall())
+        finally:
+            cursor.close()
+
+        ## Variable list is a list of single entry tuples, make into tuple
+        return NCatalog(columns=[col[0] for col in variable_list],
+                        missing_values=dict([(var[0], var[1])
+                                             for var in variables]),
+                        sample_rates=_parseSampleRates([(var[0], var[2])
+                                                        for var in variables]),
+                        units=dict([(var[0], var[3]) for var in variables]),
+                        flight_info=flight_info)
 
     def flying(self):
         r"""
@@ -315,18 +984,23 @@ class NDatabase(object):
 
             if speed > 50:
                 if self._flying == False:
-                    cursor = self._conn.cursor()
-                    try:
-                        cursor.execute("SELECT * FROM global_attributes;")
-                        self._flight_info = dict(cursor.fetchall())
-                    except Exception:
-                        print "Could not update flight information variable."
+                    self._updateFlightInformation()
+                    self._checkCatalog()
                     self._flying = True
                 return True
             else:
                 self._flying = False
                 return False
 
+    def _updateFlightInformation(self):
+        """ Reload the flight information, done when a flight starts. """
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("SELECT * FROM global_attributes;")
+            self._flight_info = dict(cursor.fetchall())
+        except Exception:
+            print "Could not update flight information variable."
+
     def _gps_speed(self):
         data = (self.getData(number_entries=2, variables=('gglat', 'gglon')))
 
@@ -359,19 +1033,79 @@ class NDatabase(object):
 
         return d * 1000 / tm
 
-    def sleep(self, sleep_time=0):
+    def sleep(self, sleep_time=0, skip_idle=False, limit=None,
+                    blocking=True):
         """
         Used to wait for new data. If in simulation mode this increments time
         forward.
+
+        With `skip_idle` a simulation jumps forward as many whole sleeps as it
+        takes for a new row to appear (but not past the datetime `limit`).
+        Only use this when nothing changes while no data arrives, such as
+        when waiting for a flight.
+
+        Returns the number of seconds the caller still has to wait, which is
+        0 unless `blocking` is False, in which case a real (not simulated)
+        wait is left to the caller, such as an event loop.
         """
         ## Get the data rate from the server, usually 3 seconds
         if sleep_time == 0:
-            sleep_time = int(self._flight_info['DataRate'])
+            sleep_time = self.getDataRate()
 
         if self._simulate_fast:
-            self._current_time += datetime.timedelta(seconds=sleep_time)
-        else:
+            step = datetime.timedelta(seconds=sleep_time)
+            steps = 1
+            if skip_idle:
+                steps = self._idleSteps(step, limit)
+            self._current_time += steps * step
+        elif blocking:
             time.sleep(sleep_time)
+        else:
+            return sleep_time
+        return 0
+
+    def _idleSteps(self, step, limit=None):
+        """
+        The number of `step` sleeps before the next row becomes visible (or
+        the time `limit` is reached), so that a simulation can skip them.
+        """
+        now = self._getSimulatedCurrentTime()
+        next_time = self._nextTime(now)
+        if next_time is None or step <= datetime.timedelta(0):
+            return 1
+
+        if limit is not None and limit < next_time:
+            next_time = limit
+
+        seconds = step.total_seconds()
+        steps = int(math.ceil((next_time - now).total_seconds() / seconds))
+        return max(1, steps)
+
+    def _nextTime(self, after):
+        """ Time of the first row in raf_lrt after `after`. """
+        if self._replay_chunk is not None:
+            ## A simulated database does not grow, so once the last row has
+            ## been passed there is no need to ask again.
+            if (self._replay_last is not None and
+                after >= self._replay_last):
+                return None
+            if self._replayFill(after):
+                next_time = self._replay.nextTime(after)
+                if next_time is not None:
+                    return next_time
+
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("SELECT min(datetime) FROM raf_lrt "
+                           "WHERE datetime > '%s';" % after)
+            next_time = cursor.fetchone()[0]
+        except Exception, e:
+            next_time = None
+        cursor.close()
+
+        if next_time is None and self._replay_chunk is not None:
+            self._replay_last = after
+        return next_time
 
     def getTimeStr(self):
         """ Returns the most recent datapoint time as a string """
@@ -381,6 +1115,10 @@ class NDatabase(object):
         """ Returns latest datapoint time as datetime object """
         return self._getSimulatedCurrentTime()
 
+    def getDataRate(self):
+        """ Seconds between rows of raf_lrt, usually 3. """
+        return int(self._flight_info['DataRate'])
+
     def getFlightInformation(self):
         """
         Get the flight information. This is updated when a new flight is
@@ -394,20 +1132,346 @@ class NDatabase(object):
         in simulation mode.
         """
         if self._simulate_fast:
-            return (((self._current_time - self._simulate_start_time)
-                         + self._simulate_start_time).replace(microsecond=0))
+            return self._current_time.replace(microsecond=0)
         else:
             return (((datetime.datetime.utcnow() - self._start_time)
                          + self._current_time).replace(microsecond=0))
 
     def getData(self, variables=None,
                       start_time=None, end_time=None,
-                      number_entries=None):
+                      number_entries=None, epoch=False):
         """
         Get data from the server for the selected variables, where the
         variables are a tuple/list. Can be manipulated to get data from a
         range or just a certain number of entries. The times can also be
-        intervals such as start_time = "-60 MINUTES".
+        intervals such as start_time = "-60 MINUTES". With a datetime
+        `start_time` and `end_time` the rows are those strictly between
+        them (at most `number_entries` of them, oldest first).
+
+        With `epoch` the rows start with the time as epoch seconds (see
+        data.toEpoch) rather than a datetime, which the server works out.
+        """
+        if self._replay_chunk is not None:
+            rows = self._replayData(variables=variables,
+                                    start_time=start_time,
+                                    end_time=end_time,
+                                    number_entries=number_entries)
+            if rows is not None:
+                return _epochRows(rows) if epoch else rows
+
+        if self._cache is not None:
+            rows = self._cachedData(variables=variables,
+                                    start_time=start_time,
+                                    end_time=end_time,
+                                    number_entries=number_entries)
+            if rows is not None:
+                self._sawRows(rows)
+                return _epochRows(rows) if epoch else rows
+
+        rows = self._queryData(variables=variables,
+                               start_time=start_time,
+                               end_time=end_time,
+                               number_entries=number_entries,
+                               epoch=epoch)
+        if self._cache is not None:
+            self._sawRows(rows)
+        return rows
+
+    def _sawRows(self, rows):
+        """
+        Keep the time of the newest of `rows` (oldest or newest first), so
+        the cache knows which buckets have a newer row without asking.
+        """
+        if not rows:
+            return
+        for row in (rows[0], rows[-1]):
+            tm = row[0]
+            if not isinstance(tm, datetime.datetime):
+                tm = data.fromEpoch(tm)
+            if self._newest is None or tm > self._newest:
+                self._newest = tm
+
+    def _replayData(self, variables=None,
+                          start_time=None, end_time=None,
+                          number_entries=None):
+        """
+        Answer a getData query from the replay table. Returns None when the
+        query cannot be answered locally, in which case the server is asked.
+        """
+        if ((end_time is not None and
+             not isinstance(end_time, datetime.datetime)) or
+            (start_time is None and number_entries is None)):
+            return None
+
+        NOW = self._getSimulatedCurrentTime()
+        upto = NOW
+        if end_time is not None:
+            if start_time is None:
+                return None
+            upto = min(NOW, end_time - datetime.timedelta(microseconds=1))
+
+        after = None
+        if isinstance(start_time, datetime.datetime):
+            after = start_time
+        elif start_time is not None:
+            if start_time[0] == "-" or start_time[0] == "+":
+                interval = _parseInterval(start_time)
+                after = NOW + interval if interval is not None else None
+            else:
+                after = _parseTimestamp(start_time)
+            if after is None:
+                return None
+
+        if not self._replayFill(NOW):
+            return None
+
+        var_list = []
+        if variables is not None:
+            for var in variables:
+                if var in self.variable_list or var is "datetime":
+                    var_list.append(var)
+                else:
+                    print >> sys.stderr, (
+                    "%s: Could not add variable %s, does not exist"
+                    % (self.__class__.__name__, var))
+
+        for var in var_list:
+            if not self._replay.hasColumn(var):
+                return None
+
+        if after is not None:
+            ## Rows in (after, NOW], or before end_time, oldest first.
+            if self._replay_from is not None and after < self._replay_from:
+                return None
+            return self._replay.select(var_list, after=after, upto=upto,
+                                       limit=number_entries)
+        else:
+            ## The last `number_entries` rows up to NOW, newest first. If
+            ## the table does not go back far enough ask the server.
+            if (self._replay_from is not None and
+                self._replay.count(self._replay_from, NOW) < number_entries):
+                return None
+            return self._replay.select(var_list, upto=NOW,
+                                       limit=number_entries,
+                                       descending=True)
+
+    def _cachedData(self, variables=None,
+                          start_time=None, end_time=None,
+                          number_entries=None):
+        """
+        Answer a getData query with the cache for the buckets that have
+        settled and the server for the rest. Returns None when the query is
+        not one the cache can help with. With `number_entries` only the
+        buckets those rows can be in (at the DataRate) are looked at.
+        """
+        if end_time is not None or start_time is None or not variables:
+            return None
+
+        NOW = self._getSimulatedCurrentTime()
+        if isinstance(start_time, datetime.datetime):
+            after = start_time
+        elif start_time[0] == "-" or start_time[0] == "+":
+            interval = _parseInterval(start_time)
+            if interval is None:
+                return None
+            after = NOW + interval
+        else:
+            after = _parseTimestamp(start_time)
+            if after is None:
+                return None
+
+        cache = self._cache
+        settled = cache.bucketStart(NOW - cache.settle)
+        if after >= settled:
+            return None  # Nothing settled yet, such as a live update
+        variables = [var for var in variables if var in self.variable_list]
+        if len(variables) == 0:
+            return None
+
+        ## Rows arrive late after a satcom outage, so only the buckets
+        ## before the newest row can be complete, and only those without a
+        ## gap in them are cached. The newest row is the newest one fetched
+        ## so far, such as by the live updater's polls; only before any has
+        ## been is the server asked.
+        newest = self._newest
+        if newest is None:
+            newest = self._newestTime()
+            if newest is None:
+                return None
+        settled = min(settled, cache.bucketStart(newest))
+        if number_entries is not None:
+            span = datetime.timedelta(
+                       seconds=number_entries * self.getDataRate())
+            settled = min(settled, cache.bucketStart(after + span) +
+                                     cache.bucket)
+        if after >= settled:
+            return None
+        max_gap = cache.max_gap
+        if max_gap is None:
+            max_gap = datetime.timedelta(seconds=self.getDataRate())
+
+        starts = []
+        start = cache.bucketStart(after)
+        while start < settled:
+            starts.append(start)
+            start += cache.bucket
+
+        ## Chunks in the cache, then one query for everything missing.
+        database = (self._host, self._database)
+        chunks = {}
+        missing = []
+        first_missing = None
+        for var in variables:
+            for start in starts:
+                chunk = cache.get(database, var, start)
+                if chunk is None:
+                    if var not in missing:
+                        missing.append(var)
+                    if first_missing is None or start < first_missing:
+                        first_missing = start
+                else:
+                    chunks[(var, start)] = chunk
+
+        if len(missing) != 0:
+            rows = self._rangeQuery(missing, first_missing, settled)
+            if rows is None:
+                return None
+            self._chunkRows(chunks, missing, [start for start in starts
+                                              if start >= first_missing],
+                            rows, max_gap)
+
+        ## Chunks fetched at different times can have different rows when
+        ## a `max_gap` longer than the DataRate let a bucket be cached with
+        ## a row still to come, so such a bucket is fetched again for every
+        ## variable.
+        for start in starts:
+            if _sameTimes([chunks[(var, start)] for var in variables]):
+                continue
+            rows = self._rangeQuery(variables, start, start + cache.bucket)
+            if rows is None:
+                return None
+            for var in variables:
+                del chunks[(var, start)]
+            self._chunkRows(chunks, variables, [start], rows, max_gap)
+
+        ## Assemble the rows after `after`, then the unsettled rest.
+        data = []
+        for start in starts:
+            times = chunks[(variables[0], start)][0]
+            lo = bisect.bisect_right(times, after)
+            columns = [chunks[(var, start)][1][lo:] for var in variables]
+            data += zip(times[lo:], *columns)
+
+        if number_entries is not None:
+            if len(data) >= number_entries:
+                return data[:number_entries]
+            number_entries -= len(data)
+        rest = self._queryData(variables=variables,
+                               start_time=max(after, settled -
+                                 datetime.timedelta(microseconds=1)),
+                               number_entries=number_entries)
+        if rest is None:
+            return None
+        return data + list(rest)
+
+    def _chunkRows(self, chunks, variables, starts, rows, max_gap):
+        """
+        Split the `rows` of a range query of `variables` into chunks of the
+        buckets `starts`, leaving those already in `chunks` and caching the
+        complete ones. The chunks of a bucket share their tuple of times,
+        as the cache keeps them.
+        """
+        cache = self._cache
+        database = (self._host, self._database)
+        times = [row[0] for row in rows]
+        for start in starts:
+            lo = bisect.bisect_left(times, start)
+            hi = bisect.bisect_left(times, start + cache.bucket)
+            bucket_times = tuple(times[lo:hi])
+            complete = _bucketComplete(bucket_times, start,
+                                       start + cache.bucket, max_gap)
+            for pos, var in enumerate(variables):
+                if (var, start) in chunks:
+                    continue
+                chunk = (bucket_times, [row[pos + 1] for row in rows[lo:hi]])
+                if complete:
+                    cache.put(database, var, start, *chunk)
+                chunks[(var, start)] = chunk
+
+    def _newestTime(self):
+        """
+        Time of the newest row of raf_lrt (up to the simulated current time
+        when simulating), None if there is none or the query fails.
+        """
+        cursor = self._conn.cursor()
+        try:
+            if self._simulate_start_time is not None:
+                cursor.execute("SELECT max(datetime) FROM raf_lrt "
+                               "WHERE datetime <= '%s';"
+                               % self._getSimulatedCurrentTime())
+            else:
+                cursor.execute("SELECT max(datetime) FROM raf_lrt;")
+            return cursor.fetchone()[0]
+        except Exception, e:
+            print >> sys.stderr, ("%s: Could not fetch the newest time: %s"
+                                  % (self.__class__.__name__, e))
+            return None
+        finally:
+            cursor.close()
+
+    def _rangeQuery(self, variables, start, stop):
+        """ Rows with start <= datetime < stop, None if the query fails. """
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("SELECT datetime, %s FROM raf_lrt "
+                           "WHERE datetime >= '%s' AND datetime < '%s' "
+                           "ORDER BY datetime ASC;"
+                           % (", ".join(variables), start, stop))
+            return cursor.fetchall()
+        except Exception, e:
+            print >> sys.stderr, ("%s: Could not fetch data for the cache: %s"
+                                  % (self.__class__.__name__, e))
+            return None
+        finally:
+            cursor.close()
+
+    def _replayFill(self, upto):
+        """
+        Make sure the replay table holds every row up to `upto`, pulling the
+        next chunk of simulated time across from the server if needed.
+        Returns False if that could not be done.
+        """
+        if self._replay_until is not None and upto <= self._replay_until:
+            return True
+
+        chunk_end = upto + self._replay_chunk
+        labels = ("datetime",) + tuple(self.variable_list)
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute("SELECT %s FROM raf_lrt "
+                           "WHERE datetime > '%s' AND datetime <= '%s' "
+                           "ORDER BY datetime ASC;"
+                           % (", ".join(labels), self._replay_until,
+                              chunk_end))
+            rows = cursor.fetchall()
+        except Exception, e:
+            print >> sys.stderr, ("%s: Could not fill replay table: %s"
+                                  % (self.__class__.__name__, e))
+            cursor.close()
+            return False
+        cursor.close()
+
+        if self._replay is None:
+            self._replay = NMemoryTable(labels)
+        self._replay.addData(rows)
+        self._replay_until = chunk_end
+        return True
+
+    def _queryData(self, variables=None,
+                         start_time=None, end_time=None,
+                         number_entries=None, epoch=False):
+        """
+        Build and run the SQL query for getData.
         """
         ## Use server now function if not in simulation mode, otherwise perform
         ## the SQL query with the simulated current time as the upper bound.
@@ -423,6 +1487,8 @@ class NDatabase(object):
 
         ## Variables to get. Will always get datetime.
         var_str = "datetime"
+        if epoch:
+            var_str = "CAST(EXTRACT(EPOCH FROM datetime) AS bigint)"
         if variables is not None:
             for var in variables:
                 if var in self.variable_list or var is "datetime":
@@ -464,11 +1530,14 @@ class NDatabase(object):
         elif (end_time is None and
               start_time is not None and
               number_entries is not None):
+            ## Rows after the simulated current time have not arrived yet,
+            ## so a simulation never sees them (as with the replay table).
             if start_time[0] == "-" or start_time[0] == "+":
                 if self._simulate_start_time:
-                    time_interval = ("WHERE datetime > (timestamp '%s' "
-                                     "+ interval '%s')"
-                                     % (NOW, start_time))
+                    time_interval = ("WHERE (datetime > timestamp '%s' "
+                                     "+ interval '%s') AND "
+                                     "(datetime <= '%s')"
+                                     % (NOW, start_time, NOW))
                 else:
                     time_interval = ("WHERE datetime > %s %s interval '%s'"
                                      % (NOW, start_time[0], start_time[1:]))
@@ -494,6 +1563,18 @@ class NDatabase(object):
             else:
                 time_interval = (" ORDER BY datetime DESC LIMIT %s"
                                  % number_entries)
+        elif (end_time is not None and
+              isinstance(start_time, basestring) and
+              start_time[0] not in "-+"):
+            if isinstance(end_time, datetime.datetime):
+                end_time = str(end_time)
+            time_interval = ("WHERE (datetime > '%s' AND datetime < '%s')"
+                             % (start_time, end_time))
+            if self._simulate_start_time is not None:
+                time_interval += " AND (datetime <= '%s')" % NOW
+            time_interval += " ORDER BY datetime ASC"
+            if number_entries is not None:
+                time_interval += " LIMIT %s" % number_entries
         else:
             print >> sys.stderr, ("%s: Invalid time scale change"
                                   % self.__class__.__name__)
@@ -518,9 +1599,20 @@ class NDatabase(object):
         return data
 
     def getBadDataValues(self):
-        cursor = self._conn.cursor()
-        cursor.execute('SELECT name, missing_value FROM variable_list ;')
-        return dict(cursor.fetchall())
+        """ The missing value of each variable, from the catalog. """
+        return dict(self._catalog.missing_values)
+
+    def getSampleRates(self):
+        """
+        The sample rate (in Hz) of each variable, from the sampleratetable
+        column of the variable list ("SampleRate5" is 5 Hz). Variables
+        without a rate are left out.
+        """
+        return dict(self._catalog.sample_rates)
+
+    def getUnits(self):
+        """ The units of each variable, from the variable list. """
+        return dict(self._catalog.units)
 
     def getDatabaseStructure(self):
         """
@@ -630,3 +1722,119 @@ class NDatabase(object):
         ## Finally, we have all the tables, end query.
         cursor.close()
         return output.strip('\n')
+
+
+class NMemoryDatabase(NDatabase):
+    """
+    An NDatabase that replays a .asc file (with a header, see
+    datafile.NRTFile) entirely in process. No PostgreSQL server is used: the
+    rows live in a NMemoryTable and the header supplies the variable list,
+    missing values and flight information. Always runs in fast simulation
+    mode, by default starting at the first row of the file.
+    """
+
+    def __init__(self, simulate_file=None, simulate_start_time=None,
+                       database=None):
+        if simulate_file is None:
+            raise ValueError('%s: simulate_file must be specified'
+                             % self.__class__.__name__)
+
+        nfile = datafile.NRTFile(simulate_file)
+        tables = nfile.getTables()
+        labels = [label.lower() for label in nfile.labels]
+
+        ## The raf_lrt structure in the header is the full column list of the
+        ## server, the data section only has some of those columns.
+        if 'raf_lrt' in tables:
+            columns = [col[0].lower() for col in tables['raf_lrt'][0]]
+        else:
+            columns = list(labels)
+        if 'datetime' in columns:
+            columns.remove('datetime')
+
+        ## Values are stored as floats, as they would come out of the server.
+        ## Columns that are not in the data section are NULL.
+        pos_of_label = dict([(label, pos) for pos, label in enumerate(labels)])
+        positions = [pos_of_label.get(col) for col in columns]
+        rows = []
+        for row in nfile.data:
+            line = (row[0],)
+            for pos in positions:
+                if pos is None or row[pos] == '':
+                    line += (None,)
+                else:
+                    line += (float(row[pos]),)
+            rows.append(line)
+
+        ## Time, starting at the first row unless told otherwise.
+        if simulate_start_time is None and len(rows) != 0:
+            simulate_start_time = rows[0][0]
+        NDatabase.__init__(self, host=None, user=None, password=None,
+                           database=(database if database is not None
+                                     else os.path.basename(simulate_file)),
+                           simulate_start_time=simulate_start_time,
+                           simulate_fast=True,
+                           replay_chunk=datetime.timedelta(0),
+                           connect=False)
+        self._header = nfile.header
+
+        ## The header is the catalog.
+        self._catalog = NCatalog(columns=columns)
+        if 'variable_list' in tables and tables['variable_list'][1]:
+            names = [col[0] for col in tables['variable_list'][0]]
+            name = names.index('name')
+            missing = names.index('missing_value')
+            rate = names.index('sampleratetable')
+            variables = tables['variable_list'][1]
+            self._catalog.missing_values = dict([(var[name], var[missing])
+                                                 for var in variables])
+            self._catalog.sample_rates = _parseSampleRates(
+                                             [(var[name], var[rate])
+                                              for var in variables])
+            if 'units' in names:
+                units = names.index('units')
+                self._catalog.units = dict([(var[name], var[units])
+                                            for var in variables])
+        if 'global_attributes' in tables and tables['global_attributes'][1]:
+            self._catalog.flight_info = dict(tables['global_attributes'][1])
+
+        self.variable_list = self._catalog.columns
+        self._bad_data_values = self._catalog.missing_values
+        self._flight_info = dict(self._catalog.flight_info)
+
+        ## The whole file is the replay table.
+        self._replay = NMemoryTable(('datetime',) + self.variable_list)
+        self._replay.addData(rows)
+        self._replay_from = None
+        self._replay_until = datetime.datetime.max
+
+    @property
+    def last_time(self):
+        """ Time of the last row in the file, None if it has no data. """
+        return self._replay.lastTime()
+
+    def reconnect(self):
+        pass
+
+    def _updateFlightInformation(self):
+        pass
+
+    def _nextTime(self, after):
+        return self._replay.nextTime(after)
+
+    def _queryData(self, variables=None,
+                         start_time=None, end_time=None,
+                         number_entries=None, epoch=False):
+        print >> sys.stderr, ("%s: Query could not be answered from file"
+                              % self.__class__.__name__)
+        return []
+
+    def getDatabaseStructure(self):
+        """
+        The header of the replayed file, in the format of
+        NDatabase.getDatabaseStructure.
+        """
+        lines = [re.sub(r"^#!\s?", "", line)
+                 for line in (self._header or "").split('\n')
+                 if line.startswith("#!")]
+        return "\n".join(lines)
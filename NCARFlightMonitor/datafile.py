@@ -28,6 +28,9 @@
 ## Imports and Globals
 ## --------------------------------------------------------------------------
 
+## Intrapackage
+from utils import EPOCH
+
 ## Regular expressions to parse files.
 import re
 
@@ -37,6 +40,9 @@ import datetime
 ## For sys.stderr
 import sys
 
+## The written date of each day.
+_date_fields = {}  # {days since 1970: "YEAR,MONTH,DAY,"}
+
 
 ## --------------------------------------------------------------------------
 ## Functions
@@ -147,6 +153,45 @@ def _SqlFromHeader(header):
     return cmd_list
 
 
+def _TablesFromHeader(header):
+    """
+    Parse the tables in a header into a dictionary of
+    {table_name: (columns, data)}, where columns is a tuple of
+    (name, type, null) and data is a tuple of rows (or None).
+    """
+    tables = {}
+    if header is None:
+        return tables
+
+    for cnt, line in enumerate(header.split('\n')):
+        if not line.startswith("#!"):
+            continue
+
+        tbl = re.match("^#!\s*(\w+)\s*=\s*(.*)%(.*)$", line)
+        if not tbl:
+            print >>sys.stderr, ("%s: Table information line "
+                                 "improperly formatted. Line %s"
+                                 % (__name__, cnt))
+            continue
+
+        tbl_info = ()
+        for info in tbl.groups()[1].split(';'):
+            tbl_info += (eval(info), )
+        tbl_cmds = [col[0] for col in tbl_info]
+
+        columns = ()
+        if "COLUMNS" in tbl_cmds:
+            columns = tuple(tbl_info[tbl_cmds.index('COLUMNS')][1:])
+
+        tbl_data = None
+        if tbl.groups()[2] != "":
+            tbl_data = eval(tbl.groups()[2])
+
+        tables[tbl.groups()[0]] = (columns, tbl_data)
+
+    return tables
+
+
 def _concatTime(labels, data):
     """
     Take Year,Month,...,Second columns and combine them into a datetime type
@@ -174,6 +219,25 @@ def _concatTime(labels, data):
     return tuple(labels), data
 
 
+def _timeFields(tm):
+    """
+    A datetime, or epoch seconds, as written to a file: YEAR,MONTH,DAY,
+    HOUR,MINUTE,SECOND, and a trailing comma.
+    """
+    if isinstance(tm, datetime.datetime):
+        return ("%04d,%02d,%02d,%02d,%02d,%02d,"
+                % (tm.year, tm.month, tm.day, tm.hour, tm.minute, tm.second))
+
+    days, seconds = divmod(int(tm), 86400)
+    date = _date_fields.get(days)
+    if date is None:
+        date = (EPOCH + datetime.timedelta(days=days)).strftime(
+                    "%Y,%m,%d,")
+        _date_fields[days] = date
+    return "%s%02d,%02d,%02d," % (date, seconds // 3600, seconds // 60 % 60,
+                                  seconds % 60)
+
+
 def _parseIntoHeaderLabelsData(file_str):
     try:
         ## Get pieces based on structure
@@ -263,10 +327,17 @@ class NRTFile(object):
         """
         return _SqlFromHeader(self._header)
 
+    def getTables(self):
+        """
+        Return the tables in the header as {table_name: (columns, data)}.
+        """
+        return _TablesFromHeader(self._header)
+
     def write(self, file_name="", header=None, labels=None, data=None):
         """
         Write file to destination, with any combination of header, label, and
-        data information.
+        data information. The rows start with the time, as a datetime or in
+        epoch seconds (see data.toEpoch).
         """
         ## Replace information if provided to function
         if header is not None:
@@ -294,15 +365,12 @@ class NRTFile(object):
         label_str += "\n"
 
         ## Start outputting data
-        data_str = ""
+        lines = []
         for row in data:
-            line = ""
-            for value in row:
-                if isinstance(value, datetime.datetime):
-                    line += value.strftime("%Y,%m,%d,%H,%M,%S,")
-                else:
-                    line += '%s,' % str(value)
-            data_str += line.rstrip(', ') + '\n'
+            line = _timeFields(row[0]) + "".join(['%s,' % str(value)
+                                                 for value in row[1:]])
+            lines.append(line.rstrip(', ') + '\n')
+        data_str = "".join(lines)
 
         ## Try really hard to write the file.
         try:
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Drives an NWatcher from a Twisted reactor without ever blocking it. Each
+## NWatcher.step() (the database queries and the algorithms) runs in the
+## reactor's thread pool, and the wait before the next step is a callLater
+## instead of a sleep, so an IRC bot stays responsive while the watcher
+## monitors at the full data rate.
+##
+##     driver = NTwistedDriver(watch_server)
+##     driver.start()
+##     reactor.run()
+##
+## The steps run one at a time, but not in the reactor thread. Anything the
+## watcher calls (such as print_msg_fn) that uses Twisted must hand the work
+## to the reactor with reactor.callFromThread; see callInReactor() and
+## examples/bot.py.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:16:21
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+
+## Twisted
+from twisted.internet import threads
+
+## General
+import sys
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def callInReactor(fn, reactor=None):
+    """
+    Wrap a print_msg_fn(msg, tm) so that it runs in the reactor thread. The
+    wrapper returns the message formatted as Logger.print_default does.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+
+    def wrapped(msg, tm):
+        reactor.callFromThread(fn, msg, tm)
+        if tm is not None:
+            return "[%sZ] %s" % (tm, msg)
+        return msg
+
+    return wrapped
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NTwistedDriver(object):
+    """
+    Repeatedly calls watcher.step() in a thread and waits for the delay it
+    returns in the reactor. A step that raises is reported and tried again
+    after `retry_delay` seconds, as a watcher is expected to keep going.
+    """
+
+    def __init__(self, watcher, reactor=None, min_delay=0.01,
+                       retry_delay=10):
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.watcher = watcher
+        self.reactor = reactor
+        self.min_delay = min_delay
+        self.retry_delay = retry_delay
+        self.errors = 0
+
+        self._running = False
+        self._call = None  # The callLater of the next step
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self):
+        """ Start stepping the watcher. """
+        if not self._running:
+            self._running = True
+            self._schedule(0)
+
+    def stop(self):
+        """ Stop after the step in progress, if any. """
+        self._running = False
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+
+    def _schedule(self, delay):
+        self._call = self.reactor.callLater(max(delay, self.min_delay),
+                                            self._step)
+
+    def _step(self):
+        self._call = None
+        if not self._running:
+            return
+
+        deferred = threads.deferToThreadPool(self.reactor,
+                                             self.reactor.getThreadPool(),
+                                             self.watcher.step)
+        deferred.addCallbacks(self._stepped, self._failed)
+
+    def _stepped(self, delay):
+        if self._running:
+            self._schedule(delay or 0)
+
+    def _failed(self, failure):
+        self.errors += 1
+        print >>sys.stderr, ("%s: Watcher step failed: %s"
+                             % (self.__class__.__name__,
+                                failure.getErrorMessage()))
+        if self._running:
+            self._schedule(self.retry_delay)
@@ -0,0 +1,514 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Compressed columns for the data of long flights. Every NVar keeps its
+## times in an NTimeColumn, and its values in an NValueColumn once it is
+## compressed (see NVarSet.compress). Aircraft data is very regular: the
+## times step by the DataRate, and many variables sit on one value, or on
+## the missing value flag, for hours at a time.
+##
+## - NTimeColumn keeps times as runs with a constant step, which is the
+##   delta of delta of the times run length coded. A flight without satcom
+##   outages is one run, and each outage adds one more. The times are whole
+##   seconds, or microseconds once one of them has a fraction of a second.
+## - NValueColumn keeps values in blocks of `block_size`. New values stay in
+##   a list until there is a whole block, which is then coded as runs of
+##   one value if it has few of them, and otherwise as the XOR of each value
+##   with the one before it, as in Facebook's Gorilla. The XORs of a slowly
+##   changing signal are mostly zero bits; instead of packing the bits one
+##   at a time, which is slow in Python, the XORs are split into their eight
+##   byte planes and deflated with zlib, which squeezes the planes of zero
+##   bytes to almost nothing. NULLs are kept as runs of positions beside
+##   either coding. Blocks of values other than floats and None are kept as
+##   they are.
+##
+## Reading a window only decodes the blocks it covers, and the last block
+## decoded is kept, so the newest rows (in the list) and windows that move
+## along a block cost no decoding.
+##
+##     values = NValueColumn(block_size=1024)
+##     values.extend(column)
+##     window = values[start:stop]
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:04:47
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+## Intrapackage imports
+from utils import EPOCH, fromEpoch, toEpoch
+
+from array import array
+import bisect
+import datetime
+import itertools
+import struct
+import zlib
+
+## Values that can be coded, others keep their block as a tuple.
+_CODED_TYPES = frozenset([float, type(None)])
+
+## A block with no more than one run per this many values is run length
+## coded (a run costs 10 bytes).
+_RUN_RATIO = 8
+
+## Ticks per second of a time column with fractions of a second.
+_MICRO = 1000000
+_MICRO_FLOAT = float(_MICRO)
+
+## Rough size in bytes of a block, and of a value not yet in one.
+_BLOCK_BYTES = 100
+_VALUE_BYTES = 32
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def _noneRuns(values):
+    """ The runs of None in `values`, as (first position, after) tuples. """
+    if values.count(None) == 0:
+        return ()
+    nones = bytearray([value is None for value in values])
+    runs = []
+    pos = 0
+    while True:
+        first = nones.find('\x01', pos)
+        if first == -1:
+            break
+        pos = nones.find('\x00', first)
+        if pos == -1:
+            pos = len(nones)
+        runs.append((first, pos))
+    return tuple(runs)
+
+
+def encodeBlock(values):
+    """
+    Code a list of values as one of:
+
+    - ('r', run starts, run values, None runs, count), runs of one value
+    - ('x', deflated XORs, None runs, count), XORs with the value before
+    - ('o', values), when they are not all floats or None
+    """
+    count = len(values)
+    types = set(map(type, values))
+    if not types <= _CODED_TYPES:
+        ## Values of one type (such as the strings of a file) are equal
+        ## only when they are the same value, so can still be runs.
+        if len(types) == 1:
+            starts = [0] + [pos for pos in xrange(1, count)
+                            if values[pos] != values[pos - 1]]
+            if len(starts) * _RUN_RATIO <= count:
+                return ('r', array('H', starts),
+                        tuple([values[pos] for pos in starts]), (), count)
+        return ('o', tuple(values))
+
+    nones = _noneRuns(values)
+    if nones:
+        ## A NULL repeats the value before it, so it XORs to zero.
+        filled = []
+        last = 0.0
+        for value in values:
+            if value is not None:
+                last = value
+            filled.append(last)
+        values = filled
+
+    words = struct.unpack("=%dQ" % count, array('d', values).tostring())
+    xors = [word ^ before for before, word in
+            itertools.izip(words, itertools.islice(words, 1, None))]
+
+    runs = 1 + len(xors) - xors.count(0)
+    if runs * _RUN_RATIO <= count:
+        starts = array('H', [0] + [pos + 1 for pos, xor in enumerate(xors)
+                                   if xor != 0])
+        return ('r', starts, array('d', [values[pos] for pos in starts]),
+                nones, count)
+
+    packed = struct.pack("=%dQ" % count, words[0], *xors)
+    planes = "".join([packed[plane::8] for plane in xrange(8)])
+    return ('x', zlib.compress(planes, 1), nones, count)
+
+
+def decodeBlock(block):
+    """ The list of values of a block coded by encodeBlock. """
+    kind = block[0]
+    if kind == 'o':
+        return list(block[1])
+
+    if kind == 'r':
+        starts, run_values, nones, count = block[1:]
+        stops = starts.tolist()[1:] + [count]
+        values = []
+        for value, start, stop in itertools.izip(run_values, starts, stops):
+            values.extend([value] * (stop - start))
+    else:
+        planes, nones, count = block[1:]
+        planes = zlib.decompress(planes)
+        packed = bytearray(count * 8)
+        for plane in xrange(8):
+            packed[plane::8] = planes[plane * count:(plane + 1) * count]
+
+        words = []
+        word = 0
+        for xor in struct.unpack("=%dQ" % count, str(packed)):
+            word ^= xor
+            words.append(word)
+        values = array('d', struct.pack("=%dQ" % count, *words)).tolist()
+
+    for start, stop in nones:
+        values[start:stop] = [None] * (stop - start)
+    return values
+
+
+def _blockBytes(block):
+    kind = block[0]
+    if kind == 'o':
+        return _VALUE_BYTES * len(block[1])
+    if kind == 'r':
+        return 10 * len(block[1])
+    return len(block[1])
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NTimeColumn(object):
+    """
+    A list like column of increasing times, kept as runs of epoch ticks with
+    a constant step. Positions and slices give datetimes, made as they are
+    asked for, and epochs() the times as seconds since 1970.
+
+    The ticks are whole seconds until a time with a fraction of a second is
+    added, when the column changes to ticks of a microsecond (and epochs()
+    to floats), so data faster than 1 Hz keeps its times.
+    """
+
+    def __init__(self, times=()):
+        self._firsts = array('l')  # Ticks of the first time of each run
+        self._steps = array('l')  # Step of each run, 0 until it has two
+        self._positions = array('l')  # Position of each run's first time
+        self._length = 0
+        self._last = None  # Ticks of the last time
+        self._scale = 1  # Ticks per second, 1 or _MICRO
+        self.extend(times)
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def runs(self):
+        return len(self._firsts)
+
+    @property
+    def size(self):
+        """ Bytes of the column in memory (an estimate). """
+        return _BLOCK_BYTES + 3 * self._firsts.itemsize * self.runs
+
+    def extend(self, times):
+        """
+        Add datetimes, which must increase and be after those already there.
+        If they do not, ValueError is raised and nothing is added.
+        """
+        if self._scale == 1 and not any([tm.microsecond for tm in times]):
+            self._extendTicks([toEpoch(tm) for tm in times], 1)
+        else:
+            self._extendTicks([toEpoch(tm) * _MICRO + tm.microsecond
+                               for tm in times], _MICRO)
+
+    def extendEpochs(self, epochs):
+        """ Add times as seconds since 1970, see extend. """
+        if self._scale == 1 and all([seconds % 1 == 0 for seconds in epochs]):
+            self._extendTicks([int(seconds) for seconds in epochs], 1)
+        else:
+            self._extendTicks([int(round(seconds * _MICRO))
+                               for seconds in epochs], _MICRO)
+
+    def setEpochs(self, epochs):
+        """
+        Replace the times with `epochs`, in place so that whoever shares the
+        column sees them. They are checked as in extend first.
+        """
+        column = NTimeColumn()
+        column.extendEpochs(epochs)
+        self.__dict__.update(column.__dict__)
+
+    def appendEpoch(self, seconds):
+        """ Add a time as seconds since 1970. """
+        self.extendEpochs([seconds])
+
+    def _extendTicks(self, ticks, scale):
+        """
+        Add times as ticks of 1/`scale` seconds, checking all of them before
+        the column is changed.
+        """
+        if len(ticks) == 0:
+            return
+        last = self._last
+        if last is not None:
+            last *= scale // self._scale
+        for tick in ticks:
+            if last is not None and tick <= last:
+                raise ValueError('%s: times must increase, %s is not after '
+                                 '%s' % (self.__class__.__name__,
+                                         self._datetime(tick, scale),
+                                         self._datetime(last, scale)))
+            last = tick
+
+        if scale != self._scale:
+            self._toMicro()
+        for tick in ticks:
+            self._appendTick(tick)
+
+    def _toMicro(self):
+        """ Change the ticks from seconds to microseconds. """
+        self._firsts = array('l', [first * _MICRO for first in self._firsts])
+        self._steps = array('l', [step * _MICRO for step in self._steps])
+        if self._last is not None:
+            self._last *= _MICRO
+        self._scale = _MICRO
+
+    def _appendTick(self, tick):
+        last = self._last
+        if last is not None:
+            run = len(self._firsts) - 1
+            step = self._steps[run]
+            if step == 0:
+                self._steps[run] = tick - last
+                step = tick - last
+            if tick - last == step:
+                self._last = tick
+                self._length += 1
+                return
+
+        self._firsts.append(tick)
+        self._steps.append(0)
+        self._positions.append(self._length)
+        self._last = tick
+        self._length += 1
+
+    def _datetime(self, tick, scale=None):
+        if (scale or self._scale) == 1:
+            return fromEpoch(tick)
+        return EPOCH + datetime.timedelta(microseconds=tick)
+
+    def _runStop(self, run):
+        if run + 1 < len(self._positions):
+            return self._positions[run + 1]
+        return self._length
+
+    def find(self, tm):
+        """ The position of the datetime `tm`, -1 if it is not there. """
+        if self._scale == 1:
+            if tm.microsecond != 0:
+                return -1
+            return self._findTick(toEpoch(tm))
+        return self._findTick(toEpoch(tm) * _MICRO + tm.microsecond)
+
+    def findEpoch(self, seconds):
+        """ The position of the time `seconds` since 1970, -1 if none. """
+        if self._scale == 1:
+            if seconds % 1 != 0:
+                return -1
+            return self._findTick(int(seconds))
+        return self._findTick(int(round(seconds * _MICRO)))
+
+    def _findTick(self, tick):
+        run = bisect.bisect_right(self._firsts, tick) - 1
+        if run < 0:
+            return -1
+        offset = tick - self._firsts[run]
+        if offset == 0:
+            return self._positions[run]
+        step = self._steps[run]
+        if step == 0 or offset % step != 0:
+            return -1
+        pos = self._positions[run] + offset // step
+        return pos if pos < self._runStop(run) else -1
+
+    def epochs(self, start=0, stop=None):
+        """
+        The times of positions `start` to `stop` in an array('l'), or of
+        floats in an array('d') once the column has fractions of a second.
+        """
+        if self._scale == 1:
+            return self._ticks(start, stop)
+        return array('d', [tick / _MICRO_FLOAT
+                           for tick in self._ticks(start, stop)])
+
+    def _ticks(self, start=0, stop=None):
+        start, stop, step = slice(start, stop).indices(self._length)
+        epochs = array('l')
+        run = bisect.bisect_right(self._positions, start) - 1
+        pos = start
+        while pos < stop:
+            run_stop = min(stop, self._runStop(run))
+            step = self._steps[run]
+            first = self._firsts[run] + (pos - self._positions[run]) * step
+            if step == 0:
+                epochs.append(first)
+            else:
+                epochs.extend(xrange(first, first + (run_stop - pos) * step,
+                                     step))
+            pos = run_stop
+            run += 1
+        return epochs
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(self._length)
+            if step != 1:
+                return self[start:stop][::step]
+            if self._scale == 1:
+                return [fromEpoch(seconds)
+                        for seconds in self._ticks(start, stop)]
+            return [self._datetime(tick)
+                    for tick in self._ticks(start, stop)]
+
+        if item < 0:
+            item += self._length
+        if not 0 <= item < self._length:
+            raise IndexError('%s index out of range'
+                             % self.__class__.__name__)
+        run = bisect.bisect_right(self._positions, item) - 1
+        return self._datetime(self._firsts[run] +
+                              (item - self._positions[run]) *
+                              self._steps[run])
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+class NValueColumn(object):
+    """
+    A list like column of values, coded a block of `block_size` values at a
+    time as in the module description. Values are added with append and
+    extend, read by position or slice and changed with setValues.
+    """
+
+    def __init__(self, values=(), block_size=1024):
+        if not 1 <= block_size <= 65536:
+            raise ValueError('%s: block_size must be from 1 to 65536'
+                             % self.__class__.__name__)
+        self.block_size = block_size
+        self._blocks = []
+        self._sealed = 0  # Values in the blocks
+        self._tail = []  # Values after the last block
+        self._decoded = (None, None)  # (block, values) of the last decoded
+        self.extend(values)
+
+    def __len__(self):
+        return self._sealed + len(self._tail)
+
+    @property
+    def size(self):
+        """ Bytes of the column in memory (an estimate). """
+        size = _BLOCK_BYTES + _VALUE_BYTES * len(self._tail)
+        for block in self._blocks:
+            size += _BLOCK_BYTES + _blockBytes(block)
+        return size
+
+    def append(self, value):
+        self._tail.append(value)
+        if len(self._tail) >= self.block_size:
+            self._seal()
+
+    def extend(self, values):
+        self._tail.extend(values)
+        if len(self._tail) >= self.block_size:
+            self._seal()
+
+    def _seal(self):
+        """ Code the whole blocks of the tail. """
+        size = self.block_size
+        tail = self._tail
+        pos = 0
+        while len(tail) - pos >= size:
+            self._blocks.append(encodeBlock(tail[pos:pos + size]))
+            pos += size
+        self._sealed += pos
+        self._tail = tail[pos:]
+
+    def _block(self, number):
+        """ The values of a coded block, decoding it if it is not the last. """
+        if self._decoded[0] != number:
+            self._decoded = (number, decodeBlock(self._blocks[number]))
+        return self._decoded[1]
+
+    def _position(self, pos):
+        length = self._sealed + len(self._tail)
+        if pos < 0:
+            pos += length
+        if not 0 <= pos < length:
+            raise IndexError('%s index out of range'
+                             % self.__class__.__name__)
+        return pos
+
+    def __getitem__(self, item):
+        sealed = self._sealed
+        if isinstance(item, slice):
+            start, stop, step = item.indices(sealed + len(self._tail))
+            if step != 1:
+                return self[start:stop][::step]
+            if start >= sealed:  # Only the newest values
+                return self._tail[start - sealed:stop - sealed]
+            return self._window(start, stop)
+
+        pos = self._position(item)
+        if pos >= sealed:
+            return self._tail[pos - sealed]
+        return self._block(pos // self.block_size)[pos % self.block_size]
+
+    def _window(self, start, stop):
+        size = self.block_size
+        sealed = self._sealed
+        values = []
+        pos = start
+        while pos < min(stop, sealed):
+            number = pos // size
+            first = number * size
+            values.extend(self._block(number)[pos - first:
+                                              min(stop, first + size) - first])
+            pos = first + size
+        if stop > sealed:
+            values.extend(self._tail[max(start, sealed) - sealed:
+                                     stop - sealed])
+        return values
+
+    def __setitem__(self, pos, value):
+        self.setValues([pos], [value])
+
+    def setValues(self, positions, values):
+        """
+        Change the values at `positions`, recoding each block changed once.
+        """
+        size = self.block_size
+        sealed = self._sealed
+        changed = {}  # {block: values}
+        for pos, value in itertools.izip(positions, values):
+            pos = self._position(pos)
+            if pos >= sealed:
+                self._tail[pos - sealed] = value
+                continue
+            number = pos // size
+            if number not in changed:
+                changed[number] = list(self._block(number))
+            changed[number][pos - number * size] = value
+
+        for number, block in changed.iteritems():
+            self._blocks[number] = encodeBlock(block)
+        if len(changed) != 0:
+            self._decoded = (None, None)
+
+    def __iter__(self):
+        for block in self._blocks:
+            for value in decodeBlock(block):
+                yield value
+        for value in list(self._tail):
+            yield value
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Structured log events of a flight. Every message an algorithm prints
+## through the watcher's Logger is also recorded as an NEvent with its time,
+## the algorithm that raised it, the variable it is about, a severity and the
+## kind of transition (such as "missing" and "missing cleared" from the bad
+## data checks), so nothing has to re-parse the "[time Z] message" strings.
+##
+## NEventLog stores the events in columns: the times as an array of seconds
+## and everything else as small integer ids into tables of the distinct
+## strings, which keeps hundreds of variables flapping on missing data cheap.
+## Events are indexed on time and on variable, so
+##
+##     log.events.query(variable='coraw_al', start=takeoff, stop=landing)
+##
+## only touches the events asked for. join() pairs each event with the row of
+## an NVarSet at its time, and save()/loadEventLog() write and read a log as
+## one small JSON file.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:11:41
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+
+## Intrapackage
+from data import _alignPositions
+from utils import fromEpoch, toSeconds
+
+## Data structures
+from array import array
+from collections import namedtuple
+
+## General
+import bisect
+import json
+
+INFO = "info"
+WARNING = "warning"
+ERROR = "error"
+
+## Kind of an event that did not say what it was.
+MESSAGE = "message"
+
+NEvent = namedtuple('NEvent', ['time', 'algorithm', 'variable', 'severity',
+                               'kind', 'message'])
+
+## The string columns of an NEvent, each stored as ids into a table.
+_FIELDS = ('algorithm', 'variable', 'severity', 'kind', 'message')
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def loadEventLog(file_name):
+    """ Read an NEventLog written by NEventLog.save(). """
+    f = open(file_name, 'r')
+    try:
+        stored = json.load(f)
+    finally:
+        f.close()
+
+    log = NEventLog()
+    tables = stored['tables']
+    for seconds, ids in zip(stored['times'], zip(*stored['columns'])):
+        log._append(seconds, [tables[field][id]
+                              for field, id in zip(_FIELDS, ids)])
+    return log
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NEventLog(object):
+    """
+    A compact store of NEvents, queryable by variable and time range. Events
+    can be added in any order; they are always returned in time order (and
+    in the order they were added for equal times).
+    """
+
+    def __init__(self):
+        self._times = array('d')  # Seconds since 1970, see utils.toSeconds
+        self._columns = dict([(field, array('i')) for field in _FIELDS])
+        self._tables = dict([(field, []) for field in _FIELDS])
+        self._ids = dict([(field, {}) for field in _FIELDS])
+
+        ## Time index, positions sorted on time.
+        self._order_times = array('d')
+        self._order = array('i')
+
+        ## Per variable index, {variable id: (times, positions)}.
+        self._by_variable = {}
+
+    def __len__(self):
+        return len(self._times)
+
+    def __iter__(self):
+        return iter(self.query())
+
+    def add(self, tm, message, algorithm=None, variable=None,
+                  severity=INFO, kind=MESSAGE):
+        """ Record an event at the datetime `tm`. """
+        self._append(toSeconds(tm), (algorithm, variable, severity, kind,
+                                    message))
+
+    def _append(self, seconds, values):
+        pos = len(self._times)
+        self._times.append(seconds)
+        for field, value in zip(_FIELDS, values):
+            ids = self._ids[field]
+            if value not in ids:
+                ids[value] = len(self._tables[field])
+                self._tables[field].append(value)
+            self._columns[field].append(ids[value])
+
+        self.__insert(self._order_times, self._order, seconds, pos)
+
+        variable = self._columns['variable'][pos]
+        if variable not in self._by_variable:
+            self._by_variable[variable] = (array('d'), array('i'))
+        times, positions = self._by_variable[variable]
+        self.__insert(times, positions, seconds, pos)
+
+    def __insert(self, times, positions, seconds, pos):
+        """ Keep an index sorted, events nearly always arrive in order. """
+        if len(times) == 0 or times[-1] <= seconds:
+            times.append(seconds)
+            positions.append(pos)
+        else:
+            index = bisect.bisect_right(times, seconds)
+            times.insert(index, seconds)
+            positions.insert(index, pos)
+
+    def _event(self, pos):
+        return NEvent(fromEpoch(self._times[pos]),
+                      *[self._tables[field][self._columns[field][pos]]
+                        for field in _FIELDS])
+
+    def query(self, variable=None, start=None, stop=None,
+                    algorithm=None, severity=None, kind=None):
+        """
+        Events with start <= time <= stop (datetimes, None for no limit),
+        optionally only those of one variable, algorithm, severity or kind.
+        """
+        if variable is not None:
+            variable_id = self._ids['variable'].get(variable)
+            if variable_id is None:
+                return []
+            times, positions = self._by_variable[variable_id]
+        else:
+            times, positions = self._order_times, self._order
+
+        lo = (bisect.bisect_left(times, toSeconds(start))
+              if start is not None else 0)
+        hi = (bisect.bisect_right(times, toSeconds(stop))
+              if stop is not None else len(times))
+
+        filters = []
+        for field, value in (('algorithm', algorithm),
+                             ('severity', severity),
+                             ('kind', kind)):
+            if value is not None:
+                if value not in self._ids[field]:
+                    return []
+                filters.append((self._columns[field], self._ids[field][value]))
+
+        events = []
+        for index in xrange(lo, hi):
+            pos = positions[index]
+            if all([column[pos] == id for column, id in filters]):
+                events.append(self._event(pos))
+        return events
+
+    @property
+    def variables(self):
+        """ The variables that have events. """
+        return [variable for variable in self._tables['variable']
+                if variable is not None]
+
+    def join(self, nset, names=None, **query):
+        """
+        Pair each event (selected as for query()) with the values of the
+        NVarSet `nset` at the event's time: the last row at or before it, or
+        None if the set has no row that early. `names` picks the variables,
+        by default all of the set's.
+        """
+        if names is None:
+            names = nset.keys()
+        variables = [nset.getNVar(name) for name in names]
+
+        events = self.query(**query)
+        times = nset._time._times[:]
+        positions = _alignPositions(times, [event.time for event in events])
+
+        return [(event, tuple([var[pos] for var in variables])
+                        if pos != -1 else None)
+                for event, pos in zip(events, positions)]
+
+    def save(self, file_name):
+        """ Write the log as one JSON object, see loadEventLog. """
+        stored = {'times': self._times.tolist(),
+                  'columns': [self._columns[field].tolist()
+                              for field in _FIELDS],
+                  'tables': self._tables}
+        f = open(file_name, 'w')
+        try:
+            json.dump(stored, f, separators=(',', ':'))
+        finally:
+            f.close()
@@ -0,0 +1,397 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Share one poller of the real time database with many local clients. An
+## NFanoutServer republishes every batch of rows that an
+## NDatabaseLiveUpdater fetches over a local socket, and an NFanoutSubscriber
+## turns the stream back into an NVarSet, so the monitor, the IRC bot and any
+## analysis scripts cost the server a single poll between them.
+##
+##     watcher = NWatcher(database="GV", fanout="/tmp/gv.sock")   # Publisher
+##
+##     subscriber = NFanoutSubscriber("/tmp/gv.sock", ['ggalt', 'tasx'])
+##     while True:
+##         subscriber.poll(timeout=10)
+##         print subscriber.variables
+##
+## The stream is a series of frames, each a one character kind and the
+## length of the payload (struct "!cI") followed by the payload:
+##
+## - "N", the variable names of the rows that follow, separated by newlines.
+## - "R", the number of rows ("!I") and then every row as doubles, the time
+##   in seconds since 1970 followed by the values (NaN for NULL).
+##
+## Rows are only published, and only added by a subscriber, when they are
+## newer than the last ones, so a batch that overlaps the one before it
+## (such as the preflight hour sent again when a flight starts) is not
+## added twice.
+##
+## A new subscriber is first sent the last `backlog` rows. Each subscriber
+## has its own queue of frames and thread sending them, so publishing never
+## waits on a subscriber; one that falls too far behind is disconnected.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:28:37
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+
+## Intrapackage
+from data import NVarSet
+from utils import fromEpoch, toSeconds
+
+## Networking
+import select
+import socket
+import struct
+import threading
+import Queue
+
+## General
+from collections import deque
+import os
+import sys
+
+_HEADER = struct.Struct("!cI")
+_COUNT = struct.Struct("!I")
+
+_NAN = float('nan')
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def _socket(address):
+    """ A TCP socket for a (host, port) address, a unix socket for a path. """
+    if isinstance(address, tuple):
+        return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+def _frame(kind, payload):
+    return _HEADER.pack(kind, len(payload)) + payload
+
+
+def encodeNames(names):
+    return _frame("N", "\n".join(names))
+
+
+def _double(value):
+    """ `value` as a float, NaN if it is NULL or not a number. """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _NAN
+
+
+def encodeRows(rows, width):
+    """
+    Frame rows of (datetime or epoch seconds, value, ...) with `width`
+    values each, times sent as seconds since 1970. Values that are not
+    numbers are sent as NULL.
+    """
+    values = []
+    for row in rows:
+        values.append(toSeconds(row[0]))
+        values.extend([_double(value) for value in row[1:width + 1]])
+    return _frame("R", _COUNT.pack(len(rows)) +
+                       struct.pack("!%dd" % len(values), *values))
+
+
+def decodeRows(payload, width):
+    """ The rows of an "R" frame payload with `width` values each. """
+    count = _COUNT.unpack_from(payload)[0]
+    values = struct.unpack_from("!%dd" % (count * (width + 1)), payload,
+                                _COUNT.size)
+    rows = []
+    for pos in xrange(0, len(values), width + 1):
+        row = (fromEpoch(values[pos]),)
+        rows.append(row + tuple([value if value == value else None
+                                 for value in values[pos + 1:
+                                                     pos + width + 1]]))
+    return rows
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class _NFanoutClient(object):
+    """
+    A client of an NFanoutServer and the thread sending it its frames, at
+    most `max_frames` of which wait to be sent.
+    """
+
+    def __init__(self, client, timeout, max_frames):
+        self.socket = client
+        self.socket.settimeout(timeout)
+        self.error = None  # Why sending failed
+
+        self._queue = Queue.Queue(max_frames)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, frames):
+        """ Queue `frames`, False if the client has fallen behind or gone. """
+        if self.error is not None:
+            return False
+        try:
+            self._queue.put_nowait(frames)
+        except Queue.Full:
+            self.error = "too far behind"
+            return False
+        return True
+
+    def _run(self):
+        """ Sending thread, runs until close() or a send fails. """
+        try:
+            while True:
+                frames = self._queue.get()
+                if frames is None:
+                    return
+                try:
+                    self.socket.sendall(frames)
+                except socket.error, e:
+                    self.error = self.error or str(e)
+                    return
+        finally:
+            self.socket.close()
+
+    def close(self):
+        """
+        Stop once the queued frames are sent, straight away if the client
+        has fallen behind.
+        """
+        try:
+            self._queue.put_nowait(None)
+        except Queue.Full:
+            pass
+        if self.error is not None:
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def join(self):
+        self._thread.join()
+
+
+class NFanoutServer(object):
+    """
+    Publish batches of rows to every client connected to `address`, a
+    (host, port) tuple or the path of a unix socket. Add publish() as a
+    listener of an NDatabaseLiveUpdater, or give NWatcher `fanout`.
+
+    publish() only queues the rows for each client, which are sent from a
+    thread of their own with a `timeout`. A client with more than
+    `max_frames` batches waiting, or that has gone away, is disconnected so
+    it never holds up the poller.
+    """
+
+    def __init__(self, address, backlog=1200, timeout=1.0, max_frames=100):
+        self.address = address
+        self.timeout = timeout
+        self.max_frames = max_frames
+
+        self._names = None
+        self._last = None  # Time of the newest row published, epoch seconds
+        self._backlog = deque(maxlen=backlog)
+        self._clients = []
+        self._lock = threading.Lock()
+
+        if not isinstance(address, tuple) and os.path.exists(address):
+            os.remove(address)  # Left over from an earlier server
+        self._socket = _socket(address)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(address)
+        self._socket.listen(5)
+
+        self._thread = threading.Thread(target=self._accept)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+    def _accept(self):
+        """ Accept clients until closed, sending each the backlog. """
+        while True:
+            try:
+                client, address = self._socket.accept()
+            except socket.error:
+                return
+            client = _NFanoutClient(client, self.timeout, self.max_frames)
+
+            self._lock.acquire()
+            try:
+                if self._names is not None:
+                    client.send(encodeNames(self._names) +
+                                encodeRows(self._backlog, len(self._names)))
+                self._clients.append(client)
+            finally:
+                self._lock.release()
+
+    def publish(self, names, rows):
+        """
+        Send rows of (datetime or epoch seconds, value, ...) for the
+        variables `names`, in time order. Rows no newer than the last one
+        published are left out.
+        """
+        if self._last is not None:
+            pos = 0
+            while pos < len(rows) and toSeconds(rows[pos][0]) <= self._last:
+                pos += 1
+            if pos != 0:
+                rows = rows[pos:]
+        if len(rows) == 0:
+            return
+
+        names = list(names)
+        try:
+            data = encodeRows(rows, len(names))
+        except Exception, e:
+            print >>sys.stderr, ("%s: Could not encode rows: %s"
+                                 % (self.__class__.__name__, e))
+            return
+        self._last = toSeconds(rows[-1][0])
+
+        self._lock.acquire()
+        try:
+            frames = ""
+            if names != self._names:
+                ## The backlog only ever has rows of the current names.
+                self._names = names
+                self._backlog.clear()
+                frames = encodeNames(names)
+            frames += data
+            self._backlog.extend(rows)
+
+            for client in list(self._clients):
+                if not client.send(frames):
+                    print >>sys.stderr, ("%s: Dropped a client: %s"
+                                         % (self.__class__.__name__,
+                                            client.error))
+                    self._clients.remove(client)
+                    client.close()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """ Stop accepting clients and disconnect the ones there are. """
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._socket.close()
+        self._thread.join()
+
+        self._lock.acquire()
+        try:
+            clients = self._clients
+            self._clients = []
+        finally:
+            self._lock.release()
+        for client in clients:
+            client.close()
+        for client in clients:
+            client.join()
+
+        if not isinstance(self.address, tuple) and \
+           os.path.exists(self.address):
+            os.remove(self.address)
+
+
+class NFanoutSubscriber(object):
+    """
+    Receive the rows published by an NFanoutServer at `address` into
+    `variables`, an NVarSet of the variable `names` (by default those of the
+    first rows received; None before then). A variable that is not
+    published is None. Rows no newer than the last one added are dropped.
+    """
+
+    def __init__(self, address, names=None):
+        self.address = address
+        self.variables = NVarSet(list(names)) if names else None
+
+        self._names = None  # Of the rows being received
+        self._positions = None  # Of the set's variables in those rows
+        self._last = None  # Time of the newest row added
+        self._buffer = ""
+
+        self._socket = _socket(address)
+        self._socket.connect(address)
+
+    def fileno(self):
+        """ So a subscriber can be given to select() directly. """
+        return self._socket.fileno()
+
+    def poll(self, timeout=0):
+        """
+        Add the rows that have arrived, waiting up to `timeout` seconds for
+        some (None waits until there are). Returns the number of rows added.
+        Raises EOFError once the server has gone away.
+        """
+        readable = select.select([self._socket], [], [], timeout)[0]
+        if not readable:
+            return 0
+
+        data = self._socket.recv(1 << 16)
+        if data == "":
+            raise EOFError('%s: server closed the connection'
+                           % self.__class__.__name__)
+        self._buffer += data
+        return self._consume()
+
+    def _consume(self):
+        """ Decode every whole frame in the buffer. """
+        added = 0
+        pos = 0
+        while len(self._buffer) - pos >= _HEADER.size:
+            kind, length = _HEADER.unpack_from(self._buffer, pos)
+            start = pos + _HEADER.size
+            if len(self._buffer) - start < length:
+                break
+            payload = self._buffer[start:start + length]
+            pos = start + length
+
+            if kind == "N":
+                self._setNames(payload.split("\n"))
+            elif kind == "R":
+                rows = decodeRows(payload, len(self._names))
+                if self._last is not None:
+                    rows = [row for row in rows if row[0] > self._last]
+                if len(rows) == 0:
+                    continue
+                if self._positions is not None:
+                    rows = [(row[0],) +
+                            tuple([row[p] if p is not None else None
+                                   for p in self._positions])
+                            for row in rows]
+                self.variables.addData(rows)
+                self._last = rows[-1][0]
+                added += len(rows)
+
+        self._buffer = self._buffer[pos:]
+        return added
+
+    def _setNames(self, names):
+        self._names = names
+        if self.variables is None:
+            self.variables = NVarSet(list(names))
+
+        keys = self.variables.keys()
+        if keys == names:
+            self._positions = None
+        else:
+            self._positions = [names.index(key) + 1 if key in names else None
+                               for key in keys]
+
+    def close(self):
+        self._socket.close()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## The data of a flight in progress as columns in a memory mapped file, so
+## other processes on the host can read it as soon as the watcher has it,
+## without asking the database or waiting for the output file. Put the file
+## on a memory file system such as /dev/shm to keep it out of the disk.
+##
+##     watcher = NWatcher(database="GV", shared="/dev/shm/gv.columns")
+##
+##     reader = NSharedReader("/dev/shm/gv.columns")
+##     altitude = reader.view('ggalt')       # Doubles, shares the memory
+##     rows = reader.rows(start=len(reader) - 10)
+##
+## The file has a header (the struct _HEADER then the variable names), then
+## one column of `capacity` native doubles for the time (seconds since 1970)
+## and one for each variable (NaN for NULL). There is a single writer, which
+## fills in the new rows of every column before it moves the row count in
+## the header on, so a reader never sees a row that is not all there and
+## needs no lock.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:29:58
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+## Intrapackage imports
+from utils import fromEpoch, toSeconds
+
+import mmap
+import os
+import struct
+import sys
+
+## Magic, version, number of variables, capacity in rows, row count and the
+## length of the names. The row count is 8 byte aligned.
+_HEADER = struct.Struct("=4sIIIQI")
+_MAGIC = "NCSC"
+_VERSION = 1
+_COUNT_OFFSET = 16
+_COUNT = struct.Struct("=Q")
+
+_NAN = float('nan')
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def _dataOffset(names_length):
+    """ Where the columns start, 8 byte aligned. """
+    return (_HEADER.size + names_length + 7) // 8 * 8
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NSharedColumns(object):
+    """
+    Write rows into a new shared column file at `path` (replacing any file
+    there) with room for `capacity` rows of the variables `names`. Rows
+    past the capacity are left out.
+    """
+
+    def __init__(self, path, names, capacity=43200):
+        self.path = path
+        self.names = list(names)
+        self.capacity = capacity
+        self._count = 0
+        self._full = False
+
+        names_block = "\n".join(self.names)
+        self._data_offset = _dataOffset(len(names_block))
+        size = self._data_offset + (len(self.names) + 1) * capacity * 8
+
+        ## Readers of a previous file keep it, they see a new one by its
+        ## inode (NSharedReader.replaced).
+        if os.path.exists(path):
+            os.remove(path)
+        f = open(path, 'w+b')
+        try:
+            f.truncate(size)
+            self._map = mmap.mmap(f.fileno(), size)
+        finally:
+            f.close()
+
+        _HEADER.pack_into(self._map, 0, _MAGIC, _VERSION, len(self.names),
+                          capacity, 0, len(names_block))
+        self._map[_HEADER.size:_HEADER.size + len(names_block)] = names_block
+
+    def __len__(self):
+        return self._count
+
+    def append(self, names, rows):
+        """
+        Add rows of (datetime or epoch seconds, value, ...) for the
+        variables `names`, which are matched to the file's by name (others
+        are NaN). Has the signature of an NDatabaseLiveUpdater listener.
+        """
+        room = self.capacity - self._count
+        if len(rows) > room:
+            if not self._full:
+                self._full = True
+                print >>sys.stderr, ("%s: %s is full, leaving out rows"
+                                     % (self.__class__.__name__, self.path))
+            rows = rows[:room]
+        if len(rows) == 0:
+            return
+
+        pos_of_name = dict([(name, pos + 1)
+                            for pos, name in enumerate(names)])
+        columns = [[toSeconds(row[0]) for row in rows]]
+        for name in self.names:
+            pos = pos_of_name.get(name)
+            if pos is None:
+                columns.append([_NAN] * len(rows))
+            else:
+                columns.append([row[pos] if row[pos] is not None else _NAN
+                                for row in rows])
+
+        fmt = "=%dd" % len(rows)
+        for column, values in enumerate(columns):
+            struct.pack_into(fmt, self._map,
+                             self._data_offset +
+                               (column * self.capacity + self._count) * 8,
+                             *values)
+
+        ## Only now are the rows there to be read.
+        self._count += len(rows)
+        _COUNT.pack_into(self._map, _COUNT_OFFSET, self._count)
+
+    def close(self):
+        """ Unmap the file, which stays for the readers. """
+        self._map.close()
+
+
+class NSharedReader(object):
+    """
+    Read the shared column file at `path` written by an NSharedColumns, as
+    it is written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        f = open(path, 'rb')
+        try:
+            self._inode = os.fstat(f.fileno()).st_ino
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+
+        (magic, version, width, self.capacity,
+         count, names_length) = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('%s: %s is not a shared column file'
+                             % (self.__class__.__name__, path))
+        names_block = self._map[_HEADER.size:_HEADER.size + names_length]
+        self.names = names_block.split("\n") if width != 0 else []
+        self._columns = dict([(name, pos + 1)
+                              for pos, name in enumerate(self.names)])
+        self._data_offset = _dataOffset(names_length)
+
+    def __len__(self):
+        """ The number of rows written so far. """
+        return _COUNT.unpack_from(self._map, _COUNT_OFFSET)[0]
+
+    @property
+    def replaced(self):
+        """
+        Whether the writer has started a new file, such as for a flight.
+        """
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except OSError:
+            return True
+
+    def _range(self, start, stop):
+        count = len(self)
+        start, stop, step = slice(start, stop).indices(count)
+        return start, max(start, stop)
+
+    def view(self, name, start=0, stop=None):
+        """
+        The values of a variable (or 'datetime', as seconds since 1970) as a
+        read only buffer of native doubles over the shared memory, such as
+        for array.array('d').fromstring or numpy.frombuffer.
+        """
+        column = 0 if name == 'datetime' else self._columns[name]
+        start, stop = self._range(start, stop)
+        offset = self._data_offset + (column * self.capacity + start) * 8
+        return buffer(self._map, offset, (stop - start) * 8)
+
+    def _values(self, column, start, stop):
+        return struct.unpack_from("=%dd" % (stop - start), self._map,
+                                  self._data_offset +
+                                    (column * self.capacity + start) * 8)
+
+    def rows(self, start=0, stop=None, names=None):
+        """
+        Rows of (datetime, value, ...) for `names` (by default all), with
+        None for NULL, as NVarSet.addData takes them.
+        """
+        start, stop = self._range(start, stop)
+        if names is None:
+            names = self.names
+        times = [fromEpoch(seconds)
+                 for seconds in self._values(0, start, stop)]
+        columns = [[value if value == value else None
+                    for value in self._values(self._columns[name],
+                                              start, stop)]
+                   for name in names]
+        return zip(times, *columns)
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Output sinks for the watcher. A sink receives two things: the log messages
+## of a flight (message(msg, tm)) and the artifacts of a finished flight
+## (artifact(flight_info, file_names, body), the output files and the log as
+## would be emailed). NFunctionSink adapts the classic print_msg_fn and
+## email_fn functions, and NFileSink and NSocketSink write one line per item
+## to a local file or socket, which is handy for testing.
+##
+## Any sink can be wrapped in an NQueuedSink, which hands items to a
+## background thread so that a slow chat server or SMTP connection never
+## holds up the polling of data. Failed deliveries are retried with a growing
+## delay, and the queue is bounded so that a sink that has stopped working
+## cannot use up all of the memory (see `overflow`).
+##
+##     sink = NQueuedSink(NFunctionSink(email_fn=functions.sendMail),
+##                        retries=5)
+##     sink.artifact(flight_info, [file_name], "Data attached")
+##     ...
+##     sink.close()  # Waits for the mail to go out
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:14:41
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+
+## Background delivery
+import Queue
+import threading
+
+## General
+import socket
+import sys
+import time
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NSink(object):
+    """
+    Base class of the sinks, which ignores everything. Subclasses override
+    message and/or artifact; both may raise an exception on failure.
+    """
+
+    def message(self, msg, tm):
+        """
+        Deliver a log message `msg` about the time `tm` (None if it has no
+        time). Returns the message as delivered.
+        """
+        return None
+
+    def artifact(self, flight_info, file_names, body):
+        """ Deliver the files of a finished flight with a message body. """
+        pass
+
+    def flush(self):
+        """ Wait until everything sent has been delivered. """
+        pass
+
+    def close(self):
+        """ Deliver everything and release any resources. """
+        self.flush()
+
+
+class NFunctionSink(NSink):
+    """
+    Deliver through functions with the signatures of NWatcher's
+    print_msg_fn(msg, tm) and email_fn(flight_info, file_names, body).
+    """
+
+    def __init__(self, print_msg_fn=None, email_fn=None):
+        self.print_msg_fn = print_msg_fn
+        self.email_fn = email_fn
+
+    def message(self, msg, tm):
+        if self.print_msg_fn is not None:
+            return self.print_msg_fn(msg, tm)
+
+    def artifact(self, flight_info, file_names, body):
+        if self.email_fn is not None:
+            self.email_fn(flight_info, file_names, body)
+
+
+class _NLineSink(NSink):
+    """ A sink that writes every item as one line of text. """
+
+    def message(self, msg, tm):
+        if tm is not None:
+            formatted_msg = "[%sZ] %s" % (tm, msg)
+        else:
+            formatted_msg = msg
+        self._write(formatted_msg + "\n")
+        return formatted_msg
+
+    def artifact(self, flight_info, file_names, body):
+        flight = "-".join([str(flight_info.get('ProjectNumber', '')),
+                           str(flight_info.get('FlightNumber', ''))])
+        self._write("Artifact %s: %s (%s)\n"
+                    % (flight, ", ".join(file_names),
+                       body.split("\n")[0] if body else ""))
+
+    def _write(self, line):
+        raise NotImplementedError
+
+
+class NFileSink(_NLineSink):
+    """ Append every message and artifact to a text file. """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def _write(self, line):
+        f = open(self.file_name, 'a')
+        try:
+            f.write(line)
+        finally:
+            f.close()
+
+
+class NSocketSink(_NLineSink):
+    """
+    Send every message and artifact as a line of text over a socket, either
+    TCP when `address` is a (host, port) tuple or a unix socket when it is a
+    path. The connection is made when first needed and made again after a
+    failure (the failure itself is raised, so an NQueuedSink retries it).
+    """
+
+    def __init__(self, address, timeout=10):
+        self.address = address
+        self.timeout = timeout
+        self._socket = None
+
+    def _connect(self):
+        if isinstance(self.address, tuple):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.address)
+        self._socket = sock
+
+    def _write(self, line):
+        if self._socket is None:
+            self._connect()
+        try:
+            self._socket.sendall(line)
+        except socket.error:
+            self.close()
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except socket.error:
+                pass
+            self._socket = None
+
+
+class NQueuedSink(NSink):
+    """
+    Deliver to another sink from a background thread. message() and
+    artifact() only queue the item and return straight away (message
+    returns None; give `on_message` to receive what the sink returns).
+
+    A delivery that raises is tried again up to `retries` times, waiting
+    `retry_delay` seconds and doubling the wait each time. At most
+    `max_queue` items wait for delivery; when the queue is full, `overflow`
+    decides between dropping the new item ("drop", counted in `dropped`) and
+    waiting for room ("block").
+    """
+
+    def __init__(self, sink, max_queue=10000, retries=3, retry_delay=1.0,
+                       overflow="drop", on_message=None):
+        if overflow not in ("drop", "block"):
+            raise ValueError('%s: overflow must be "drop" or "block"'
+                             % self.__class__.__name__)
+
+        self.sink = sink
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.overflow = overflow
+        self.on_message = on_message
+
+        self.dropped = 0  # Items not queued as the queue was full
+        self.failed = 0  # Items that could not be delivered
+
+        self._queue = Queue.Queue(max_queue)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def message(self, msg, tm):
+        self._put(('message', (msg, tm)))
+
+    def artifact(self, flight_info, file_names, body):
+        self._put(('artifact', (flight_info, file_names, body)))
+
+    def _put(self, item):
+        if self._thread is None:
+            raise ValueError('%s: sink is closed' % self.__class__.__name__)
+
+        if self.overflow == "block":
+            self._queue.put(item)
+            return
+
+        try:
+            self._queue.put_nowait(item)
+        except Queue.Full:
+            self.dropped += 1
+            print >>sys.stderr, ("%s: Queue full, dropped %s"
+                                 % (self.__class__.__name__, item[0]))
+
+    def _run(self):
+        """ Delivery thread, runs until close() queues None. """
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._deliver(*item)
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, kind, args):
+        for attempt in xrange(self.retries + 1):
+            try:
+                result = getattr(self.sink, kind)(*args)
+            except Exception, e:
+                if attempt == self.retries:
+                    self.failed += 1
+                    print >>sys.stderr, ("%s: Could not deliver %s: %s"
+                                         % (self.__class__.__name__, kind, e))
+                    return
+                time.sleep(self.retry_delay * 2 ** attempt)
+            else:
+                if kind == 'message' and self.on_message is not None:
+                    self.on_message(result)
+                return
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+        self.sink.flush()
+
+    def close(self):
+        """ Deliver everything queued, then stop the thread. """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self.sink.close()
@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Incremental statistics that can be attached to the columns of an NVarSet.
+## Each aggregator is fed one (datetime, value) pair at a time through add()
+## and keeps just enough state to answer its query in constant time, so an
+## algorithm does not need to re-slice its variables every time a new point
+## arrives.
+##
+## Windows can either be a number of samples (`size=20`) or a span of time
+## keyed on the datetime column (`duration=datetime.timedelta(minutes=5)`).
+## A sample leaves a time window once it is `duration` or more older than the
+## newest sample. If neither is given the aggregator covers every sample it
+## has seen.
+##
+## Aggregators are attached to a column with NVarSet.attachAggregator(), which
+## returns the aggregator so it can be kept in an algorithm's setup function:
+##
+##     def setup(self):
+##         self.co_mean = self.variables.attachAggregator('coraw_al',
+##                                                        NRollingStats(20))
+##
+##     def process(self, tm, data):
+##         if self.co_mean.mean > 8000:
+##             ...
+##
+## The aggregators of an algorithm's variables are brought up to date before
+## process() is called for each point, so they always describe the data up
+## to and including `tm`.
+##
+## NRollup summarises many variables at once over fixed buckets of time (the
+## min, mean, max and count of each bucket), so an overview of a whole flight
+## is a few hundred rows instead of tens of thousands. NVarSet.attachRollups()
+## keeps one up to date for each period in ROLLUP_PERIODS:
+##
+##     nset.attachRollups()
+##     minutes = nset.getRollup(datetime.timedelta(minutes=1))
+##     rows = minutes.select(['coraw_al'])
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 04:56:53
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+## Intrapackage imports
+from utils import EPOCH
+
+from collections import deque, OrderedDict
+
+import bisect
+import datetime
+import math
+
+## Default rollup periods, from a few rows per bucket up to a few dozen
+## buckets for a whole flight.
+ROLLUP_PERIODS = (datetime.timedelta(seconds=10),
+                  datetime.timedelta(minutes=1),
+                  datetime.timedelta(minutes=10))
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def _microseconds(delta):
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def periodName(period):
+    """ Short name of a period for file names, such as 10s, 1min or 2h. """
+    microseconds = _microseconds(period)
+    if microseconds % 3600000000 == 0:
+        return "%dh" % (microseconds // 3600000000)
+    elif microseconds % 60000000 == 0:
+        return "%dmin" % (microseconds // 60000000)
+    elif microseconds % 1000000 == 0:
+        return "%ds" % (microseconds // 1000000)
+    return "%dus" % microseconds
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class NAggregator(object):
+    """
+    Base class for the incremental aggregators. Values equal to
+    `missing_value` (or None) are ignored, so the bad data flag from the
+    server never makes its way into a statistic.
+    """
+
+    def __init__(self, size=None, duration=None, missing_value=None):
+        if size is not None and duration is not None:
+            raise ValueError('%s: only one of size or duration can be set'
+                             % self.__class__.__name__)
+        if size is not None and size < 1:
+            raise ValueError('%s: size must be at least one sample'
+                             % self.__class__.__name__)
+        if (duration is not None and
+            (not isinstance(duration, datetime.timedelta) or
+             duration <= datetime.timedelta(0))):
+            raise ValueError('%s: duration must be a positive '
+                             'datetime.timedelta' % self.__class__.__name__)
+
+        self.size = size
+        self.duration = duration
+        self.missing_value = missing_value
+        self.last_time = None
+        self.reset()
+
+    def reset(self):
+        """ Forget every sample seen so far. """
+        self.last_time = None
+
+    def add(self, tm, value):
+        """ Add the newest sample. Samples must be added in time order. """
+        if value is None or value == self.missing_value:
+            return
+        self.last_time = tm
+        self._add(tm, value)
+
+    def _add(self, tm, value):
+        raise NotImplementedError
+
+    def _expired(self, count, tm, newest_count, newest_tm):
+        """
+        Has the sample numbered `count` at time `tm` left the window, given
+        the newest sample?
+        """
+        if self.size is not None:
+            return count <= newest_count - self.size
+        elif self.duration is not None:
+            return tm <= newest_tm - self.duration
+        return False
+
+
+class NRollingStats(NAggregator):
+    """
+    Rolling count, mean, variance and standard deviation. Uses Welford's
+    update (and its inverse when a sample leaves the window) so that the
+    variance stays accurate for values such as the raw CO counts.
+    """
+
+    def reset(self):
+        super(NRollingStats, self).reset()
+        self._window = deque()
+        self._count = 0
+        self._mean = 0.0
+        self._m2 = 0.0
+        self._seen = 0
+
+    def _add(self, tm, value):
+        value = float(value)
+        self._seen += 1
+        self._window.append((self._seen, tm, value))
+        self._push(value)
+
+        while self._expired(self._window[0][0], self._window[0][1],
+                            self._seen, tm):
+            self._pop(self._window.popleft()[2])
+
+    def _push(self, value):
+        self._count += 1
+        delta = value - self._mean
+        self._mean += delta / self._count
+        self._m2 += delta * (value - self._mean)
+
+    def _pop(self, value):
+        self._count -= 1
+        if self._count == 0:
+            self._mean = 0.0
+            self._m2 = 0.0
+            return
+        delta = value - self._mean
+        self._mean -= delta / self._count
+        self._m2 -= delta * (value - self._mean)
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return self._mean if self._count != 0 else None
+
+    @property
+    def variance(self):
+        """ Sample variance of the window, None for fewer than two samples. """
+        if self._count < 2:
+            return None
+        return max(self._m2, 0.0) / (self._count - 1)
+
+    @property
+    def std(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+    @property
+    def rate(self):
+        """
+        Rate of change across the window (value per second) between the
+        oldest and newest sample.
+        """
+        if self._count < 2:
+            return None
+        first = self._window[0]
+        last = self._window[-1]
+        seconds = (last[1] - first[1]).total_seconds()
+        if seconds == 0:
+            return None
+        return (last[2] - first[2]) / seconds
+
+
+class _NMonotonicExtreme(NAggregator):
+    """
+    Rolling minimum or maximum using a monotonic deque, every sample is added
+    and removed at most once.
+    """
+
+    def reset(self):
+        super(_NMonotonicExtreme, self).reset()
+        self._window = deque()
+        self._seen = 0
+
+    def _keep(self, old, new):
+        raise NotImplementedError
+
+    def _add(self, tm, value):
+        self._seen += 1
+        while len(self._window) != 0 and not self._keep(self._window[-1][2],
+                                                        value):
+            self._window.pop()
+        self._window.append((self._seen, tm, value))
+
+        while self._expired(self._window[0][0], self._window[0][1],
+                            self._seen, tm):
+            self._window.popleft()
+
+    @property
+    def value(self):
+        return self._window[0][2] if len(self._window) != 0 else None
+
+    @property
+    def time(self):
+        """ The datetime at which the current extreme was recorded. """
+        return self._window[0][1] if len(self._window) != 0 else None
+
+
+class NRollingMin(_NMonotonicExtreme):
+    """ Rolling minimum of a window. """
+
+    def _keep(self, old, new):
+        return old < new
+
+
+class NRollingMax(_NMonotonicExtreme):
+    """ Rolling maximum of a window. """
+
+    def _keep(self, old, new):
+        return old > new
+
+
+class NEWMA(NAggregator):
+    """
+    Exponentially weighted moving average, where `alpha` is the weight of the
+    newest sample. This has no window, so size and duration are not used.
+    """
+
+    def __init__(self, alpha=0.1, missing_value=None):
+        if not (0 < alpha <= 1):
+            raise ValueError('NEWMA: alpha must be in (0, 1]')
+        self.alpha = alpha
+        super(NEWMA, self).__init__(missing_value=missing_value)
+
+    def reset(self):
+        super(NEWMA, self).reset()
+        self._value = None
+
+    def _add(self, tm, value):
+        if self._value is None:
+            self._value = float(value)
+        else:
+            self._value += self.alpha * (value - self._value)
+
+    @property
+    def value(self):
+        return self._value
+
+
+class NRollup(object):
+    """
+    Min, mean, max and count of several variables over consecutive buckets
+    of `period` (a datetime.timedelta). Buckets start at multiples of the
+    period, so the rollups of different flights line up. Values that are
+    None or equal to the variable's entry in `missing_values` (a dictionary
+    keyed on the variable name in any case, like
+    NDatabase.getBadDataValues) are left out; a bucket with none left has a
+    count of 0 and None for the rest.
+    """
+
+    def __init__(self, period, names=(), missing_values=None):
+        if (not isinstance(period, datetime.timedelta) or
+            period <= datetime.timedelta(0)):
+            raise ValueError('%s: period must be a positive '
+                             'datetime.timedelta' % self.__class__.__name__)
+
+        self.period = period
+        self._period_us = _microseconds(period)
+        self._missing_values = dict([(name.lower(), value)
+                                     for name, value
+                                     in (missing_values or {}).iteritems()])
+        self.times = []  # Start of each bucket
+        self._columns = OrderedDict()  # name: (counts, mins, maxs, sums)
+
+        for name in names:
+            self.addColumn(name)
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def names(self):
+        return self._columns.keys()
+
+    def bucketStart(self, tm):
+        """ Start of the bucket that the datetime `tm` falls in. """
+        ## Buckets are aligned to multiples of the period since the epoch.
+        return tm - datetime.timedelta(
+                        microseconds=_microseconds(tm - EPOCH) %
+                                     self._period_us)
+
+    def addColumn(self, name, times=(), values=()):
+        """
+        Start summarising another variable, with its history given as lists
+        of datetimes and values.
+        """
+        name = name.lower()
+        if name in self._columns:
+            raise ValueError('%s: already has a variable named %s'
+                             % (self.__class__.__name__, name))
+
+        length = len(self.times)
+        self._columns[name] = ([0] * length, [None] * length,
+                               [None] * length, [0.0] * length)
+        self.addValues(name, times, values)
+
+    def addValues(self, name, times, values):
+        """
+        Add values of one variable at the datetimes `times`, such as ones
+        that were None when their rows were added.
+        """
+        name = name.lower()
+        column = self._columns[name]
+        missing_value = self._missing_values.get(name)
+        start = index = None
+        for tm, value in zip(times, values):
+            if start is None or not (start <= tm < start + self.period):
+                start = self.bucketStart(tm)
+                index = self._bucket(start)
+            self._add(column, index, value, missing_value)
+
+    def addRows(self, rows, names=None):
+        """
+        Add rows of (datetime, value, ...), where the values are in the order
+        of `names` (by default the names of the rollup). Variables the rollup
+        does not summarise are skipped.
+        """
+        if names is None:
+            names = self.names
+
+        columns = []
+        for pos, name in enumerate(names):
+            name = name.lower()
+            if name in self._columns:
+                columns.append((pos + 1, self._columns[name],
+                                self._missing_values.get(name)))
+
+        start = index = None
+        for row in rows:
+            ## Most rows fall in the same bucket as the row before.
+            if start is None or not (start <= row[0] < start + self.period):
+                start = self.bucketStart(row[0])
+                index = self._bucket(start)
+            ## _add, inlined as this runs for every value ingested.
+            for pos, (counts, mins, maxs, sums), missing_value in columns:
+                value = row[pos]
+                if value is None or value == missing_value:
+                    continue
+                counts[index] += 1
+                sums[index] += value
+                if mins[index] is None or value < mins[index]:
+                    mins[index] = value
+                if maxs[index] is None or value > maxs[index]:
+                    maxs[index] = value
+
+    def _bucket(self, start):
+        """ Position of the bucket that begins at `start`, adding it. """
+        if len(self.times) != 0 and start == self.times[-1]:
+            return len(self.times) - 1
+
+        pos = bisect.bisect_left(self.times, start)
+        if pos == len(self.times) or self.times[pos] != start:
+            self.times.insert(pos, start)
+            for counts, mins, maxs, sums in self._columns.itervalues():
+                counts.insert(pos, 0)
+                mins.insert(pos, None)
+                maxs.insert(pos, None)
+                sums.insert(pos, 0.0)
+        return pos
+
+    def _add(self, column, index, value, missing_value):
+        if value is None or value == missing_value:
+            return
+        counts, mins, maxs, sums = column
+        counts[index] += 1
+        sums[index] += value
+        if mins[index] is None or value < mins[index]:
+            mins[index] = value
+        if maxs[index] is None or value > maxs[index]:
+            maxs[index] = value
+
+    def labels(self, names=None):
+        """ The column names of the rows from select(). """
+        if names is None:
+            names = self.names
+
+        labels = ['DATETIME']
+        for name in names:
+            name = name.lower()
+            labels += ["%s_min" % name, "%s_mean" % name,
+                       "%s_max" % name, "%s_count" % name]
+        return tuple(labels)
+
+    def select(self, names=None, start=None, stop=None):
+        """
+        Rows of (bucket start, min, mean, max, count, ...) with the four
+        values for each of `names` (by default every variable), from the
+        bucket holding the datetime `start` up to the bucket holding `stop`.
+        """
+        if names is None:
+            names = self.names
+
+        try:
+            columns = [self._columns[name.lower()] for name in names]
+        except KeyError, e:
+            raise KeyError('%s: no variable named %s'
+                           % (self.__class__.__name__, e.args[0]))
+
+        lo = (bisect.bisect_left(self.times, self.bucketStart(start))
+              if start is not None else 0)
+        hi = (bisect.bisect_right(self.times, stop)
+              if stop is not None else len(self.times))
+
+        rows = []
+        for index in xrange(lo, hi):
+            row = [self.times[index]]
+            for counts, mins, maxs, sums in columns:
+                count = counts[index]
+                row += [mins[index],
+                        sums[index] / count if count != 0 else None,
+                        maxs[index], count]
+            rows.append(tuple(row))
+
+        return rows
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Watch a whole fleet from one process. NSupervisor holds one NWatcher per
+## aircraft database and interleaves their NWatcher.step() calls, always
+## running the watcher whose next poll is due first (ties go round robin), so
+## a watcher waiting for a flight costs nothing while another is flying.
+##
+## The watchers share the output sinks, which are given one background
+## delivery thread each for the whole fleet. An NDatabase connection (and
+## with it the variable list and bad data tables) is only shared by watchers
+## of the same database, host and user, so with one watcher per aircraft
+## each has its own and only the sinks are shared. A watcher that raises is
+## closed and created again from its configuration after a delay that
+## doubles with each crash in a row. The connection it used is made again
+## when it restarts, once for all the watchers sharing it, since the crash
+## is often the connection going stale.
+##
+##     supervisor = NSupervisor(sinks=[NFileSink('/tmp/fleet.log')])
+##     supervisor.add("GV", configure, database="GV", email_fn=sendMail)
+##     supervisor.add("C130", configure, database="C130", email_fn=sendMail)
+##     supervisor.run()
+##
+## For more watchers than one core can keep up with, runPartitioned() splits
+## them over worker processes, each with its own connections and sinks. The
+## configure functions are then sent to the workers, so they must be defined
+## at the top level of a module (as for batch.replayFlights).
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:18:02
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+
+## Intrapackage
+from database import NDatabase
+from sinks import NQueuedSink
+from watch import NWatcher
+
+## Worker processes
+import multiprocessing
+
+## General
+import heapq
+import sys
+import time
+import traceback
+
+## Options of NWatcher that give it its own (simulated) server, which cannot
+## be shared.
+_OWN_SERVER = ('server', 'simulate_start_time', 'simulate_file')
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def _superviseWorker(specs, sinks, restart_delay, max_restart_delay,
+                     duration):
+    """ Run a share of the watchers in a worker process. """
+    supervisor = NSupervisor(sinks=sinks, restart_delay=restart_delay,
+                             max_restart_delay=max_restart_delay)
+    for name, configure, kwds in specs:
+        supervisor.add(name, configure, **kwds)
+    try:
+        supervisor.run(duration)
+    finally:
+        supervisor.close()
+
+## --------------------------------------------------------------------------
+## Classes
+## --------------------------------------------------------------------------
+
+
+class _NSupervised(object):
+    """ A watcher, its configuration and its crash record. """
+
+    def __init__(self, name, configure, kwds):
+        self.name = name
+        self.configure = configure
+        self.kwds = kwds
+        self.watcher = None
+        self.server_key = None  # Of the shared connection it uses
+        self.crashes = 0  # In a row
+        self.crashed = None  # Time of the last crash
+        self.restarts = 0
+
+
+class NSupervisor(object):
+    """
+    Runs many NWatchers in one process, see the module description. The
+    extra `sinks` receive the messages and files of every watcher.
+    """
+
+    def __init__(self, sinks=(), restart_delay=10, max_restart_delay=600):
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+
+        self._raw_sinks = list(sinks)  # For worker processes
+        self._sinks = [NQueuedSink(sink) for sink in sinks]
+        ## Only watchers of the same database can share a connection.
+        self._servers = {}  # {(database, host, user): NDatabase}
+        self._reconnected = {}  # {(database, host, user): time}
+
+        self._entries = []
+        self._queue = []  # Heap of (due time, sequence, entry)
+        self._sequence = 0
+
+    @property
+    def watchers(self):
+        """ The running watchers by name (None while waiting to restart). """
+        return dict([(entry.name, entry.watcher) for entry in self._entries])
+
+    @property
+    def restarts(self):
+        return dict([(entry.name, entry.restarts) for entry in self._entries])
+
+    def add(self, name, configure=None, **kwds):
+        """
+        Watch another database. `kwds` are the options of NWatcher and
+        `configure(watcher)` attaches the algorithms, as in batch.py. The
+        watcher is created when it is first due.
+        """
+        if name in [entry.name for entry in self._entries]:
+            raise ValueError('%s: already watching %s'
+                             % (self.__class__.__name__, name))
+
+        entry = _NSupervised(name, configure, kwds)
+        self._entries.append(entry)
+        self._schedule(entry, 0)
+
+    def _schedule(self, entry, delay):
+        self._sequence += 1
+        heapq.heappush(self._queue,
+                       (time.time() + delay, self._sequence, entry))
+
+    def _serverKey(self, kwds):
+        """ What watchers must have in common to share a connection. """
+        return (kwds.get('database'),
+                kwds.get('host', "eol-rt-data.guest.ucar.edu"),
+                kwds.get('user', "ads"))
+
+    def _server(self, key, kwds):
+        """ The shared connection for a watcher's database. """
+        if key not in self._servers:
+            self._servers[key] = NDatabase(
+                                     database=key[0], host=key[1],
+                                     user=key[2],
+                                     catalog_dir=kwds.get('catalog_dir'),
+                                     notify=kwds.get('notify', False),
+                                     cache=kwds.get('cache'))
+        return self._servers[key]
+
+    def _reconnect(self, key, since):
+        """
+        Connect the shared connection `key` again, unless that has been done
+        `since` a crash (for another watcher sharing it).
+        """
+        if self._reconnected.get(key, 0) < since:
+            self._servers[key].reconnect()
+            self._reconnected[key] = time.time()
+
+    def _start(self, entry):
+        kwds = dict(entry.kwds)
+        if not any([option in kwds for option in _OWN_SERVER]):
+            entry.server_key = self._serverKey(kwds)
+            kwds['server'] = self._server(entry.server_key, kwds)
+            if entry.crashed is not None:
+                self._reconnect(entry.server_key, entry.crashed)
+        kwds['sinks'] = list(kwds.get('sinks', ())) + self._sinks
+
+        watcher = NWatcher(**kwds)
+        if entry.configure is not None:
+            entry.configure(watcher)
+        entry.watcher = watcher
+
+    def step(self):
+        """
+        Run the watcher that is due next, if it is due. Returns the seconds
+        until the next watcher is due, None when there are none.
+        """
+        if len(self._queue) == 0:
+            return None
+
+        due, sequence, entry = self._queue[0]
+        now = time.time()
+        if due > now:
+            return due - now
+        heapq.heappop(self._queue)
+
+        try:
+            if entry.watcher is None:
+                if entry.crashes != 0:
+                    entry.restarts += 1
+                self._start(entry)
+            delay = entry.watcher.step()
+            entry.crashes = 0
+        except Exception, e:
+            ## Stop its threads and connections; the shared sinks stay open.
+            if entry.watcher is not None:
+                try:
+                    entry.watcher.close()
+                except Exception:
+                    traceback.print_exc()
+            entry.watcher = None
+            entry.crashes += 1
+            entry.crashed = time.time()
+            delay = min(self.restart_delay * 2 ** (entry.crashes - 1),
+                        self.max_restart_delay)
+            print >>sys.stderr, ("%s: Watcher %s crashed, restarting in %g s"
+                                 % (self.__class__.__name__, entry.name,
+                                    delay))
+            traceback.print_exc()
+
+        self._schedule(entry, delay or 0)
+        return max(self._queue[0][0] - time.time(), 0)
+
+    def run(self, duration=None):
+        """ Run the watchers, forever or for `duration` seconds. """
+        end = time.time() + duration if duration is not None else None
+        while end is None or time.time() < end:
+            wait = self.step()
+            if wait is None:
+                return
+            if end is not None:
+                wait = min(wait, end - time.time())
+            if wait > 0:
+                time.sleep(wait)
+
+    def runPartitioned(self, processes=None, duration=None):
+        """
+        Run the watchers split over `processes` worker processes (by default
+        one per core), forever or for `duration` seconds.
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        processes = max(1, min(processes, len(self._entries)))
+
+        specs = [(entry.name, entry.configure, entry.kwds)
+                 for entry in self._entries]
+        workers = [multiprocessing.Process(
+                       target=_superviseWorker,
+                       args=(specs[pos::processes], self._raw_sinks,
+                             self.restart_delay, self.max_restart_delay,
+                             duration))
+                   for pos in xrange(processes)]
+
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def close(self):
+        """
+        End the flights in progress (writing their files), wait for the
+        sinks to deliver everything and close the connections.
+        """
+        watchers = [entry.watcher for entry in self._entries
+                    if entry.watcher is not None]
+        ## The sinks are shared, so only close them once every flight is in.
+        for watcher in watchers:
+            watcher.finish()
+        for watcher in watchers:
+            watcher.close()
+        for sink in self._sinks:
+            sink.close()
+        for server in self._servers.itervalues():
+            server.stop()
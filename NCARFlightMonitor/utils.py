@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Small helpers shared by the modules of the package: conversions between
+## datetimes and seconds since 1970 (the epoch times that the data, the
+## caches, the event log and the shared and fanned out rows are kept in) and
+## replacing a pickled file atomically.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:39:34
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+import cPickle as pickle
+import datetime
+import os
+
+## Epoch times are seconds since this time.
+EPOCH = datetime.datetime(1970, 1, 1)
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def toEpoch(tm):
+    """ The datetime `tm` as whole seconds since 1970. """
+    delta = tm - EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def toSeconds(tm):
+    """
+    The datetime `tm` as seconds since 1970, microseconds included. Epoch
+    seconds are returned as they are.
+    """
+    if not isinstance(tm, datetime.datetime):
+        return tm
+    delta = tm - EPOCH
+    return (delta.days * 86400 + delta.seconds) + delta.microseconds / 1e6
+
+
+def fromEpoch(seconds):
+    """ The datetime of `seconds` since 1970. """
+    return EPOCH + datetime.timedelta(seconds=seconds)
+
+
+def writePickle(file_name, obj, sync=False):
+    """
+    Replace `file_name` with `obj` pickled, writing a temporary file first
+    and renaming it over the old one so a reader never sees part of it. With
+    `sync` the data is on disk before the rename.
+    """
+    temp_file = "%s%s%d%stmp" % (file_name, os.extsep, os.getpid(),
+                                 os.extsep)
+    f = open(temp_file, 'wb')
+    try:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(temp_file, file_name)
@@ -46,13 +46,25 @@
 ## --------------------------------------------------------------------------
 
 ## Server Imports
-from database import NDatabaseLiveUpdater, NDatabase
+from database import NDatabaseLiveUpdater, NDatabase, _parseTimestamp
+from database import CATCHUP_ROWS
 ## ASCII file imports
 from datafile import NRTFile
 ## Internal Python Ordered Dictionary data structures
-from data import NVarSet, NVar
+from data import NVarSet, NLazyVarSet, NVar, fromEpoch, toEpoch
 ## Mutable algorithm containers
 from algos import NAlgorithm
+## Incremental statistics for the built in checks
+from stats import NRollingStats, NEWMA, periodName
+## Structured log events
+from events import NEventLog, INFO, WARNING, MESSAGE
+## Delivery of messages and files
+from sinks import NFunctionSink, NQueuedSink
+## Resuming a flight after a restart
+from checkpoint import NCheckpoint
+## Sharing the data with local clients
+from fanout import NFanoutServer
+from shared import NSharedColumns
 
 ## All dates are handled in datetime.datetime format
 import datetime
@@ -60,7 +72,11 @@ import datetime
 ## Allows methods to be injected into instantiated objects.
 import types
 
+## Algorithm state is pickled for checkpoints
+import cPickle as pickle
+
 ## General
+from collections import OrderedDict
 import os
 import tempfile
 import time
@@ -85,22 +101,129 @@ def output_file_str(flight_info):
     return file_path
 
 
+def rollup_file_str(file_path, period):
+    """
+    The file a rollup is written to, next to the output file of the flight.
+    For example /tmp/ICE-T-rf12-....asc gives /tmp/ICE-T-rf12-...-1min.asc
+    """
+    root, ext = os.path.splitext(file_path)
+    return "%s-%s%s" % (root, periodName(period), ext)
+
+
+def events_file_str(file_path):
+    """ The file the log events of a flight are saved to. """
+    return "%s-events%sjson" % (os.path.splitext(file_path)[0], os.extsep)
+
+
 ## --------------------------------------------------------------------------
 ## Classes
 ## --------------------------------------------------------------------------
 class Logger(object):
-    def __init__(self, print_msg_fn=None):
+    """
+    Passes messages to print_msg_fn and keeps the formatted messages. Each
+    message is also recorded in `events` (an events.NEventLog) with its
+    variable, kind and severity, and the algorithm that raised it. The
+    watcher sets `algorithm` and `variable` while an algorithm runs, and
+    these are used for messages that do not give their own.
+
+    With `coalesce` (a timedelta of data time) only the first message about
+    a variable in each window is delivered straight away; the rest are held
+    and delivered as one summary when the window is over (see flush()), so
+    a variable flapping around its missing value does not flood the output.
+    Every message is still recorded in `events`.
+
+    With `background` print_msg_fn is called from a delivery thread (see
+    sinks.NQueuedSink), so a slow print_msg_fn (such as a chat or network
+    message) never holds up the caller. Messages are also sent to every
+    sink in `sinks`. close() waits for everything to be delivered.
+    """
+    def __init__(self, print_msg_fn=None, coalesce=None, background=False,
+                       sinks=()):
         self.messages = []
+        self.events = NEventLog()
+        self.algorithm = None
+        self.variable = None
+        self.coalesce = coalesce
+        self._held = {}  # {variable: (window end, [(msg, tm), ...])}
         if print_msg_fn is None:
             self.print_msg_fn = self.print_default
         else:
             self.print_msg_fn = print_msg_fn
 
+        self._sink = NFunctionSink(print_msg_fn=self.print_msg_fn)
+        self._background = background
+        if background:
+            self._sink = NQueuedSink(self._sink,
+                                     on_message=self._delivered)
+        self._sinks = list(sinks)
+
     def reset(self):
         self.messages = []
-
-    def print_msg(self, msg, tm):
-        self.messages += [self.print_msg_fn(msg, tm)]
+        self.events = NEventLog()
+        self._held = {}
+
+    def print_msg(self, msg, tm, variable=None, kind=MESSAGE,
+                        severity=INFO, algorithm=None):
+        if variable is None:
+            variable = self.variable
+
+        ## The watcher's own messages give the time as a string. Messages
+        ## without a time are not events.
+        event_tm = _parseTimestamp(tm) if isinstance(tm, basestring) else tm
+        if event_tm is not None:
+            self.events.add(event_tm, msg,
+                            algorithm=(algorithm if algorithm is not None
+                                       else self.algorithm),
+                            variable=variable,
+                            severity=severity, kind=kind)
+
+        if self.coalesce is None or variable is None or event_tm is None:
+            self._deliver(msg, tm)
+            return
+
+        if variable in self._held:
+            window_end, held = self._held[variable]
+            if event_tm < window_end:
+                held.append((msg, tm))
+                return
+            self._deliverHeld(variable)
+
+        self._deliver(msg, tm)
+        self._held[variable] = (event_tm + self.coalesce, [])
+
+    def flush(self, tm=None):
+        """
+        Deliver the messages held for variables whose window ended by the
+        datetime `tm`, or all of them without `tm`.
+        """
+        for variable in sorted(self._held):
+            if tm is None or self._held[variable][0] <= tm:
+                self._deliverHeld(variable)
+
+    def close(self):
+        """ Deliver everything held or queued. """
+        self.flush()
+        self._sink.close()
+        for sink in self._sinks:
+            sink.flush()
+
+    def _deliverHeld(self, variable):
+        held = self._held.pop(variable)[1]
+        if len(held) == 1:
+            self._deliver(*held[0])
+        elif len(held) > 1:
+            self._deliver("%s: %d more messages, last: %s"
+                          % (variable, len(held), held[-1][0]), held[-1][1])
+
+    def _deliver(self, msg, tm):
+        result = self._sink.message(msg, tm)
+        if not self._background:
+            self._delivered(result)
+        for sink in self._sinks:
+            sink.message(msg, tm)
+
+    def _delivered(self, formatted_msg):
+        self.messages.append(formatted_msg)
 
     def print_default(self, msg, tm):
         """
@@ -134,11 +257,117 @@ class NWatcher(object):
                        print_msg_fn=None,
                        output_file_path=None,
                        variables=None,
+                       replay_chunk=datetime.timedelta(minutes=30),
+                       server=None,
+                       lazy=False,
+                       rollups=None,
+                       save_events=False,
+                       coalesce=None,
+                       background_log=False,
+                       sinks=(),
+                       background_mail=False,
+                       checkpoint_dir=None,
+                       checkpoint_interval=datetime.timedelta(minutes=1),
+                       checkpoint_catchup=datetime.timedelta(hours=2),
+                       catalog_dir=None,
+                       notify=False,
+                       fanout=None,
+                       shared=None,
+                       cadences=None,
+                       default_cadence=1,
+                       cache=None,
+                       catchup_rows=CATCHUP_ROWS,
+                       gap_threshold=None,
+                       compress=False,
                        *extra,
                        **kwds):
         """
         Give the watcher class the database information and email to send the
         resulting files.
+
+        When simulating, `replay_chunk` is how much simulated time worth of
+        data is pulled from the database at once (None pulls every tick).
+
+        An already created server (such as a database.NMemoryDatabase) can be
+        given with `server`, in which case the database options are unused.
+        Otherwise `catalog_dir` keeps the database catalog on disk so that
+        the watcher starts without reading it again (see catalog.py), and
+        with `notify` new data is waited for with LISTEN/NOTIFY instead of
+        polling every DataRate seconds (see NDatabase). A cache.NChunkCache
+        given as `cache` answers the queries for past data, such as the hour
+        fetched for a variable first used with `lazy`, from what was fetched
+        before.
+
+        With `fanout`, an address for fanout.NFanoutServer, the rows of a
+        flight are republished to local NFanoutSubscribers as they arrive,
+        so other clients need not poll the server themselves. With `shared`,
+        the path of a file (best on /dev/shm), the data of a flight is also
+        kept there as columns that other processes on the host can read
+        with shared.NSharedReader as it arrives (with `lazy`, a variable
+        only from when it is first used).
+
+        `cadences` and `default_cadence` let variables be fetched less often
+        than every DataRate seconds, see database.NDatabaseLiveUpdater; for
+        example {('tasx', 'gglat', 'gglon', 'coraw_al'): 1} with a
+        default_cadence of 10 fetches the rest every tenth update. Rows are
+        added as they arrive with None for the variables not fetched yet,
+        algorithms only process rows once all of their variables are filled
+        in, and everything is filled in after landing. The fanout and shared
+        copies only get the values fetched with each new row.
+
+        The gaps in the data of a flight longer than `gap_threshold` (by
+        default twice the DataRate), such as satcom outages, are indexed
+        (see NVarSet.indexGaps) and algorithms can ask for them with
+        self.gaps(start, stop). No query fetches more than `catchup_rows`
+        rows (None for no limit): the data missed since a checkpoint is
+        caught up in batches with the algorithms run after each one, the
+        hour before a flight starts is cut to its last `catchup_rows` rows,
+        and rows that arrive late from inside a gap are fetched in batches
+        once the watcher has caught up, and put in place (see
+        NDatabaseLiveUpdater). Algorithms carry on after the last row they
+        processed, so they do not see the late rows.
+
+        With `lazy` a variable is only fetched from the server once an
+        algorithm uses it (see data.NLazyVarSet). The bad data checks are
+        then only run on the variables in use: missing data in a variable
+        that no other algorithm uses is not reported. Attach an algorithm
+        (such as attachBoundsCheck) to a variable to have it checked.
+        Everything is fetched at the end of a flight for the output file.
+        With `compress` the data of a flight is kept compressed (see
+        NVarSet.compress), for long flights of many variables on hosts with
+        little memory.
+
+        `rollups` is a list of timedelta periods (such as
+        stats.ROLLUP_PERIODS) to keep min/mean/max/count summaries of every
+        variable over during a flight (see NVarSet.attachRollups). Each is
+        written to its own file next to the output file when the flight ends.
+
+        The structured log events of the last flight are kept in `events`
+        (an events.NEventLog). With `save_events` they are also written next
+        to the output file (`...-events.json`, read with
+        events.loadEventLog).
+
+        `coalesce` (a timedelta) and `background_log` are passed on to the
+        Logger of each flight: repeated messages about a variable within
+        `coalesce` are delivered as one summary, and with `background_log`
+        print_msg_fn is called from a separate thread so it cannot hold up
+        run().
+
+        `sinks` are extra sinks.NSinks that receive every log message and
+        the output file of every flight, each delivered from its own
+        background thread (unless it is already an NQueuedSink, which can
+        be shared between watchers, and is then left open by close()). With
+        `background_mail` email_fn is also called from a background thread
+        (and retried if it fails). Call close() to wait for all deliveries
+        when done with the watcher.
+
+        With `checkpoint_dir` the state of a flight in progress (the data,
+        the algorithms' state and the log) is saved there every
+        `checkpoint_interval` of data time (see checkpoint.NCheckpoint). If
+        the watcher is restarted during the same flight it resumes from the
+        checkpoint, fetching at most `checkpoint_catchup` of the data it
+        missed, instead of starting the flight again. Algorithm state that
+        cannot be pickled starts again from its setup function.
         """
         ## Private Vars
         self._database = database
@@ -149,10 +378,38 @@ class NWatcher(object):
 
         self._header = header
         self._email = email_fn if email_fn is not None else None
+        self._mail_sink = NFunctionSink(email_fn=email_fn)
+        if background_mail and email_fn is not None:
+            self._mail_sink = NQueuedSink(self._mail_sink, overflow="block")
+        ## Only the sinks made here are closed by close(), the NQueuedSinks
+        ## given may be shared with other watchers.
+        sinks = list(sinks)
+        self._sinks = [sink if isinstance(sink, NQueuedSink)
+                       else NQueuedSink(sink) for sink in sinks]
+        self._own_sinks = [sink for sink in self._sinks if sink not in sinks]
+
+        self._checkpoint = (NCheckpoint(checkpoint_dir)
+                            if checkpoint_dir is not None else None)
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoint_catchup = checkpoint_catchup
+        self._last_checkpoint = None
+        self._spooled = 0  # Rows of this flight in the checkpoint
+        self._spooled_time = None  # Epoch of the last of them
+        self._late_chunks = []  # (names, late rows) to spool before others
         self._output_file_path = output_file_path
 
         self._algos = []
         self.__input_algos = []
+        self.__passive_algos = []  # Only run on variables already in use
+        self._lazy = lazy
+        self._compress = compress
+        self._rollup_periods = rollups
+        self._save_events = save_events
+        self._coalesce = coalesce
+        self._background_log = background_log
+
+        self.log = None
+        self.events = None  # Events of the last flight
 
         self.__print_msg_fn = print_msg_fn
 
@@ -163,29 +420,58 @@ class NWatcher(object):
         self._flight_end_time = None
         self._num_flight = 0
         self._waiting = False
+        self._landing = False  # Waiting for the last data of a flight
         self.__wait = 1
+        self._stop_time = None  # Set by runTillTime/runForDuration
 
-        if self._simulate_file is not None:
+        ## Wall clock seconds spent on each part of the work, and the number
+        ## of rows ingested, over all flights.
+        self.timing = {'ingest': 0.0, 'algorithms': 0.0, 'output': 0.0,
+                       'checkpoint': 0.0, 'rows': 0}
+
+        self._own_server = server is None
+        if server is not None:
+            self._server = server
+        elif self._simulate_file is not None:
             self._server = NDatabase(database=self._database,
                                      host=self._host,
                                      user=self._user,
                                      simulate_start_time=(
                                        self._simulate_start_time),
                                      simulate_fast=True,
-                                     simulate_file=self._simulate_file)
+                                     simulate_file=self._simulate_file,
+                                     replay_chunk=replay_chunk,
+                                     catalog_dir=catalog_dir,
+                                     notify=notify,
+                                     cache=cache)
         elif self._simulate_start_time is not None:
             self._server = NDatabase(database=self._database,
                                      host=self._host,
                                      user=self._user,
                                      simulate_start_time=(
                                        self._simulate_start_time),
-                                     simulate_fast=True)
+                                     simulate_fast=True,
+                                     replay_chunk=replay_chunk,
+                                     catalog_dir=catalog_dir,
+                                     notify=notify,
+                                     cache=cache)
         else:
             self._server = NDatabase(database=self._database,
                                      host=self._host,
-                                     user=self._user)
+                                     user=self._user,
+                                     catalog_dir=catalog_dir,
+                                     notify=notify,
+                                     cache=cache)
 
         self._updater = None  # Interfaces with server to get regular updates.
+        self.fanout = NFanoutServer(fanout) if fanout is not None else None
+        self._shared_path = shared
+        self.shared = None  # NSharedColumns of the flight in progress
+
+        self._cadences = cadences
+        self._default_cadence = default_cadence
+        self._catchup_rows = catchup_rows
+        self._gap_threshold = gap_threshold
 
         if variables is None:
             self.__input_variables = self._server.variable_list
@@ -195,6 +481,31 @@ class NWatcher(object):
 
         self._badDataCheck(self.__input_variables)
 
+    def close(self):
+        """
+        Wait for the mail and sinks to deliver everything, and close the
+        connections the watcher made. Shared sinks (the NQueuedSinks given
+        as `sinks`) are flushed but left open, as is a `server` given.
+        """
+        for sink in self._sinks:
+            if sink in self._own_sinks:
+                sink.close()
+            else:
+                sink.flush()
+        self._mail_sink.close()
+        if self.fanout is not None:
+            self.fanout.close()
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
+        if self._own_server:
+            self._server.stop()
+
+    def finish(self):
+        """ End the flight in progress now, if any, writing its file. """
+        if self._flying_now:
+            self._flightEnding()
+
     def startWatching(self):
         """ Runs run() all the time, operates in a 'daemon' mode """
         while(True):
@@ -210,8 +521,10 @@ class NWatcher(object):
         if fake_flight:
             self._server._fake_flying = True
         start_time = self._server.getTime()
+        self._stop_time = start_time + duration
         while duration > (self._server.getTime() - start_time):
             self.run()
+        self._stop_time = None
 
         self._flightEnding()
 
@@ -220,8 +533,10 @@ class NWatcher(object):
         if fake_flight:
           self._server._fake_flying = True
 
+        self._stop_time = run_time
         while run_time > self._server.getTime():
             self.run()
+        self._stop_time = None
 
         if self._flying_now:
           self._flightEnding()
@@ -235,10 +550,25 @@ class NWatcher(object):
         since run() was last called. This data is then processed though real
         time algorithms added by attachAlgo().
 
-        This is a NON BLOCKING function, it does not loop. Hence it can be
-        used inside event loops in other packages (such as the twisted IRC bot
-        package).
+        This does not loop, but it does wait for the data rate after each
+        update (see step() for a version that does not wait at all).
+        """
+        self._run(blocking=True)
+
+    def step(self):
+        """
+        Does the same work as run() without waiting, and returns the number
+        of seconds to wait before calling step() again. This lets an event
+        loop (see driver.NTwistedDriver) do the waiting, and call step()
+        from a worker thread so the database queries do not block it.
         """
+        return self._run(blocking=False)
+
+    def _run(self, blocking):
+        ## The wait after a landing was left to the caller last step.
+        if self._landing:
+            return self._finishLanding(blocking)
+
         if not self._server.flying():
             if self._flying_now == False:  # No flight in progress.
                 self._server.reconnect()  # Done to ensure good connection.
@@ -246,27 +576,42 @@ class NWatcher(object):
                     print ("[%sZ] Waiting for flight."
                            % self._server.getTimeStr())
                     self._waiting = True
-                self._server.sleep(3 * self.__wait)
+                ## Nothing changes until new data arrives, so a simulation
+                ## can skip ahead to it.
+                return self._server.sleep(3 * self.__wait, skip_idle=True,
+                                          limit=self._stop_time,
+                                          blocking=blocking)
 
             ## Just switched from flying to not flying.
             else:
-                self.log.print_msg("Flight ending.", self._server.getTimeStr())
-                self._server.sleep(2 * 60)  # Get more data after landing
-                self._updater.update()  # Get last bit of data.
-                self._flightEnding()
+                self.log.print_msg("Flight ending.", self._server.getTimeStr(),
+                                   kind="flight")
+                self._landing = True
+                # Get more data after landing
+                delay = self._server.sleep(2 * 60, blocking=blocking)
+                if delay > 0:
+                    return delay
+                return self._finishLanding(blocking)
 
         ## Flight is in progress
         else:
             if self._flying_now == False:  # Just started flying
                 self._flightStarting()
-                self.log.print_msg("In Flight.", self._server.getTimeStr())
+                self.log.print_msg("In Flight.", self._server.getTimeStr(),
+                                   kind="flight")
 
             # Can return none, sleeps for at least DataRate
             # seconds (three seconds by default).
-            self._updater.update()
+            delay = self._updater.update(blocking=blocking)
+            if len(self._updater.late) != 0:
+                self._lateRows(self._updater.late)
 
             # Run algorithms attached by user.
+            start = time.time()
             for algo in self._algos:
+                self.log.algorithm = algo.desc
+                self.log.variable = (algo.variables.keys()[0]
+                                     if len(algo.variables) == 1 else None)
                 try:
                     algo.run()
                 except Exception, e:
@@ -275,23 +620,250 @@ class NWatcher(object):
                     print "Algorithm Description: %s" % algo.desc
                     self._algos.remove(algo)
                     print e
+            self.log.algorithm = self.log.variable = None
+            self.log.flush(self._server.getTime())
+            self.timing['algorithms'] += time.time() - start
+
+            if (self._checkpoint is not None and
+                self._server.getTime() - self._last_checkpoint >=
+                  self._checkpoint_interval):
+                self._saveCheckpoint()
+            return delay
+
+    def _finishLanding(self, blocking):
+        self._landing = False
+        ## Get last bit of data.
+        delay = self._updater.update(blocking=blocking)
+        while self._updater.behind:
+            self._updater.update(blocking=False)
+        self._flightEnding()
+        return delay
 
     def _flightStarting(self):
         self._flight_start_time = self._server.getTime()
         self._flight_end_time = None
         self._flying_now = True
         self._waiting = False
-        self.log = Logger(self.__print_msg_fn)
-        ##    Get preflight data
+        self.log = Logger(self.__print_msg_fn, coalesce=self._coalesce,
+                          background=self._background_log,
+                          sinks=self._sinks)
         self._variables = self._resetVariables(self.__input_variables)
-        self._variables.addData(self._server.getData(start_time="-60 MINUTE",
-                                                     variables=(
-                                                       self._variables.keys()))
-                                                     )
-        self._updater = NDatabaseLiveUpdater(server=self._server,
-                                             variables=self._variables)
+        self._variables.maskMissing(self._server.getBadDataValues())
+        gap_threshold = self._gap_threshold
+        if gap_threshold is None:
+            gap_threshold = datetime.timedelta(
+                seconds=2 * self._server.getDataRate())
+        self._variables.indexGaps(gap_threshold)
+
+        ## Carry on from a checkpoint of this flight if there is one.
+        resume = self._loadCheckpoint()
+        start = time.time()
+        if resume is None:
+            ##    Get preflight data, which the algorithms start after.
+            if self._catchup_rows is None:
+                preflight = self._server.getData(
+                                start_time="-60 MINUTE",
+                                variables=self._variables.keys(),
+                                epoch=True)
+            else:
+                ## The last rows of the hour, newest first.
+                since = toEpoch(self._server.getTime() -
+                                datetime.timedelta(minutes=60))
+                preflight = [row for row in reversed(self._server.getData(
+                                 variables=self._variables.keys(),
+                                 number_entries=self._catchup_rows,
+                                 epoch=True))
+                             if row[0] > since]
+        else:
+            state, chunks = resume
+            self._flight_start_time = state['flight_start_time']
+            self._restoreRows(chunks)
+            self._spooled = len(self._variables._time)
+            if self._spooled != 0:
+                self._spooled_time = self._variables._time.epochs(-1)[0]
+
+            ## Only catch up on a bounded amount of missed data.
+            catchup_start = max(state['last_time'],
+                                self._server.getTime() -
+                                  self._checkpoint_catchup)
+            preflight = self._server.getData(
+                            start_time=catchup_start,
+                            variables=self._variables.keys(),
+                            number_entries=self._catchup_rows,
+                            epoch=True)
+        self._variables.addData(preflight)
+        if self._rollup_periods is not None:
+            self._variables.attachRollups(
+                self._rollup_periods,
+                missing_values=self._server.getBadDataValues())
+        self.timing['ingest'] += time.time() - start
+        self.timing['rows'] += len(preflight)
+        self._updater = NDatabaseLiveUpdater(
+                            server=self._server,
+                            variables=self._variables,
+                            cadences=self._cadences,
+                            default_cadence=self._default_cadence,
+                            max_rows=self._catchup_rows,
+                            start_time=(fromEpoch(preflight[-1][0])
+                                        if len(preflight) != 0 else None))
+        if self.fanout is not None:
+            ## Only the rows newer than the last flight's are sent again.
+            self.fanout.publish(self._variables.keys(), preflight)
+            self._updater.addListener(self.fanout.publish)
+        if self._shared_path is not None:
+            self.shared = NSharedColumns(self._shared_path,
+                                         self._variables.names
+                                         if self._lazy
+                                         else self._variables.keys())
+            self.shared.append(self._variables.keys(),
+                               self._variables.sliceWithTime(None, None,
+                                                             epoch=True))
+            self._updater.addListener(self.shared.append)
         self.resetAlgos()
 
+        if resume is not None:
+            self._restoreState(state)
+            self.log.print_msg("Resumed from checkpoint at %s."
+                               % state['last_time'],
+                               self._server.getTimeStr(), kind="flight")
+        self._last_checkpoint = self._server.getTime()
+
+    def _flightKey(self):
+        """ What identifies a flight in a checkpoint. """
+        info = self._server.getFlightInformation()
+        return (info.get('ProjectNumber'), info.get('FlightNumber'))
+
+    def _loadCheckpoint(self):
+        """ The (state, chunks) of a checkpoint of this flight, or None. """
+        self._spooled = 0
+        self._spooled_time = None
+        self._late_chunks = []
+        if self._checkpoint is None:
+            return None
+
+        resume = self._checkpoint.load()
+        if resume is not None and resume[0]['flight'] != self._flightKey():
+            ## Left over from an earlier flight.
+            self._checkpoint.clear()
+            resume = None
+        return resume
+
+    def _restoreRows(self, chunks):
+        """
+        Add the spooled rows to the variables, returning how many there were.
+        Late rows (see _lateRows) are put in place.
+        """
+        count = 0
+        for names, rows in chunks:
+            if self._lazy:
+                self._variables.materialize([name for name in names
+                                             if name in self._variables.names])
+            keys = self._variables.keys()
+            if names != keys:
+                ## Columns that were not spooled are None.
+                positions = [names.index(key) + 1 if key in names else None
+                             for key in keys]
+                rows = [(row[0],) + tuple([row[pos] if pos is not None
+                                           else None for pos in positions])
+                        for row in rows]
+            self._variables.insertData(rows)
+            count += len(rows)
+        return count
+
+    def _lateRows(self, rows):
+        """
+        Rows the updater put in a gap: the algorithms carry on after the last
+        row they processed, and those the checkpoint has already gone past
+        are spooled with the next one.
+        """
+        for algo in self._algos:
+            algo.resume()
+        if self._spooled_time is not None:
+            spooled = [row for row in rows if row[0] < self._spooled_time]
+            if len(spooled) != 0:
+                self._late_chunks.append((self._variables.keys(), spooled))
+                self._spooled += len(spooled)
+
+    def _saveCheckpoint(self):
+        """ Spool the new rows and save the rest of the flight's state. """
+        start = time.time()
+        try:
+            length = len(self._variables._time)
+            for names, rows in self._late_chunks:
+                self._checkpoint.appendRows(names, rows)
+            self._late_chunks = []
+            self._checkpoint.appendRows(
+                self._variables.keys(),
+                self._variables.sliceWithTime(self._spooled, None,
+                                              epoch=True))
+            self._spooled = length
+            if length != 0:
+                self._spooled_time = self._variables._time.epochs(-1)[0]
+
+            self._checkpoint.saveState({
+                'flight': self._flightKey(),
+                'flight_start_time': self._flight_start_time,
+                'last_time': self._variables._time.getTimeFromPos(-1),
+                'rows': self._spooled,
+                'messages': self.log.messages,
+                'events': self.log.events,
+                'algorithms': self._algorithmState()})
+        except Exception, e:
+            print ("%s: Could not save checkpoint" % self.__class__.__name__)
+            print e
+        self._last_checkpoint = self._server.getTime()
+        self.timing['checkpoint'] += time.time() - start
+
+    def _algorithmState(self):
+        """
+        The pickled state of every algorithm, as set up by its setup function
+        and changed by its process function, with the aggregators of its
+        variables. Pickled together so shared objects are only stored once.
+        """
+        def algorithmState(algo):
+            return (algo.desc,
+                    dict([(name, value)
+                          for name, value in algo.__dict__.iteritems()
+                          if name not in ('variables', 'log', 'setup',
+                                          'process', '_time', '_pos',
+                                          'watermark', 'gaps')]),
+                    algo.variables._aggregators)
+
+        try:
+            return [pickle.dumps([algorithmState(algo)
+                                  for algo in self._algos],
+                                 pickle.HIGHEST_PROTOCOL)]
+        except Exception:
+            ## One at a time, leaving out the algorithms that cannot be saved.
+            blobs = []
+            for algo in self._algos:
+                try:
+                    blobs.append(pickle.dumps([algorithmState(algo)],
+                                              pickle.HIGHEST_PROTOCOL))
+                except Exception:
+                    blobs.append(pickle.dumps([None]))
+            return blobs
+
+    def _restoreState(self, state):
+        """ Put the log and algorithms back as they were in a checkpoint. """
+        self.log.messages = state['messages']
+        self.log.events = state['events']
+
+        saved = []
+        for blob in state['algorithms']:
+            saved += pickle.loads(blob)
+        if len(saved) != len(self._algos):
+            print ("%s: Algorithms have changed since the checkpoint, "
+                   "starting them again" % self.__class__.__name__)
+            return
+
+        for algo, algo_state in zip(self._algos, saved):
+            if algo_state is None or algo_state[0] != algo.desc:
+                continue
+            algo.__dict__.update(algo_state[1])
+            algo.variables._aggregators = algo_state[2]
+            algo.resume()
+
     def _flightEnding(self):
         ## Output file string creation
         if self._output_file_path is None:
@@ -302,11 +874,19 @@ class NWatcher(object):
         print ("[%sZ] Outputting file to %s" %
                      (self._server.getTimeStr(), out_file_name))
 
+        if self._updater is not None:
+            self._updater.fillAll()  # Variables with a slower cadence
+            self.timing['ingest'] += self._updater.seconds
+            self.timing['rows'] += self._updater.rows
+
         ## Actually try to write the file
+        start = time.time()
         try:
+            if self._lazy:
+                self._variables.materializeAll()
             out_file = NRTFile()
             labels = self._variables.labels
-            data = self._variables.sliceWithTime(None, None)
+            data = self._variables.sliceWithTime(None, None, epoch=True)
             if self._header == False:
                 out_file.write(file_name=out_file_name,
                                labels=labels,
@@ -321,27 +901,68 @@ class NWatcher(object):
             print "%s: Could not create data file" % self.__class__.__name__
             print e
 
+        ## Overviews of the flight, if kept
+        for rollup in (self._variables.rollups
+                       if self._variables is not None else []):
+            try:
+                NRTFile().write(file_name=rollup_file_str(out_file_name,
+                                                          rollup.period),
+                                labels=rollup.labels(),
+                                data=rollup.select())
+            except Exception, e:
+                print ("%s: Could not create rollup file"
+                       % self.__class__.__name__)
+                print e
+
+        if self._save_events and self.log is not None:
+            try:
+                self.log.events.save(events_file_str(out_file_name))
+            except Exception, e:
+                print ("%s: Could not create events file"
+                       % self.__class__.__name__)
+                print e
+        self.timing['output'] += time.time() - start
+
+        ## Everything the algorithms said goes out before the mail.
+        if self.log is not None:
+            self.log.close()
+
         ## Now try to mail the file
         try:
             mail_time = self._server.getTimeStr()
 
             ## TODO: Change email subject to project name and flight number
-            if self._email is not None:
-                if self.log.messages != []:
+            if self._email is not None or len(self._sinks) != 0:
+                if self.log is not None and self.log.messages != []:
                     body_msg = "\n".join(self.log.messages)
                 else:
                     body_msg = "Data attached"
-                self._email(self._server.getFlightInformation(),
-                            [out_file_name], body_msg)
+                flight_info = self._server.getFlightInformation()
+                for sink in self._sinks:
+                    sink.artifact(flight_info, [out_file_name], body_msg)
 
-                print "[%s] Sent mail." % self._server.getTimeStr()
+            if self._email is not None:
+                self._mail_sink.artifact(flight_info, [out_file_name],
+                                         body_msg)
+                if isinstance(self._mail_sink, NQueuedSink):
+                    print "[%s] Queued mail." % self._server.getTimeStr()
+                else:
+                    print "[%s] Sent mail." % self._server.getTimeStr()
         except Exception, e:
             print "%s: Could not send mail" % self.__class__.__name__
             print e
 
         self._flying_now = False
+        self._landing = False
         self._flight_end_time = self._server.getTime()
+        if self._checkpoint is not None:
+            self._checkpoint.clear()
+        if self.shared is not None:
+            self.shared.close()
+            self.shared = None
         self._num_flight += 1
+        if self.log is not None:
+            self.events = self.log.events
         self.log = None
         self._variables = None
         self._updater = None
@@ -354,7 +975,8 @@ class NWatcher(object):
         """
         Store an NAlgorithm object to later call its process function in
         NAlgorithm.run(). Can use a setup function to programmatically create
-        a persistent local scope.
+        a persistent local scope. See NAlgorithm for the run modes; a
+        "batch" process function gets all the new rows at once.
         """
         if description is None:
             description = "No Description"
@@ -378,10 +1000,30 @@ class NWatcher(object):
 
     def resetAlgos(self):
         """ Return to setup state. """
+        if self._lazy:
+            ## Fetch what the algorithms need in one go, rather than one
+            ## backfill per variable.
+            needed = []
+            for algo, variables in self.__input_algos:
+                if (algo not in self.__passive_algos and
+                    len(self._checkIfVariablesExists(variables)) == 0):
+                    needed += [var for var in variables if var not in needed]
+            self._variables.materialize(needed)
+
         for algo_var in self.__input_algos:
             algo = algo_var[0]
             variables = algo_var[1]
 
+            ## Passive algorithms only run on the variables there are, and
+            ## with `lazy` only on those already in use.
+            if algo in self.__passive_algos:
+                variables = [var for var in variables
+                             if var not in self._checkIfVariablesExists([var])
+                             and (not self._lazy or
+                                  self._variables.isMaterialized(var))]
+                if len(variables) == 0:
+                    continue
+
             bad_variables = self._checkIfVariablesExists(variables)
             if len(bad_variables) != 0:
                 print ("Could not run algorithm that has "
@@ -398,9 +1040,18 @@ class NWatcher(object):
 
             algo.log = self.log
             algo.flight_start_time = self._flight_start_time
+            algo.gaps = self._variables.gaps
+            algo.watermark = None
+            if self._cadences is not None or self._default_cadence != 1:
+                algo.watermark = self.__watermark(variables)
             algo.reset()
             self._algos.append(algo)
 
+    def __watermark(self, variables):
+        """ How far an algorithm on `variables` can process. """
+        variables = [var.lower() for var in variables]
+        return lambda: self._updater.watermark(variables)
+
     def attachBoundsCheck(self, variable_name=None,
                           lower_bound=-32767,
                           upper_bound=32767):
@@ -427,12 +1078,15 @@ class NWatcher(object):
             ## If out of range and was not so before
             if not(self.lower_bound <= val <= self.upper_bound) \
                  and self.error == False:
-                self.log.print_msg("%s out of bounds." % self.name, tm)
+                self.log.print_msg("%s out of bounds." % self.name, tm,
+                                   variable=self.name,
+                                   kind="out of bounds", severity=WARNING)
                 self.error = True
             ## If in range after being out of range
             elif self.lower_bound <= val <= self.upper_bound \
                      and self.error == True:
-                self.log.print_msg("%s back in bounds." % self.name, tm)
+                self.log.print_msg("%s back in bounds." % self.name, tm,
+                                   variable=self.name, kind="in bounds")
                 self.error = False
 
         ## Attach method to object of NAlgorithm
@@ -442,34 +1096,129 @@ class NWatcher(object):
                         description=("Bounds check for %s"
                                      % variable_name))
 
-    def _badDataCheck(self, variables=None):
-        for var in variables:
-            self.__badDataForVariable(var)
+    def attachDriftCheck(self, variable_name=None, limit=None,
+                         window=datetime.timedelta(minutes=5),
+                         alpha=0.001):
+        """
+        Checks to see if the mean of a variable over the last `window` has
+        moved more than `limit` away from its long term (exponentially
+        weighted) baseline. If so it calls log.print() to print a message to
+        the user.
+        """
+        if limit is None:
+            raise ValueError('%s: a drift check needs a limit'
+                             % self.__class__.__name__)
 
-    def __badDataForVariable(self, variable_name=None):
-        bad_data_flags = self._server.getBadDataValues()
+        missing_value = (self._server.getBadDataValues()
+                         .get(variable_name.upper()))
 
-        def setup_bad(self, *args, **kwds):
-            self._bad_table = bad_data_flags
-            self.var = variable_name
-            self.out_of_bounds = bad_data_flags[self.var.upper()]
+        def driftCheckSetup(self, *args, **kwds):
+            """
+            Setup function to give instantiated object persistent variables.
+            """
+            self.limit = limit
             self.error = False
             self.name = variable_name
-
-        def process_bad(self, tm, data):
-            if data[0] == self.out_of_bounds and self.error == False:
-                self.log.print_msg('%s MISSING DATA' % self.name, tm)
+            self.recent = self.variables.attachAggregator(
+                              variable_name,
+                              NRollingStats(duration=window,
+                                            missing_value=missing_value))
+            self.baseline = self.variables.attachAggregator(
+                              variable_name,
+                              NEWMA(alpha=alpha,
+                                    missing_value=missing_value))
+
+        def driftCheck(self, tm, data):
+            """
+            Determine if drifting, and only print a message once if so.
+            """
+            if self.recent.mean is None or self.baseline.value is None:
+                return
+
+            drift = abs(self.recent.mean - self.baseline.value)
+            if drift > self.limit and self.error == False:
+                self.log.print_msg("%s drifting." % self.name, tm,
+                                   variable=self.name, kind="drifting",
+                                   severity=WARNING)
                 self.error = True
-            elif data[0] != self.out_of_bounds and self.error == True:
-                self.log.print_msg('%s no longer has missing data'
-                                   % self.name, tm)
+            elif drift <= self.limit and self.error == True:
+                self.log.print_msg("%s no longer drifting." % self.name, tm,
+                                   variable=self.name, kind="drift cleared")
                 self.error = False
 
+        ## Attach method to object of NAlgorithm
         self.attachAlgo(variables=[variable_name],
+                        start_fn=driftCheckSetup,
+                        process_fn=driftCheck,
+                        description=("Drift check for %s"
+                                     % variable_name))
+
+    def _badDataCheck(self, variables=None):
+        """
+        Report each variable starting and ending a run of missing data (its
+        bad data flag). One algorithm checks every variable fetched at the
+        same cadence, from the missing value masks of the set (see
+        NVarSet.maskMissing), so an update only costs a count of each mask
+        and a search where a variable has changed.
+        """
+        cadence_of = {}
+        for names, cadence in (self._cadences or {}).iteritems():
+            if isinstance(names, basestring):
+                names = (names,)
+            for name in names:
+                cadence_of[name.lower()] = cadence
+
+        groups = OrderedDict()  # {cadence: [variable, ...]}
+        for var in variables:
+            cadence = cadence_of.get(var.lower(), self._default_cadence)
+            groups.setdefault(cadence, []).append(var)
+
+        for group in groups.itervalues():
+            self.__badDataForVariables(group)
+
+    def __badDataForVariables(self, variable_names):
+
+        def setup_bad(self, *args, **kwds):
+            self.error = {}  # {variable: in a run of missing data}
+
+        def process_bad(self, times, columns):
+            start, stop = self.batch
+            for name in self.variables.keys():
+                var = self.variables.getNVar(name)
+                error = self.error.get(name, False)
+                missing = var.missingCount(start, stop)
+                if missing == (stop - start if error else 0):
+                    continue  # No change
+
+                first = start
+                for run_start, run_end in (var.missingRuns(start, stop) +
+                                           [(stop, stop)]):
+                    if run_start > first and error == True:
+                        self.log.print_msg('%s no longer has missing data'
+                                           % name,
+                                           var.getTimeFromPos(first),
+                                           variable=name,
+                                           kind="missing cleared",
+                                           algorithm=("Bad data check for "
+                                                      "%s" % name))
+                        error = False
+                    if run_start < run_end and error == False:
+                        self.log.print_msg('%s MISSING DATA' % name,
+                                           var.getTimeFromPos(run_start),
+                                           variable=name, kind="missing",
+                                           severity=WARNING,
+                                           algorithm=("Bad data check for "
+                                                      "%s" % name))
+                        error = True
+                    first = run_end
+                self.error[name] = error
+
+        self.attachAlgo(variables=variable_names,
                         start_fn=setup_bad,
                         process_fn=process_bad,
-                        description=("Bad data check for %s"
-                                     % variable_name))
+                        run_mode="batch",
+                        description="Bad data checks")
+        self.__passive_algos.append(self.__input_algos[-1][0])
 
     def _resetVariables(self, variables):
         ## Remove dud variables
@@ -479,7 +1228,22 @@ class NWatcher(object):
             print ("The following variables do not exist: %s"
                    % [var for var in self.__input_variables
                       if var not in variables])
-        return NVarSet(variables)
+        if self._lazy:
+            nset = NLazyVarSet(variables, self._backfill)
+        else:
+            nset = NVarSet(variables)
+        if self._compress:
+            nset.compress()
+        return nset
+
+    def _backfill(self, variables, start_time):
+        """ History of newly used variables for an NLazyVarSet. """
+        start = time.time()
+        data = self._server.getData(variables=variables,
+                                    start_time=(start_time -
+                                                datetime.timedelta(seconds=1)))
+        self.timing['ingest'] += time.time() - start
+        return data
 
     def _checkIfVariablesExists(self, variables):
         return [var for var in variables
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Benchmark history files. Each run of a benchmark appends one JSON object
+## per line, recording when and on what revision, python and machine it ran,
+## so results can be compared across releases with any JSON reader.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:01:50
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+import datetime
+import json
+import os
+import platform
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def revision():
+    """ The git revision of the tree, None if it cannot be found. """
+    try:
+        process = subprocess.Popen(["git", "rev-parse", "--short", "HEAD"],
+                                   cwd=ROOT_DIR,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        out = process.communicate()[0].strip()
+        return out if process.returncode == 0 and out != "" else None
+    except OSError:
+        return None
+
+
+def append(file_name, benchmark, results):
+    """ Append one run of `benchmark` to the history file. """
+    record = {'benchmark': benchmark,
+              'date': datetime.datetime.utcnow().strftime(
+                          "%Y-%m-%dT%H:%M:%SZ"),
+              'revision': revision(),
+              'python': platform.python_version(),
+              'machine': platform.node(),
+              'results': results}
+
+    f = open(file_name, 'a')
+    f.write(json.dumps(record, sort_keys=True) + "\n")
+    f.close()
+
+
+def load(file_name, benchmark=None):
+    """ All records of a history file, optionally only of one benchmark. """
+    records = []
+    if not os.path.exists(file_name):
+        return records
+
+    for line in open(file_name, 'r'):
+        line = line.strip()
+        if line == "":
+            continue
+        record = json.loads(line)
+        if benchmark is None or record['benchmark'] == benchmark:
+            records.append(record)
+
+    return records
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Micro benchmarks of the NVar and NVarSet operations used on the hot path:
+## appending a tick of data, point lookups by integer and by datetime, range
+## slices, merging with `+` and exporting a whole set to an .asc file. Each
+## operation is timed over a grid of realistic sizes, from 1 to 500 variables
+## and from a thousand to a hundred thousand rows (the 5 second data of a
+## long flight is about eight thousand rows, 1 second data is 36 thousand).
+##
+## The data is generated from a fixed random seed and each timing is the best
+## of several repeats, so runs are comparable. Results are appended to a
+## history file (benchmarks/history.jsonl by default), and --compare prints
+## the change from the previous run recorded on the same machine.
+##
+##     python benchmarks/micro_nvar.py --quick
+##     python benchmarks/micro_nvar.py --compare
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:02:29
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+
+## System
+import datetime
+import gc
+import optparse
+import os
+import platform
+import random
+import sys
+import timeit
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+
+## Run against the package in this tree.
+sys.path.insert(0, ROOT_DIR)
+
+from NCARFlightMonitor.data import NVar, NVarSet
+from NCARFlightMonitor.datafile import NRTFile
+import history
+
+DEFAULT_HISTORY = os.path.join(BENCH_DIR, "history.jsonl")
+
+## (variables, rows) sizes. The single variable sizes time the NVar
+## operations, the rest the NVarSet operations.
+GRID = ((1, 1000), (1, 10000), (1, 100000),
+        (10, 1000), (10, 10000), (10, 100000),
+        (100, 1000), (100, 10000),
+        (500, 1000), (500, 10000))
+QUICK_GRID = ((1, 1000), (1, 10000), (10, 1000), (100, 1000))
+
+## Number of point lookups timed per repeat.
+LOOKUPS = 1000
+
+START = datetime.datetime(2011, 8, 19, 17, 5, 3)
+DATA_RATE = datetime.timedelta(seconds=5)
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def makeRows(variables, rows, seed=1, start=START):
+    """ Rows of (datetime, value, ...) like those from the server. """
+    rand = random.Random(seed)
+    return [tuple([start + i * DATA_RATE] +
+                  [rand.uniform(-100, 100) for var in xrange(variables)])
+            for i in xrange(rows)]
+
+
+def makeNVar(rows, start=START, seed=1):
+    var = NVar("var0")
+    var.addData([(row[0], row[1]) for row in makeRows(1, rows, seed, start)])
+    return var
+
+
+def makeNVarSet(variables, rows):
+    nset = NVarSet(["var%d" % i for i in xrange(variables)])
+    nset.addData(makeRows(variables, rows))
+    return nset
+
+
+def best(fn, repeat, number=1):
+    """ Best time of `repeat` runs of `number` calls of fn, per call. """
+    timer = timeit.Timer(fn)
+    gc.collect()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def benchNVar(rows, repeat):
+    """ Seconds per operation for the NVar operations at `rows` rows. """
+    results = {}
+    data = [(row[0], row[1]) for row in makeRows(1, rows)]
+
+    ## Append one tick at a time, as NDatabaseLiveUpdater does.
+    def append():
+        var = NVar("var0")
+        for row in data:
+            var.addData([row])
+    results['nvar_append_row'] = best(append, repeat) / rows
+
+    var = makeNVar(rows)
+    rand = random.Random(2)
+    positions = [rand.randrange(rows) for i in xrange(LOOKUPS)]
+    times = [data[pos][0] for pos in positions]
+
+    def lookupInt():
+        for pos in positions:
+            var[pos]
+    results['nvar_lookup_int'] = best(lookupInt, repeat) / LOOKUPS
+
+    def lookupDatetime():
+        for tm in times:
+            var[tm]
+    results['nvar_lookup_datetime'] = best(lookupDatetime, repeat) / LOOKUPS
+
+    ## The last 1% of the rows, as algorithms slice recent data.
+    window = max(10, rows // 100)
+    start_time = data[-window][0]
+    results['nvar_slice_recent'] = best(
+        lambda: var.sliceWithTime(start_time, None), repeat)
+
+    ## Merging: a second half that lies entirely after the first, and two
+    ## halves whose times interleave.
+    first = makeNVar(rows // 2)
+    after = makeNVar(rows - rows // 2, start=START + (rows // 2) * DATA_RATE)
+    interleaved = makeNVar(rows - rows // 2,
+                           start=START + datetime.timedelta(seconds=2))
+    results['nvar_merge_after'] = best(lambda: first + after, repeat)
+    results['nvar_merge_interleaved'] = best(lambda: first + interleaved,
+                                             repeat)
+
+    return results
+
+
+def benchNVarSet(variables, rows, repeat):
+    """ Seconds per operation for the NVarSet operations. """
+    results = {}
+    data = makeRows(variables, rows)
+    names = ["var%d" % i for i in xrange(variables)]
+
+    ## Append one tick at a time.
+    def append():
+        nset = NVarSet(names)
+        for row in data:
+            nset.addData([row])
+    results['nvarset_append_row'] = best(append, repeat) / rows
+
+    nset = makeNVarSet(variables, rows)
+    window = max(10, rows // 100)
+    start_time = data[-window][0]
+    results['nvarset_slice_recent'] = best(
+        lambda: nset.sliceWithTime(start_time, None), repeat)
+
+    def export():
+        NRTFile().write(file_name=os.devnull, labels=nset.labels,
+                        data=nset.sliceWithTime(None, None))
+    results['nvarset_export'] = best(export, repeat)
+
+    return results
+
+
+def run(grid, repeat):
+    """ Run the benchmarks over the grid, {operation: {size: seconds}}. """
+    results = {}
+
+    def record(size, timings):
+        for operation, seconds in timings.iteritems():
+            results.setdefault(operation, {})[size] = seconds
+
+    for variables, rows in grid:
+        size = "%dx%d" % (variables, rows)
+        print >>sys.stderr, "Running %s variables x rows" % size
+        if variables == 1:
+            record(size, benchNVar(rows, repeat))
+        record(size, benchNVarSet(variables, rows, repeat))
+
+    return results
+
+
+def previousRun(file_name):
+    """
+    The last recorded results from this machine, None if there are none.
+    """
+    records = [record for record in history.load(file_name, "micro_nvar")
+               if record['machine'] == platform.node()]
+    return records[-1]['results'] if len(records) != 0 else None
+
+
+def printResults(results, previous=None):
+    """ One line per operation and size, in microseconds. """
+    for operation in sorted(results):
+        for size in sorted(results[operation],
+                           key=lambda s: tuple(map(int, s.split('x')))):
+            seconds = results[operation][size]
+            line = "%-24s %12s %14.2f us" % (operation, size, seconds * 1e6)
+            if previous is not None and size in previous.get(operation, {}):
+                line += "  x%.2f" % (seconds / previous[operation][size])
+            print line
+
+## --------------------------------------------------------------------------
+## Start command line interface (main)
+## --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-q", "--quick", dest="quick", action="store_true",
+                      default=False, help="only the small sizes")
+    parser.add_option("-r", "--repeat", dest="repeat", type="int",
+                      default=3, help="repeats per timing (best is kept)")
+    parser.add_option("-H", "--history", dest="history",
+                      default=DEFAULT_HISTORY,
+                      help="history file to append results to")
+    parser.add_option("-n", "--no-history", dest="record",
+                      action="store_false", default=True,
+                      help="do not record the results")
+    parser.add_option("-c", "--compare", dest="compare", action="store_true",
+                      default=False,
+                      help="show the change from the previous run")
+    options, args = parser.parse_args()
+
+    previous = previousRun(options.history) if options.compare else None
+    results = run(QUICK_GRID if options.quick else GRID, options.repeat)
+    printResults(results, previous)
+
+    if options.record:
+        history.append(options.history, "micro_nvar", results)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Golden output regression benchmark. Every sample flight in `samples/` is
+## replayed in process (database.NMemoryDatabase) through an NWatcher with the
+## default bad data checks and the algorithms from 'examples/functions.py'.
+## The log messages must match the stored golden logs in `benchmarks/golden/`
+## message for message, and the time spent parsing the file, ingesting rows,
+## running algorithms and writing the output file is reported.
+##
+##     python benchmarks/replay_samples.py                  # check and time
+##     python benchmarks/replay_samples.py --history h.json # also record
+##     python benchmarks/replay_samples.py --update         # new goldens
+##
+## Only use --update when a change of output is intended, and commit the new
+## golden logs with that change. The exit code is non zero when any sample
+## does not match its golden log.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:01:50
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+
+## System
+import datetime
+import optparse
+import os
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+SAMPLE_DIR = os.path.join(ROOT_DIR, "samples")
+GOLDEN_DIR = os.path.join(BENCH_DIR, "golden")
+
+## Run against the package in this tree, with the example algorithms.
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "examples"))
+
+from NCARFlightMonitor.batch import replayFlight, compareReports
+from batch_replay import configure
+import history
+
+## Sample files and the simulated start time of their replay (None starts at
+## the first row of the file). rf05 starts at the time used in README.mkd.
+SAMPLES = (
+    ("HIPPO-5-rf05-2011_08_20-03_34_52.asc",
+     datetime.datetime(2011, 8, 19, 18, 0, 0)),
+    ("ICE-T-rf12-2011_07_30-19_38_00.asc", None),
+)
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def goldenPath(sample):
+    return os.path.join(GOLDEN_DIR,
+                        "%s%slog" % (os.path.splitext(sample)[0], os.extsep))
+
+
+def runSample(sample, start_time):
+    """
+    Replay a sample and collect its messages and timing as a dictionary.
+    """
+    ## Keep the watcher's own status prints out of the report.
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        result = replayFlight(os.path.join(SAMPLE_DIR, sample),
+                              configure=configure,
+                              simulate_start_time=start_time)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    if result['error'] is not None:
+        print >>sys.stderr, result['error']
+        return None, result['messages']
+
+    timing = result['timing']
+    ingest = timing['ingest']
+    rows_per_second = timing['rows'] / ingest if ingest > 0 else 0.0
+    return {'parse_s': result['parse'],
+            'rows': timing['rows'],
+            'ingest_s': ingest,
+            'ingest_rows_per_s': rows_per_second,
+            'algorithms_s': timing['algorithms'],
+            'output_s': timing['output'],
+            'total_s': result['seconds']}, result['messages']
+
+
+def checkGolden(sample, messages, update=False):
+    """
+    Compare the messages with the golden log of a sample (or replace the
+    golden log). Returns the list of differences.
+    """
+    actual = "\n".join(messages)
+    path = goldenPath(sample)
+
+    if update:
+        f = open(path, 'w')
+        f.write(actual + "\n")
+        f.close()
+        return []
+
+    if not os.path.exists(path):
+        return ["no golden log %s, run with --update" % path]
+
+    expected = open(path, 'r').read().rstrip('\n')
+    return compareReports(expected, actual)
+
+## --------------------------------------------------------------------------
+## Start command line interface (main)
+## --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-u", "--update", dest="update", action="store_true",
+                      default=False, help="rewrite the golden logs")
+    parser.add_option("-H", "--history", dest="history", default=None,
+                      help="append the results to this history file")
+    options, args = parser.parse_args()
+
+    print ("%-38s %8s %7s %10s %8s %8s %8s  %s"
+           % ("sample", "parse s", "rows", "rows/s", "algos s",
+              "output s", "total s", "golden"))
+
+    results = {}
+    failed = False
+    for sample, start_time in SAMPLES:
+        timing, messages = runSample(sample, start_time)
+        if timing is None:
+            failed = True
+            print "%-38s replay failed" % sample
+            continue
+
+        diff = checkGolden(sample, messages, update=options.update)
+        status = ("updated" if options.update
+                  else ("ok" if len(diff) == 0 else "MISMATCH"))
+        failed = failed or len(diff) != 0
+        timing['golden'] = status
+        results[sample] = timing
+
+        print ("%-38s %8.3f %7d %10.0f %8.3f %8.3f %8.3f  %s"
+               % (sample, timing['parse_s'], timing['rows'],
+                  timing['ingest_rows_per_s'], timing['algorithms_s'],
+                  timing['output_s'], timing['total_s'], status))
+        for line in diff:
+            print "    %s" % line
+
+    if options.history is not None:
+        history.append(options.history, "replay_samples", results)
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Replay archived flights through the NWatcher class with the algorithms from
+## 'examples/functions.py', one flight per core, and print all of the log
+## messages as one report. When given a previous report with --compare the
+## differences are printed instead, and the exit code is non zero if there
+## are any.
+##
+##     python batch_replay.py ../samples/*.asc > before.txt
+##     (change an algorithm)
+##     python batch_replay.py --compare before.txt ../samples/*.asc
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 05:00:15
+
+## --------------------------------------------------------------------------
+## Imports and Globals
+## --------------------------------------------------------------------------
+from NCARFlightMonitor.batch import replayFlights, formatReport, compareReports
+import functions
+
+## System
+import optparse
+import sys
+
+## --------------------------------------------------------------------------
+## Functions
+## --------------------------------------------------------------------------
+
+
+def configure(watch_server):
+    """ The algorithms to replay, the same as cli_monitor.py. """
+    watch_server.attachAlgo(variables=('coraw_al',),
+                            start_fn=functions.setup_co,
+                            process_fn=functions.process_co,
+                            description="CO raw cal checker")
+
+    watch_server.attachAlgo(variables=('coraw_al',),
+                            start_fn=functions.setup_lost_satcom,
+                            process_fn=functions.process_lost_satcom,
+                            run_mode="every update",
+                            description="Satcom loss indicator")
+
+## --------------------------------------------------------------------------
+## Start command line interface (main)
+## --------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    parser = optparse.OptionParser(usage="%prog [options] flight.asc ...")
+    parser.add_option("-c", "--compare", dest="compare", default=None,
+                      help="report from an earlier run to compare against")
+    parser.add_option("-p", "--processes", dest="processes", type="int",
+                      default=None, help="worker processes (default: cores)")
+    parser.add_option("-t", "--timing", dest="timing", action="store_true",
+                      default=False, help="include replay times in report")
+    options, files = parser.parse_args()
+
+    if len(files) == 0:
+        parser.error("no flight files given")
+
+    results = replayFlights(files, configure=configure,
+                            processes=options.processes)
+
+    if options.compare is None:
+        print formatReport(results, timing=options.timing)
+    else:
+        expected = open(options.compare, 'r').read().rstrip('\n')
+        diff = compareReports(expected, formatReport(results))
+        for line in diff:
+            print line
+        sys.exit(1 if len(diff) != 0 else 0)
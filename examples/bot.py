@@ -19,33 +19,36 @@ from NCARFlightMonitor.database import NDatabase
 from NCARFlightMonitor.database import NDatabaseLiveUpdater, NDatabaseManager
 from NCARFlightMonitor.data import NVar
 from NCARFlightMonitor.watch import NWatcher, logger
+from NCARFlightMonitor.driver import NTwistedDriver
 import NCARFlightMonitor
 import datetime
 
 import os
 import time
 from twisted.words.protocols import irc
-from twisted.internet import protocol, reactor, ssl, task
+from twisted.internet import protocol, reactor, ssl
 
 import sys
 import functions
 
 Zeus = None
+Driver = None
 
 ## --------------------------------------------------------------------------
 ## Functions
 ## --------------------------------------------------------------------------
 
 
-## Used to print messages to a chatroom
+## Used to print messages to a chatroom. The watcher delivers its messages
+## from a background thread, so the message is handed to the reactor.
 def zeusMsg(message, tm=None):
     try:
         if tm is not None:
             formatted_msg = "[%sZ] %s" % (tm, message)
-            Zeus.msg("#co", formatted_msg)
+            reactor.callFromThread(Zeus.msg, "#co", formatted_msg)
         else:
             formatted_msg = message
-            Zeus.msg("#co", formatted_msg)
+            reactor.callFromThread(Zeus.msg, "#co", formatted_msg)
 
         print formatted_msg
         return formatted_msg
@@ -74,21 +77,30 @@ class ZeusBot(irc.IRCClient):
     def privmsg(self, user, channel, msg):
         ## /msg ZeusBot start to start watching server
         if msg == "start":
-            global Zeus
+            global Zeus, Driver
             Zeus = self
+            if Driver is not None and Driver.running:
+                return
 
+            ## Summarise flapping variables once a minute rather than
+            ## flooding the channel.
             watch_server = NWatcher(database="GV",
                                    email_fn=functions.sendMail,
-                                   print_msg_fn=zeusMsg)
+                                   print_msg_fn=zeusMsg,
+                                   coalesce=datetime.timedelta(minutes=1),
+                                   background_log=True)
 
             watch_server.attachAlgo(variables=('coraw_al',),
                 start_fn=functions.setup_co,
                 process_fn=functions.process_co)
 
-            l = task.LoopingCall(watch_server.run)
-            l.start(0.01)
+            ## Polls in the reactor's thread pool and waits with callLater,
+            ## so the bot never freezes for the data rate.
+            Driver = NTwistedDriver(watch_server)
+            Driver.start()
         elif msg == "stop":
-            pass
+            if Driver is not None:
+                Driver.stop()
 
 
 class ZeusBotFactory(protocol.ClientFactory):
@@ -102,6 +102,18 @@ def process_lost_satcom(self, tm, data):
         self.lost_count = 0
 
 
+def process_satcom_gaps(self, tm, data):
+    """
+    Report each satcom interruption once the data is back, from the gaps
+    the watcher indexes. Unlike process_lost_satcom this is a run_mode="new
+    data" algorithm, and also sees the length of the interruption.
+    """
+    for before, after in self.gaps(tm, tm):
+        if after == tm:
+            self.log.print_msg("Satcom interruption of %s since %s"
+                               % (after - before, before), tm)
+
+
 ## sendMail in watch module is empty, it must be filled out later in order
 ## to send emails. This was done because there is no cross platform, cross
 ## mail server implementation that works to send emails except an SMTP server,
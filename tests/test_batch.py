@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of the batch replay of flight files in worker processes, with the
+## algorithms of examples/batch_replay.py, and of a replay against its
+## golden log in benchmarks/golden.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:47:13
+
+import os
+import sys
+import unittest
+
+from NCARFlightMonitor.batch import (replayFlight, replayFlights,
+                                     formatReport, compareReports)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, "samples", "ICE-T-rf12-2011_07_30-19_38_00.asc")
+GOLDEN = os.path.join(ROOT, "benchmarks", "golden",
+                      "ICE-T-rf12-2011_07_30-19_38_00.log")
+
+sys.path.insert(0, os.path.join(ROOT, "examples"))
+from batch_replay import configure
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self):
+        ## Keep the watcher's own status prints out of the test output.
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+    def test_workers_same_as_in_process(self):
+        expected = [replayFlight(SAMPLE, configure=configure)]
+        results = replayFlights([SAMPLE, SAMPLE], configure=configure,
+                                processes=2)
+        self.assertEqual(results[0]['error'], None)
+        self.assertTrue(len(results[0]['messages']) > 0)
+        self.assertEqual(compareReports(formatReport(expected * 2),
+                                        formatReport(results)), [])
+
+    def test_golden_log(self):
+        result = replayFlight(SAMPLE, configure=configure)
+        f = open(GOLDEN, 'r')
+        try:
+            expected = f.read().rstrip('\n')
+        finally:
+            f.close()
+        self.assertEqual(compareReports(expected,
+                                        "\n".join(result['messages'])), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of getData answered through a cache.NChunkCache, against a table
+## of rows held in the test that can be added to out of order, as the rows
+## sent after a satcom outage are.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:46:00
+
+import bisect
+import datetime
+import unittest
+
+from NCARFlightMonitor.cache import NChunkCache
+from NCARFlightMonitor.database import NDatabase, _parseInterval
+
+START = datetime.datetime(2011, 8, 19, 18)
+
+
+def rows(first, last):
+    """ Rows every three seconds from `first` up to `last` minutes in. """
+    return [(START + datetime.timedelta(seconds=seconds), float(seconds))
+            for seconds in range(first * 60, last * 60, 3)]
+
+
+def withB(data):
+    """ The rows of `data` with the variable b, the negative of a. """
+    return [row + (-row[1],) for row in data]
+
+
+class NTableDatabase(NDatabase):
+    """
+    An NDatabase whose raf_lrt is the list `rows` of (datetime, a), with the
+    variable b being -a.
+    """
+
+    def __init__(self, cache):
+        NDatabase.__init__(self, host="test", database="test", cache=cache,
+                           connect=False)
+        self.variable_list = ("a", "b")
+        self._flight_info = {'DataRate': '3'}
+        self.rows = []
+        self.now = START
+        self.queries = 0
+        self.newest_queries = 0
+
+    def insert(self, new_rows):
+        for row in new_rows:
+            bisect.insort(self.rows, row)
+
+    def _getSimulatedCurrentTime(self):
+        return self.now
+
+    def _select(self, data, variables):
+        return [(row[0],) + tuple([row[1] if var == "a" else -row[1]
+                                   for var in variables])
+                for row in data]
+
+    def _newestTime(self):
+        self.newest_queries += 1
+        times = [row[0] for row in self.rows if row[0] <= self.now]
+        return times[-1] if len(times) != 0 else None
+
+    def _rangeQuery(self, variables, start, stop):
+        self.queries += 1
+        return self._select([row for row in self.rows
+                             if start <= row[0] < stop], variables)
+
+    def _queryData(self, variables=None, start_time=None, end_time=None,
+                         number_entries=None, epoch=False):
+        if not isinstance(start_time, datetime.datetime):
+            start_time = self.now + _parseInterval(start_time)
+        return self._select([row for row in self.rows
+                             if start_time < row[0] <= self.now]
+                            [:number_entries], variables)
+
+
+class TestLateRows(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = NChunkCache()
+        self.db = NTableDatabase(self.cache)
+        self.db.now = START + datetime.timedelta(minutes=40)
+
+    def test_complete_buckets_cached(self):
+        self.db.insert(rows(0, 40))
+        expected = rows(0, 40)[1:]
+        self.assertEqual(self.db.getData(["a"], start_time=START), expected)
+        self.assertEqual(self.db.getData(["a"], start_time=START), expected)
+        self.assertEqual(self.db.queries, 1)
+
+    def test_rows_inserted_into_a_gap(self):
+        ## Satcom lost from 10 to 20 minutes, its rows arriving later.
+        self.db.insert(rows(0, 10) + rows(20, 40))
+        self.assertEqual(self.db.getData(["a"], start_time=START),
+                         rows(0, 10)[1:] + rows(20, 40))
+        for minutes in (10, 15):
+            start = START + datetime.timedelta(minutes=minutes)
+            self.assertEqual(self.cache.get(("test", "test"), "a", start),
+                             None)
+        self.assertNotEqual(self.cache.get(("test", "test"), "a", START),
+                            None)
+
+        self.db.insert(rows(10, 20))
+        self.assertEqual(self.db.getData(["a"], start_time=START),
+                         rows(0, 40)[1:])
+
+    def test_number_entries(self):
+        self.db.insert(rows(0, 40))
+        self.db.getData(["a"], start_time=START)
+        queries = self.db.queries
+        after = START + datetime.timedelta(minutes=3)
+        self.assertEqual(self.db.getData(["a"], start_time=after,
+                                         number_entries=100),
+                         rows(3, 40)[1:101])
+        self.assertEqual(self.db.queries, queries)
+
+    def test_bucket_of_the_newest_row(self):
+        ## Rows up to 22 minutes arrived, the rest are on their way.
+        self.db.insert(rows(0, 22))
+        self.db.getData(["a"], start_time=START)
+        start = START + datetime.timedelta(minutes=20)
+        self.assertEqual(self.cache.get(("test", "test"), "a", start), None)
+
+        self.db.insert(rows(22, 40))
+        self.assertEqual(self.db.getData(["a"], start_time=START),
+                         rows(0, 40)[1:])
+
+    def test_missing_row(self):
+        ## One row missing in the middle, at the start and at the end of a
+        ## bucket.
+        data = rows(0, 40)
+        missing = [START + datetime.timedelta(seconds=seconds)
+                   for seconds in (7 * 60, 10 * 60, 20 * 60 - 3)]
+        self.db.insert([row for row in data if row[0] not in missing])
+        self.db.getData(["a"], start_time=START)
+        for minutes in (0, 5, 10, 15):
+            start = START + datetime.timedelta(minutes=minutes)
+            self.assertEqual(self.cache.get(("test", "test"), "a", start)
+                             is None, minutes != 0)
+
+        self.db.insert([row for row in data if row[0] in missing])
+        self.assertEqual(self.db.getData(["a"], start_time=START), data[1:])
+
+    def test_chunks_with_different_times(self):
+        ## A max_gap of two rows caches the first bucket of a without the
+        ## row at two minutes, which then arrives before b is fetched.
+        self.cache.max_gap = datetime.timedelta(seconds=6)
+        late = START + datetime.timedelta(minutes=2)
+        self.db.insert([row for row in rows(0, 40) if row[0] != late])
+        self.db.getData(["a"], start_time=START)
+        self.assertEqual(len(self.cache.get(("test", "test"), "a",
+                                            START)[0]), 99)
+
+        self.db.insert([row for row in rows(0, 40) if row[0] == late])
+        self.assertEqual(self.db.getData(["a", "b"], start_time=START),
+                         withB(rows(0, 40))[1:])
+        self.assertEqual(len(self.cache.get(("test", "test"), "a",
+                                            START)[0]), 100)
+
+    def test_newest_time_from_rows_fetched(self):
+        ## Only the first query asks for the newest time; later ones know
+        ## it from the rows fetched, as the live updater's polls are.
+        self.db.insert(rows(0, 40))
+        for count in range(3):
+            self.assertEqual(self.db.getData(["a", "b"], start_time=START),
+                             withB(rows(0, 40))[1:])
+        self.assertEqual(self.db.newest_queries, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
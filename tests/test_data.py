@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of the NVar and NVarSet containers of data.py.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:24:00
+
+import datetime
+import unittest
+
+from NCARFlightMonitor.data import NVar, NVarSet, NLazyVarSet, toEpoch
+from NCARFlightMonitor.data import alignNVarSets
+from NCARFlightMonitor.stats import NRollup
+from NCARFlightMonitor.data import _mergePlan, _applyPlan
+
+START = datetime.datetime(2011, 8, 19, 18)
+
+
+def rows(count, columns=2, start=0):
+    """ `count` rows three seconds apart of `columns` values each. """
+    return [(START + datetime.timedelta(seconds=3 * pos),) +
+            tuple([float(pos * 10 + col) for col in range(columns)])
+            for pos in range(start, start + count)]
+
+
+def epochRows(data):
+    return [(toEpoch(row[0]),) + row[1:] for row in data]
+
+
+class TestEpochRows(unittest.TestCase):
+
+    def test_same_as_datetime_rows(self):
+        plain = NVarSet(["a", "b"])
+        plain.addData(rows(10))
+        nset = NVarSet(["a", "b"])
+        nset.addData(epochRows(rows(10)))
+        self.assertEqual(nset.sliceWithTime(None, None),
+                         plain.sliceWithTime(None, None))
+        self.assertEqual(nset.sliceWithTime(None, None, epoch=True),
+                         epochRows(rows(10)))
+        self.assertEqual(nset.getNVar("b")[START], 1.0)
+
+    def test_fill(self):
+        nset = NVarSet(["a", "b"])
+        nset.addData([(row[0], row[1], None) for row in rows(10)])
+        filled = [(row[0], row[1], -row[2]) for row in rows(4, start=5)]
+        last = nset.fillData([(row[0], row[2]) for row in epochRows(filled)],
+                             ["b"])
+        self.assertEqual(last, toEpoch(filled[-1][0]))
+        self.assertEqual(nset.getNVar("b")[:],
+                         [None] * 5 + [row[2] for row in filled] + [None])
+
+    def test_times_are_shared(self):
+        nset = NVarSet(["a", "b"])
+        nset.addData(rows(10))
+        self.assertTrue(nset.getNVar("a")._times is nset.getNVar("b")._times)
+        self.assertEqual(nset._time._times.runs, 1)
+
+    def test_bad_batch_adds_nothing(self):
+        ## Neither the shared times nor any value is added when one row is
+        ## out of order or short, so later rows keep their times.
+        nset = NVarSet(["a", "b"])
+        nset.addData(rows(2))
+        for data in (rows(2, start=3)[::-1], rows(2, start=1),
+                     rows(1, start=3) + [(rows(1, start=4)[0][0], 1.0)]):
+            self.assertRaises((ValueError, IndexError), nset.addData, data)
+            self.assertEqual([len(nset.getNVar(name)) for name in "ab"],
+                             [2, 2])
+        nset.addData(rows(3, start=2))
+        self.assertEqual(nset.sliceWithTime(None, None), rows(5))
+
+    def test_fractions_of_a_second(self):
+        half = datetime.timedelta(microseconds=500000)
+        data = [(START + half * pos, float(pos)) for pos in range(6)]
+        var = NVar("a")
+        var.addData(data)
+        self.assertEqual(var[START + 3 * half], 3.0)
+        self.assertEqual(var[:], [row[1] for row in data])
+        nset = NVarSet(["a"])
+        nset.addData(data)
+        self.assertEqual(nset.sliceWithTime(None, None, epoch=True)[1],
+                         (toEpoch(START) + 0.5, 1.0))
+
+
+class TestInsertData(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = rows(20)
+        self.nset = NVarSet(["a", "b"])
+        self.nset.maskMissing({"A": 50.0})
+        self.nset.indexGaps(datetime.timedelta(seconds=6))
+
+    def check(self):
+        self.nset.addData(self.rows[:5] + self.rows[15:])
+        self.assertEqual(len(self.nset.gaps()), 1)
+        self.assertEqual(self.nset.insertData(self.rows[4:10]), 5)
+        self.assertEqual(self.nset.sliceWithTime(None, None),
+                         self.rows[:10] + self.rows[15:])
+        self.assertEqual(self.nset.getNVar("a").missingRuns(), [(5, 6)])
+        self.assertEqual(self.nset.gaps(), [(self.rows[9][0],
+                                             self.rows[15][0])])
+
+    def test_insert(self):
+        self.check()
+
+    def test_insert_compressed(self):
+        self.nset.compress(block_size=4)
+        self.check()
+
+    def test_gaps_by_time(self):
+        self.nset.addData(self.rows[:2] + self.rows[5:7] + self.rows[10:])
+        self.assertEqual(len(self.nset.gaps()), 2)
+        self.assertEqual(self.nset.gaps(self.rows[5][0], self.rows[5][0]),
+                         [(self.rows[1][0], self.rows[5][0])])
+        self.assertEqual(self.nset.gaps(self.rows[7][0], self.rows[8][0]),
+                         [(self.rows[6][0], self.rows[10][0])])
+        self.assertEqual(self.nset.gaps(self.rows[11][0]), [])
+
+
+class TestMergePlan(unittest.TestCase):
+    """ Plans of two lists of times, applied to values tagged by list. """
+
+    def merge(self, left, right, duplicates):
+        plan = _mergePlan(left, right, duplicates)
+        self.assertEqual(_applyPlan(plan, left, right),
+                         sorted(set(left) | set(right)))
+        return _applyPlan(plan, [("left", tm) for tm in left],
+                          [("right", tm) for tm in right])
+
+    def expected(self, left, right, keep):
+        tagged = dict([(tm, ("left", tm)) for tm in left])
+        for tm in right:
+            if keep == "right" or tm not in tagged:
+                tagged[tm] = ("right", tm)
+        return [tagged[tm] for tm in sorted(tagged)]
+
+    def test_duplicates(self):
+        left = [1, 2, 3, 5, 8, 9, 10, 14]
+        right = [0, 2, 3, 4, 9, 11, 14, 15]
+        for keep in ("right", "left"):
+            self.assertEqual(self.merge(left, right, keep),
+                             self.expected(left, right, keep))
+        self.assertRaises(ValueError, _mergePlan, left, right, "error")
+
+    def test_one_after_the_other(self):
+        left = range(10)
+        right = range(10, 15)
+        self.assertEqual(_mergePlan(left, right), [(False, 0, 10),
+                                                   (True, 0, 5)])
+        self.assertEqual(_mergePlan(right, left), [(True, 0, 10),
+                                                   (False, 0, 5)])
+        self.assertEqual(self.merge([], right, "error"),
+                         self.expected([], right, "error"))
+        self.assertEqual(self.merge(left, [], "error"),
+                         self.expected(left, [], "error"))
+
+    def test_all_duplicates(self):
+        times = range(0, 30, 3)
+        for keep in ("right", "left"):
+            self.assertEqual(self.merge(times, times, keep),
+                             self.expected(times, times, keep))
+
+    def test_bad_duplicates(self):
+        self.assertRaises(ValueError, _mergePlan, [1], [2], "both")
+
+
+class TestAdd(unittest.TestCase):
+    """ `+` of the halves of a variable gives the whole variable back. """
+
+    def nvar(self, data):
+        var = NVar("a")
+        var.addData([(row[0], row[1]) for row in data])
+        return var
+
+    def check(self, first, second):
+        data = sorted(first + second)
+        merged = self.nvar(first) + self.nvar(second)
+        self.assertEqual(merged.sliceWithTime(None, None),
+                         [(row[0], row[1]) for row in data])
+        self.assertEqual(merged.getTimeFromPos(-1), data[-1][0])
+        self.assertEqual(merged[data[3][0]], data[3][1])
+
+    def test_after(self):
+        data = rows(20)
+        self.check(data[:10], data[10:])
+        self.check(data[10:], data[:10])
+
+    def test_interleaved(self):
+        data = rows(20)
+        self.check(data[::2], data[1::2])
+
+    def test_sets(self):
+        data = rows(20, columns=3)
+        first = NVarSet(["a", "b", "c"])
+        first.addData(data[::2])
+        second = NVarSet(["a", "b", "c"])
+        second.addData(data[1::2])
+        self.assertEqual((first + second).sliceWithTime(None, None), data)
+
+
+class TestAlign(unittest.TestCase):
+    """
+    A 1 Hz set ("a", its seconds) joined with a set every three seconds from
+    one second in ("b", ten times its seconds) and with a 10 Hz set.
+    """
+
+    def setUp(self):
+        second = datetime.timedelta(seconds=1)
+        self.fast = NVarSet(["a"])
+        self.fast.addData([(START + pos * second, float(pos))
+                           for pos in range(10)])
+        self.slow = NVarSet(["b"])
+        self.slow.addData([(START + pos * second, pos * 10.0)
+                           for pos in (1, 4, 7)])
+        tenth = datetime.timedelta(microseconds=100000)
+        self.tenths = NVarSet(["c"])
+        self.tenths.addData([(START + pos * tenth, pos / 10.0)
+                             for pos in range(91)])
+
+    def assertValues(self, var, expected):
+        values = var[:]
+        self.assertEqual(len(values), len(expected))
+        for value, want in zip(values, expected):
+            if want is None or value is None:
+                self.assertEqual(value, want)
+            else:
+                self.assertAlmostEqual(value, want)
+
+    def join(self, method, **options):
+        joined = self.fast.join(self.slow, method, **options)
+        self.assertEqual(joined.keys(), ["a", "b"])
+        self.assertEqual(joined.getNVar("a")[:], self.fast.getNVar("a")[:])
+        self.assertEqual(joined.getNVar("b")._times[:],
+                         self.fast.getNVar("a")._times[:])
+        return joined.getNVar("b")
+
+    def test_asof(self):
+        self.assertValues(self.join("asof"),
+                          [None, 10, 10, 10, 40, 40, 40, 70, 70, 70])
+        self.assertValues(self.join("asof", missing_value=-1.0,
+                                    tolerance=datetime.timedelta(seconds=1)),
+                          [-1, 10, 10, -1, 40, 40, -1, 70, 70, -1])
+
+    def test_nearest(self):
+        self.assertValues(self.join("nearest"),
+                          [10, 10, 10, 40, 40, 40, 70, 70, 70, 70])
+        self.assertValues(self.join("nearest", missing_value=-1.0,
+                                    tolerance=datetime.timedelta(seconds=1)),
+                          [10, 10, 10, 40, 40, 40, 70, 70, 70, -1])
+
+    def test_linear(self):
+        self.assertValues(self.join("linear"),
+                          [None, 10, 20, 30, 40, 50, 60, 70, None, None])
+        ## Spans of three seconds are too far apart to interpolate across.
+        self.assertValues(self.join("linear", missing_value=-1.0,
+                                    tolerance=datetime.timedelta(seconds=2)),
+                          [-1, 10, -1, -1, 40, -1, -1, 70, -1, -1])
+
+    def test_linear_missing_value(self):
+        self.slow = NVarSet(["b"])
+        self.slow.addData([(START + datetime.timedelta(seconds=pos), value)
+                           for pos, value in ((1, 10.0), (4, -32767.0),
+                                              (7, 70.0))])
+        self.assertValues(self.join("linear", missing_value=-32767.0),
+                          [-32767, 10, -32767, -32767, -32767, -32767,
+                           -32767, 70, -32767, -32767])
+
+    def test_bad_method(self):
+        self.assertRaises(ValueError, self.fast.join, self.slow, "cubic")
+
+    def test_sub_second_rates(self):
+        ## The 10 Hz set on the 1 Hz times and the other way round.
+        joined = self.fast.join(self.tenths, "asof")
+        self.assertValues(joined.getNVar("c"), range(10))
+        joined = self.tenths.join(self.slow, "linear")
+        self.assertEqual(len(joined.getNVar("b")), 91)
+        self.assertValues(joined.getNVar("b")[15:16], [15.0])
+        self.assertAlmostEqual(joined.getNVar("b")[START +
+                               datetime.timedelta(seconds=5.5)], 55.0)
+
+    def test_resample(self):
+        period = datetime.timedelta(seconds=1.5)
+        resampled = self.fast.resample(period)
+        self.assertEqual(resampled.getNVar("a").getTimeFromPos(1),
+                         START + period)
+        self.assertValues(resampled.getNVar("a"),
+                          [pos * 1.5 for pos in range(7)])
+        resampled = self.slow.resample(period, "nearest")
+        self.assertValues(resampled.getNVar("b"), [10, 10, 40, 40, 70])
+        resampled = self.tenths.resample(datetime.timedelta(seconds=3),
+                                         "asof", start=START +
+                                         datetime.timedelta(seconds=0.5))
+        self.assertValues(resampled.getNVar("c"), [0.5, 3.5, 6.5])
+        self.assertRaises(ValueError, self.fast.resample,
+                          datetime.timedelta(0))
+
+    def test_several_sets(self):
+        times = [START + datetime.timedelta(seconds=pos) for pos in (0, 5)]
+        aligned = alignNVarSets([self.slow, self.fast, self.tenths], times,
+                                "asof", missing_value=0.0)
+        self.assertEqual(aligned.keys(), ["b", "a", "c"])
+        self.assertEqual(aligned.sliceWithTime(None, None),
+                         [(times[0], 0.0, 0.0, 0.0),
+                          (times[1], 40.0, 5.0, 5.0)])
+        self.fast.getNVar("a").name = "b"
+        self.assertRaises(ValueError, alignNVarSets, [self.slow, self.fast])
+
+
+class TestRollups(unittest.TestCase):
+    """ Rollups kept up by addData against ones of all the rows at once. """
+
+    def setUp(self):
+        self.periods = [datetime.timedelta(minutes=1),
+                        datetime.timedelta(seconds=10)]
+        self.missing_values = {"A": 50.0}
+        self.rows = rows(100)
+
+    def expected(self, data, period):
+        rollup = NRollup(period, ["a", "b"], self.missing_values)
+        rollup.addRows(data)
+        return rollup.select()
+
+    def test_incremental(self):
+        ## History before the rollups are attached, then batches of rows
+        ## (the last with epoch times) as the updater adds them.
+        nset = NVarSet(["a", "b"])
+        nset.addData(self.rows[:7])
+        nset.attachRollups(self.periods, self.missing_values)
+        nset.addData(self.rows[7:8])
+        nset.addData(self.rows[8:50])
+        nset.addData(epochRows(self.rows[50:]))
+
+        self.assertEqual([rollup.period for rollup in nset.rollups],
+                         sorted(self.periods))
+        for period in self.periods:
+            rollup = nset.getRollup(period)
+            self.assertEqual(rollup.select(),
+                             self.expected(self.rows, period))
+            self.assertEqual(toEpoch(rollup.times[0]) %
+                             (period.days * 86400 + period.seconds), 0)
+        self.assertEqual(nset.getRollup(self.periods[0]).select()[0][1:5],
+                         (0.0, 1850.0 / 19, 190.0, 19))  # Without 50.0
+        self.assertRaises(KeyError, nset.getRollup,
+                          datetime.timedelta(hours=1))
+
+    def test_filled(self):
+        ## Values of b that were None until filled in are counted once.
+        nset = NVarSet(["a", "b"])
+        nset.attachRollups(self.periods, self.missing_values)
+        nset.addData([(row[0], row[1], None) for row in self.rows])
+        nset.fillData([(row[0], row[2]) for row in self.rows[20:60]], ["b"])
+        filled = [(row[0], row[1], row[2] if 20 <= pos < 60 else None)
+                  for pos, row in enumerate(self.rows)]
+        for period in self.periods:
+            self.assertEqual(nset.getRollup(period).select(),
+                             self.expected(filled, period))
+
+
+class TestMissingMask(unittest.TestCase):
+    """ The masks of maskMissing, with flags keyed in any case. """
+
+    NAMES = ["ch4_pic", "butcnts_clsmai3760a", "co2_pic"]
+
+    ## As from getBadDataValues: most names are upper case, some are not.
+    FLAGS = {"CH4_PIC": -32767.0, "BUTCNTS_CLSMAI3760a": -32767.0,
+             "CO2_PIC": -32767.0}
+
+    def flagged(self, count, start=0):
+        """ Rows with every variable missing from the fourth to the sixth. """
+        return [row[:1] + tuple([-32767.0 if 3 <= pos < 6 else value
+                                 for value in row[1:]])
+                for pos, row in enumerate(rows(count, columns=3,
+                                               start=start), start)]
+
+    def test_flags_in_any_case(self):
+        nset = NVarSet(self.NAMES)
+        nset.addData(self.flagged(10))
+        nset.maskMissing(self.FLAGS)
+        self.assertEqual(nset.missingCounts(),
+                         dict([(name, 3) for name in self.NAMES]))
+        for col, name in enumerate(self.NAMES):
+            var = nset.getNVar(name)
+            self.assertEqual(var.missingRuns(), [(3, 6)])
+            self.assertEqual([var.isMissing(pos) for pos in range(10)],
+                             [3 <= pos < 6 for pos in range(10)])
+            self.assertEqual(var.validValues(2, 8),
+                             [float(pos * 10 + col)
+                              for pos in (2, 6, 7)])
+
+    def test_none_is_not_missing(self):
+        nset = NVarSet(["a"])
+        nset.addData([(START, None), (START + datetime.timedelta(seconds=1),
+                                      -32767.0)])
+        nset.maskMissing({"A": -32767.0})
+        self.assertEqual(nset.missingCounts(), {"a": 1})
+        self.assertEqual(nset.getNVar("a").validValues(), [])
+
+    def test_rows_added_later(self):
+        nset = NVarSet(self.NAMES)
+        nset.maskMissing(self.FLAGS)
+        nset.addData(self.flagged(4))
+        nset.addData(self.flagged(6, start=4))
+        self.assertEqual(nset.missingCounts(),
+                         dict([(name, 3) for name in self.NAMES]))
+        self.assertEqual(nset.missingCounts(start=4),
+                         dict([(name, 2) for name in self.NAMES]))
+
+    def test_lazy_set(self):
+        history = self.flagged(10)
+
+        def backfill(names, start_time):
+            positions = [self.NAMES.index(name) + 1 for name in names]
+            return [(row[0],) + tuple([row[pos] for pos in positions])
+                    for row in history if row[0] >= start_time]
+
+        nset = NLazyVarSet(self.NAMES, backfill)
+        nset.maskMissing(self.FLAGS)
+        nset.addData([(row[0],) for row in history])
+        var = nset.getNVar("butcnts_clsmai3760a")
+        self.assertEqual(var.missingRuns(), [(3, 6)])
+
+
+class TestLazyVarSet(unittest.TestCase):
+
+    def setUp(self):
+        self.history = rows(10)
+        self.fetched = []
+
+        def backfill(names, start_time):
+            self.fetched.append(tuple(names))
+            positions = [("a", "b").index(name) + 1 for name in names]
+            return [(row[0],) + tuple([row[pos] for pos in positions])
+                    for row in self.history if row[0] >= start_time]
+
+        self.nset = NLazyVarSet(("a", "b"), backfill)
+
+    def test_same_fields_as_a_set(self):
+        plain = NVarSet(["a", "b"])
+        for name in plain.__dict__:
+            self.assertTrue(name in self.nset.__dict__, name)
+        self.assertEqual(self.nset.keys(), [])
+
+    def test_backfill_on_first_use(self):
+        self.nset.addData([(row[0],) for row in self.history])
+        self.assertEqual(self.fetched, [])
+        var = self.nset.getNVar("b")
+        self.assertEqual(self.fetched, [("b",)])
+        self.assertEqual(var[:], [row[2] for row in self.history])
+        self.assertEqual(self.nset.keys(), ["b"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of the replay and query paths of database.NDatabase, using the
+## sample flights in `samples/` through database.NMemoryDatabase.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:20:00
+
+import datetime
+import os
+import StringIO
+import sys
+import unittest
+
+from NCARFlightMonitor import database
+from NCARFlightMonitor.data import NVarSet, toEpoch
+from NCARFlightMonitor.database import NDatabase, NMemoryDatabase
+from NCARFlightMonitor.database import NDatabaseLiveUpdater
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+                          __file__))),
+                      "samples", "HIPPO-5-rf05-2011_08_20-03_34_52.asc")
+
+
+class NRecordingConnection(object):
+    """ A connection whose cursors record the SQL run and return no rows. """
+    def __init__(self):
+        self.sql = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.sql.append(sql)
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class TestMemoryDatabase(unittest.TestCase):
+
+    def test_base_state(self):
+        db = NMemoryDatabase(simulate_file=SAMPLE)
+        self.assertEqual(db._catalogs.directory, None)
+        self.assertEqual(db._conn, None)
+        self.assertTrue("tasx" in db.variable_list)
+        self.assertEqual(db.getTime(), db._replay.nextTime(
+                                           datetime.datetime.min))
+
+
+class NCountingDatabase(NMemoryDatabase):
+    """ Reconnects as an NDatabase, counting the catalog refreshes. """
+    refreshes = 0
+
+    reconnect = NDatabase.reconnect
+
+    def _refreshCatalog(self):
+        self.refreshes += 1
+
+
+class TestCatalogRefresh(unittest.TestCase):
+
+    def setUp(self):
+        self.connect = database.psycopg2.connect
+        database.psycopg2.connect = lambda **kwds: NRecordingConnection()
+
+    def tearDown(self):
+        database.psycopg2.connect = self.connect
+
+    def test_only_when_a_flight_starts(self):
+        db = NCountingDatabase(simulate_file=SAMPLE)
+        for count in range(5):
+            db.reconnect()
+            self.assertFalse(db.flying())
+        self.assertEqual(db.refreshes, 0)
+
+        db._current_time += datetime.timedelta(hours=2)
+        self.assertTrue(db.flying())
+        self.assertTrue(db.flying())
+        self.assertEqual(db.refreshes, 1)
+
+    def test_fingerprint_covers_rows(self):
+        db = NMemoryDatabase(simulate_file=SAMPLE)
+        db._conn = NRecordingConnection()
+        db._conn.fetchone = lambda: (0, 0, 0, 0)
+        NDatabase._schemaFingerprint(db)
+        self.assertTrue("max(xmin::text::bigint) FROM variable_list"
+                        in db._conn.sql[1])
+        self.assertTrue("max(xmin::text::bigint) FROM global_attributes"
+                        in db._conn.sql[1])
+
+
+class TestReplayBounds(unittest.TestCase):
+
+    def setUp(self):
+        self.db = NMemoryDatabase(simulate_file=SAMPLE)
+        self.db._current_time += datetime.timedelta(minutes=30)
+        self.now = self.db.getTime()
+
+    def test_interval_with_number_entries(self):
+        rows = self.db.getData(start_time="-10 MINUTE", variables=["tasx"],
+                               number_entries=100000)
+        self.assertNotEqual(len(rows), 0)
+        self.assertTrue(rows[-1][0] <= self.now)
+        self.assertTrue(rows[0][0] > self.now - datetime.timedelta(minutes=10))
+
+    def test_number_entries_is_a_limit(self):
+        rows = self.db.getData(start_time="-10 MINUTE", variables=["tasx"],
+                               number_entries=5)
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(rows[0][0] > self.now - datetime.timedelta(minutes=10))
+
+    def test_between(self):
+        rows = self.db.getData(start_time="-10 MINUTE", variables=["tasx"])
+        between = self.db.getData(start_time=rows[2][0], end_time=rows[6][0],
+                                  variables=["tasx"], number_entries=10)
+        self.assertEqual(between, rows[3:6])
+
+        self.db._conn = NRecordingConnection()
+        NDatabase._queryData(self.db, variables=["tasx"],
+                             start_time=rows[2][0], end_time=rows[6][0])
+        self.assertTrue("datetime < '%s'" % rows[6][0]
+                        in self.db._conn.sql[0])
+
+    def test_query_bounded_at_now(self):
+        ## The server is asked for the same rows as the replay table holds.
+        self.db._conn = NRecordingConnection()
+        NDatabase._queryData(self.db, variables=["tasx"],
+                             start_time="-10 MINUTE", number_entries=5)
+        self.assertTrue("datetime <= '%s'" % self.now in self.db._conn.sql[0])
+
+
+class NListServer(object):
+    """ Answers the queries of an NDatabaseLiveUpdater from `rows`. """
+    notify = False
+    _simulate_fast = True
+
+    def __init__(self, rows):
+        self.rows = list(rows)
+        self.queries = 0
+
+    def getData(self, variables=None, start_time=None, end_time=None,
+                      number_entries=None, epoch=False):
+        self.queries += 1
+        rows = sorted([row for row in self.rows
+                       if (start_time is None or row[0] > start_time) and
+                          (end_time is None or row[0] < end_time)])
+        if start_time is None:
+            rows = rows[::-1]
+        rows = rows[:number_entries]
+        if epoch:
+            rows = [(toEpoch(row[0]),) + row[1:] for row in rows]
+        return rows
+
+    def pollNotifications(self, **kwds):
+        return None
+
+    def sleep(self, *args, **kwds):
+        return 0
+
+
+class TestLateRows(unittest.TestCase):
+
+    def setUp(self):
+        start = datetime.datetime(2011, 8, 19, 18)
+        self.rows = [(start + datetime.timedelta(seconds=3 * pos), float(pos))
+                     for pos in range(40)]
+        self.server = NListServer(self.rows[:10] + self.rows[30:])
+        self.nset = NVarSet(["tasx"])
+        self.nset.indexGaps(datetime.timedelta(seconds=6))
+
+    def catchUp(self, **kwds):
+        self.updater = NDatabaseLiveUpdater(
+                           server=self.server, variables=self.nset,
+                           max_rows=8,
+                           start_time=(self.rows[0][0] -
+                                       datetime.timedelta(seconds=1)),
+                           **kwds)
+        self.updater.update()
+        while self.updater.behind:
+            self.updater.update()
+        self.assertEqual(len(self.nset.gaps()), 1)
+
+    def test_gap_filled_in_batches(self):
+        self.catchUp(gap_sweep=1)
+
+        ## The rows of the outage arrive late.
+        self.server.rows = self.rows
+        late = []
+        for count in range(4):
+            self.updater.update()
+            late.append(len(self.updater.late))
+        self.assertEqual(late, [8, 8, 4, 0])
+        self.assertEqual(self.nset.sliceWithTime(None, None), self.rows)
+        self.assertEqual(self.nset.gaps(), [])
+
+    def test_gaps_looked_at_every_sweep(self):
+        self.catchUp(gap_sweep=10)
+        queries = self.server.queries
+        for count in range(20):
+            self.updater.update()
+        self.assertEqual(self.server.queries - queries, 20 + 2)
+        self.assertEqual(len(self.nset.gaps()), 1)
+
+
+
+class NFakeListenConnection(object):
+    """ A connection listening for notifications, sent with notify(). """
+    def __init__(self):
+        self.notifies = []
+        self.pending = []
+        self.lost = False
+        self.closed = False
+
+    def notify(self):
+        self.pending.append((0, "raf_lrt_new"))
+
+    def poll(self):
+        if self.lost:
+            raise RuntimeError("server closed the connection")
+        self.notifies += self.pending
+        self.pending = []
+
+    def close(self):
+        self.closed = True
+
+
+class NNotifyDatabase(NDatabase):
+    """
+    An NDatabase asked to listen for notifications, which it gets from an
+    NFakeListenConnection (none without `listening`), answering queries
+    from `rows` as NListServer does.
+    """
+    def __init__(self, rows, listening=True):
+        NDatabase.__init__(self, database="test", notify=True,
+                           notify_timeout=30, connect=False)
+        self.variable_list = ("a",)
+        self._flight_info = {'DataRate': '3'}
+        self._listen_conn = NFakeListenConnection() if listening else None
+        self.server = NListServer(rows)
+
+    def getData(self, *args, **kwds):
+        return self.server.getData(*args, **kwds)
+
+
+class TestNotifications(unittest.TestCase):
+
+    def setUp(self):
+        start = datetime.datetime(2011, 8, 19, 18)
+        self.rows = [(start + datetime.timedelta(seconds=3 * pos), float(pos))
+                     for pos in range(10)]
+        self.stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+
+    def updater(self, db):
+        return NDatabaseLiveUpdater(server=db, variables=NVarSet(["a"]),
+                                    start_time=(self.rows[0][0] -
+                                                datetime.timedelta(
+                                                    seconds=1)))
+
+    def test_adaptive_polling(self):
+        ## Without notifications the wait doubles while no data arrives, up
+        ## to notify_timeout, and drops back to the DataRate when it does.
+        db = NNotifyDatabase(self.rows[:1], listening=False)
+        self.assertFalse(db.listening)
+        updater = self.updater(db)
+        queries = db.server.queries
+        waits = [updater.update(blocking=False) for count in range(6)]
+        self.assertEqual(waits, [3, 6, 12, 24, 30, 30])
+        self.assertEqual(db.server.queries - queries, 6)  # Every update
+
+        db.server.rows = self.rows[:2]
+        self.assertEqual(updater.update(blocking=False), 3)
+        self.assertEqual(updater.update(blocking=False), 6)
+        self.assertEqual(len(updater._vars._time), 2)
+
+    def test_lost_notifications(self):
+        db = NNotifyDatabase(self.rows[:1])
+        updater = self.updater(db)
+        self.assertEqual(updater.update(blocking=False), 3)
+        conn = db._listen_conn
+        conn.lost = True
+        self.assertEqual(updater.update(blocking=False), 3)
+        self.assertFalse(db.listening)
+        self.assertTrue(conn.closed)
+        self.assertTrue("polling instead" in sys.stderr.getvalue())
+        self.assertEqual(updater.update(blocking=False), 6)
+
+    def test_shared_connection(self):
+        ## Two updaters listen on one connection; each queries once per
+        ## batch of notifications, however many it is.
+        db = NNotifyDatabase(self.rows[:1])
+        first = self.updater(db)
+        second = self.updater(db)
+        for updater in (first, second):
+            updater.update(blocking=False)
+        queries = db.server.queries
+
+        ## Nothing notified, nothing asked for.
+        for updater in (first, second):
+            self.assertEqual(updater.update(blocking=False), 3)
+        self.assertEqual(db.server.queries, queries)
+
+        db.server.rows = self.rows[:3]
+        db._listen_conn.notify()
+        db._listen_conn.notify()
+        self.assertEqual(first.update(blocking=False), 3)
+        self.assertEqual(db.server.queries, queries + 1)
+        self.assertEqual(first._notifications, 2)
+
+        ## A notification waiting ends a wait straight away.
+        db.server.rows = self.rows[:4]
+        db._listen_conn.notify()
+        self.assertEqual(second.update(blocking=False), 3)
+        self.assertEqual(first._wait(False, blocking=False), 0)
+        self.assertEqual(first.update(blocking=False), 3)
+        self.assertEqual(db.server.queries, queries + 3)
+        self.assertEqual((first._notifications, second._notifications),
+                         (3, 3))
+        self.assertEqual(db.pollNotifications(), 3)
+        for updater in (first, second):
+            self.assertEqual(len(updater._vars._time), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
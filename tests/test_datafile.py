@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of writing an NVarSet to an .asc file with NRTFile and reading it
+## back.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:49:19
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from NCARFlightMonitor.data import NVarSet, toEpoch
+from NCARFlightMonitor.datafile import NRTFile
+
+START = datetime.datetime(2011, 12, 31, 23, 59, 50)
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, "flight.asc")
+
+        ## Across midnight and the new year, with NULLs.
+        self.rows = [(START + datetime.timedelta(seconds=5 * pos),
+                      pos * 0.5, -32767.0, None if pos % 4 else 1e-3)
+                     for pos in range(10)]
+        self.nset = NVarSet(["ggalt", "tasx", "coraw_al"])
+        self.nset.addData(self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        f = open(self.file_name, 'r')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_round_trip(self):
+        NRTFile().write(file_name=self.file_name, labels=self.nset.labels,
+                        data=self.nset.sliceWithTime(None, None))
+        written = NRTFile(self.file_name)
+        self.assertEqual(written.labels,
+                         ('DATETIME', 'GGALT', 'TASX', 'CORAW_AL'))
+        self.assertEqual([(row[0],) + tuple([None if value == 'None'
+                                             else float(value)
+                                             for value in row[1:]])
+                          for row in written.data], self.rows)
+
+    def test_epoch_rows(self):
+        NRTFile().write(file_name=self.file_name, labels=self.nset.labels,
+                        data=self.nset.sliceWithTime(None, None))
+        expected = self.read()
+        NRTFile().write(file_name=self.file_name, labels=self.nset.labels,
+                        data=self.nset.sliceWithTime(None, None, epoch=True))
+        self.assertEqual(self.read(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of the compressed columns of encoding.py: blocks decode to the
+## values they were coded from, and times are found at their positions.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:45:59
+
+import datetime
+import math
+import random
+import unittest
+
+from NCARFlightMonitor.encoding import (encodeBlock, decodeBlock,
+                                        NTimeColumn, NValueColumn)
+from NCARFlightMonitor.utils import toEpoch, toSeconds
+
+START = datetime.datetime(2011, 8, 19, 18)
+
+
+class TestBlocks(unittest.TestCase):
+
+    def assertRoundTrip(self, values, kind):
+        block = encodeBlock(values)
+        self.assertEqual(block[0], kind)
+        self.assertEqual(decodeBlock(block), values)
+
+    def test_runs(self):
+        values = [0.0] * 300 + [-32767.0] * 200 + [None] * 24 + [12.5] * 500
+        self.assertRoundTrip(values, 'r')
+
+    def test_xors(self):
+        rand = random.Random(7)
+        values = [math.sin(pos / 50.0) * 1e4 + rand.random()
+                  for pos in range(1024)]
+        values[10:20] = [None] * 10
+        values[-1] = None
+        values[100] = -0.0
+        values[101] = 1e300
+        self.assertRoundTrip(values, 'x')
+        self.assertEqual(math.copysign(1.0, decodeBlock(
+                             encodeBlock(values))[100]), -1.0)
+
+    def test_nones(self):
+        self.assertRoundTrip([None] * 64, 'r')
+        self.assertRoundTrip([None if pos % 3 == 0 else pos * 0.5
+                              for pos in range(64)], 'x')
+
+    def test_other_types(self):
+        self.assertRoundTrip(["on"] * 40 + ["off"] * 24, 'r')
+        self.assertRoundTrip(["a", "b"] * 32, 'o')
+        self.assertRoundTrip([1, 2.0, None, "c"], 'o')
+
+    def test_column(self):
+        rand = random.Random(11)
+        values = [rand.choice([None, 1.0, rand.random()])
+                  for pos in range(1000)]
+        column = NValueColumn(block_size=64)
+        column.extend(values[:500])
+        for value in values[500:]:
+            column.append(value)
+        self.assertEqual(column[:], values)
+        self.assertEqual(column[130:700], values[130:700])
+        self.assertEqual(column[999], values[999])
+
+        column.setValues([3, 640, 999], [5.0, None, 6.0])
+        values[3], values[640], values[999] = 5.0, None, 6.0
+        self.assertEqual(list(column), values)
+
+
+class TestTimeColumn(unittest.TestCase):
+
+    def setUp(self):
+        ## Three runs: every second, every three seconds after a gap, and a
+        ## single time after another gap.
+        self.times = ([START + datetime.timedelta(seconds=pos)
+                       for pos in range(10)] +
+                      [START + datetime.timedelta(seconds=60 + 3 * pos)
+                       for pos in range(10)] +
+                      [START + datetime.timedelta(hours=1)])
+        self.column = NTimeColumn(self.times)
+
+    def test_round_trip(self):
+        self.assertEqual(self.column.runs, 3)
+        self.assertEqual(len(self.column), len(self.times))
+        self.assertEqual(self.column[:], self.times)
+        self.assertEqual(list(self.column), self.times)
+        self.assertEqual(list(self.column.epochs(5, 15)),
+                         [toEpoch(tm) for tm in self.times[5:15]])
+
+    def test_find(self):
+        for pos, tm in enumerate(self.times):
+            self.assertEqual(self.column.find(tm), pos)
+            self.assertEqual(self.column.findEpoch(toEpoch(tm)), pos)
+
+    def test_not_found(self):
+        second = datetime.timedelta(seconds=1)
+        for tm in [START - second,  # Before the first
+                   START + 10 * second,  # In the first gap
+                   START + 61 * second,  # Between steps of a run
+                   START + 90 * second,  # After the end of a run
+                   START + datetime.timedelta(hours=2),  # After the last
+                   START + datetime.timedelta(microseconds=500)]:
+            self.assertEqual(self.column.find(tm), -1)
+
+    def test_times_must_increase(self):
+        ## A batch that does not increase adds nothing, even the times
+        ## before the bad one.
+        later = self.times[-1] + datetime.timedelta(seconds=1)
+        self.assertRaises(ValueError, self.column.extend, [later, START])
+        self.assertRaises(ValueError, self.column.extendEpochs,
+                          [toEpoch(later), toEpoch(later)])
+        self.assertRaises(ValueError, self.column.extend,
+                          [later + datetime.timedelta(microseconds=500),
+                           later])
+        self.assertEqual(self.column[:], self.times)
+        self.assertEqual(self.column.epochs().typecode, 'l')
+
+    def test_fractions_of_a_second(self):
+        ## Quarter seconds after the last time continue its run.
+        quarter = datetime.timedelta(microseconds=250000)
+        times = self.times + [self.times[-1] + quarter * pos
+                              for pos in range(1, 9)]
+        self.column.extend(times[len(self.times):])
+        self.assertEqual(self.column.runs, 3)
+        self.assertEqual(self.column[:], times)
+        self.assertEqual(self.column[-3], times[-3])
+        for pos, tm in enumerate(times):
+            self.assertEqual(self.column.find(tm), pos)
+            self.assertEqual(self.column.findEpoch(toSeconds(tm)), pos)
+        self.assertEqual(self.column.find(times[-1] - quarter / 2), -1)
+        self.assertEqual(list(self.column.epochs(-2)),
+                         [toSeconds(tm) for tm in times[-2:]])
+
+        self.column.extendEpochs([toEpoch(times[-1]) + 1])
+        self.assertEqual(self.column[-1],
+                         times[-1] + datetime.timedelta(seconds=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of the event log of events.py: queries through the time and the
+## per variable indexes, the join with an NVarSet and the JSON file.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 07:12:58
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from NCARFlightMonitor.data import NVarSet
+from NCARFlightMonitor.events import (NEvent, NEventLog, loadEventLog,
+                                      INFO, WARNING, ERROR, MESSAGE)
+
+START = datetime.datetime(2011, 8, 19, 18)
+
+
+def at(seconds):
+    return START + datetime.timedelta(seconds=seconds)
+
+
+class TestEventLog(unittest.TestCase):
+
+    def setUp(self):
+        ## Added out of order, with two events at the same time.
+        self.events = [
+            NEvent(at(10), "checkBadData", "tasx", WARNING, "missing",
+                   "tasx missing"),
+            NEvent(at(4), "checkBadData", "ggalt", WARNING, "missing",
+                   "ggalt missing"),
+            NEvent(at(10), "cosmo", "coraw_al", ERROR, "spike",
+                   "coraw_al spike"),
+            NEvent(at(30), "checkBadData", "tasx", INFO, "missing cleared",
+                   "tasx back"),
+            NEvent(at(20.5), None, None, INFO, MESSAGE, "Flight started"),
+            NEvent(at(1), "checkBadData", "tasx", WARNING, "missing",
+                   "tasx missing"),
+        ]
+        self.log = NEventLog()
+        for event in self.events:
+            self.log.add(event.time, event.message,
+                         algorithm=event.algorithm, variable=event.variable,
+                         severity=event.severity, kind=event.kind)
+
+    def inOrder(self, events):
+        ## Sorted on time, stable for equal times.
+        return sorted(events, key=lambda event: event.time)
+
+    def test_query(self):
+        self.assertEqual(len(self.log), len(self.events))
+        self.assertEqual(self.log.query(), self.inOrder(self.events))
+        self.assertEqual(list(self.log), self.log.query())
+
+        ## Both ends are included.
+        self.assertEqual(self.log.query(start=at(4), stop=at(20.5)),
+                         [event for event in self.inOrder(self.events)
+                          if at(4) <= event.time <= at(20.5)])
+        self.assertEqual(self.log.query(start=at(31)), [])
+        self.assertEqual(self.log.query(severity=WARNING, stop=at(9)),
+                         [self.events[5], self.events[1]])
+        self.assertEqual(self.log.query(algorithm="checkBadData",
+                                        kind="missing cleared"),
+                         [self.events[3]])
+        self.assertEqual(self.log.query(algorithm="other"), [])
+
+    def test_variable_index(self):
+        self.assertEqual(sorted(self.log.variables),
+                         ["coraw_al", "ggalt", "tasx"])
+        for variable in self.log.variables:
+            self.assertEqual(self.log.query(variable=variable),
+                             [event for event in self.inOrder(self.events)
+                              if event.variable == variable])
+        self.assertEqual(self.log.query(variable="tasx", start=at(5),
+                                        stop=at(29)),
+                         [self.events[0]])
+        self.assertEqual(self.log.query(variable="tasx", kind="missing"),
+                         [self.events[5], self.events[0]])
+        self.assertEqual(self.log.query(variable="thdg"), [])
+
+        ## The index only holds the positions of its variable's events.
+        variable_id = self.log._ids['variable']["tasx"]
+        times, positions = self.log._by_variable[variable_id]
+        self.assertEqual(list(positions), [5, 0, 3])
+        self.assertEqual(list(times), sorted(times))
+
+    def test_join(self):
+        ## Rows every three seconds from two seconds in.
+        nset = NVarSet(["tasx", "ggalt"])
+        nset.addData([(at(seconds), seconds * 10.0, -seconds * 1.0)
+                      for seconds in range(2, 30, 3)])
+        joined = self.log.join(nset)
+        self.assertEqual([event for event, row in joined],
+                         self.log.query())
+        self.assertEqual([row for event, row in joined],
+                         [None, (20.0, -2.0), (80.0, -8.0), (80.0, -8.0),
+                          (200.0, -20.0), (290.0, -29.0)])
+
+        self.assertEqual(self.log.join(nset, names=["ggalt"],
+                                       variable="tasx", start=at(5)),
+                         [(self.events[0], (-8.0,)),
+                          (self.events[3], (-29.0,))])
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, "events.json")
+            self.log.save(file_name)
+            loaded = loadEventLog(file_name)
+        finally:
+            shutil.rmtree(directory)
+
+        self.assertEqual(len(loaded), len(self.log))
+        self.assertEqual(loaded.query(), self.log.query())
+        self.assertEqual(loaded.query()[4].time, at(20.5))
+        self.assertEqual(loaded.query(variable="tasx", severity=WARNING),
+                         self.log.query(variable="tasx", severity=WARNING))
+        self.assertEqual(sorted(loaded.variables),
+                         sorted(self.log.variables))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of the fanout stream: the frames of rows, and a server that never
+## waits on its subscribers.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:40:00
+
+import datetime
+import os
+import socket
+import sys
+import tempfile
+import time
+import unittest
+
+from NCARFlightMonitor.fanout import (encodeNames, encodeRows, decodeRows,
+                                      NFanoutServer, NFanoutSubscriber)
+
+START = datetime.datetime(2011, 8, 19, 18)
+
+
+class TestFrames(unittest.TestCase):
+
+    def test_round_trip(self):
+        rows = [(START, 1.5, None, -32767.0),
+                (START + datetime.timedelta(seconds=3), 0.0, 2.25, 1e300)]
+        frame = encodeRows(rows, 3)
+        self.assertEqual(decodeRows(frame[5:], 3), rows)
+
+    def test_values_that_are_not_numbers(self):
+        rows = [(START, "12.5", "bad", object())]
+        frame = encodeRows(rows, 3)
+        self.assertEqual(decodeRows(frame[5:], 3), [(START, 12.5, None, None)])
+
+    def test_width(self):
+        ## Only `width` values of each row are sent.
+        rows = [(START, 1.0, 2.0, 3.0)]
+        self.assertEqual(decodeRows(encodeRows(rows, 2)[5:], 2),
+                         [(START, 1.0, 2.0)])
+        self.assertEqual(decodeRows(encodeRows([], 2)[5:], 2), [])
+
+
+class TestServer(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "fanout.sock")
+        self.server = NFanoutServer(self.path, max_frames=2)
+        self.stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+        self.server.close()
+
+    def waitForClients(self, count):
+        for attempt in range(100):
+            if self.server.clients == count:
+                return
+            time.sleep(0.01)
+        self.fail("%d clients, expected %d" % (self.server.clients, count))
+
+    def test_subscriber(self):
+        subscriber = NFanoutSubscriber(self.path)
+        self.waitForClients(1)
+        rows = [(START + datetime.timedelta(seconds=3 * pos), float(pos), None)
+                for pos in range(10)]
+        self.server.publish(["a", "b"], rows)
+        added = 0
+        while added < len(rows):
+            added += subscriber.poll(timeout=5)
+        self.assertEqual(subscriber.variables.sliceWithTime(None, None), rows)
+        subscriber.close()
+
+    def test_overlapping_batches(self):
+        ## Each batch starts with the last rows of the one before, and the
+        ## preflight hour is published again at the start of a flight.
+        self.server.max_frames = 100  # Quicker than the subscribers read
+        subscriber = NFanoutSubscriber(self.path)
+        self.waitForClients(1)
+        rows = [(START + datetime.timedelta(seconds=pos), float(pos))
+                for pos in range(30)]
+        for start, stop in ((0, 10), (5, 20), (0, 20), (19, 30), (25, 30)):
+            self.server.publish(["a"], rows[start:stop])
+        added = 0
+        while added < len(rows):
+            added += subscriber.poll(timeout=5)
+        self.assertEqual(subscriber.variables.sliceWithTime(None, None), rows)
+
+        ## A subscriber joining late gets the backlog and then only the
+        ## new rows, even when it is sent rows it already has.
+        late = NFanoutSubscriber(self.path)
+        self.waitForClients(2)
+        more = [(START + datetime.timedelta(seconds=pos), float(pos))
+                for pos in range(30, 35)]
+        self.server.publish(["a"], rows[-5:] + more)
+        added = 0
+        while added < len(rows + more):
+            added += late.poll(timeout=5)
+        self.assertEqual(late.variables.sliceWithTime(None, None),
+                         rows + more)
+        late._buffer = encodeNames(["a"]) + encodeRows(rows[-3:] + more, 1)
+        self.assertEqual(late._consume(), 0)
+        subscriber.close()
+        late.close()
+
+    def test_slow_client_does_not_hold_up_publish(self):
+        slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        slow.connect(self.path)  # Never reads
+        self.waitForClients(1)
+
+        batches = [[(START + datetime.timedelta(seconds=pos), float(pos))
+                    for pos in range(count * 10000, (count + 1) * 10000)]
+                   for count in range(20)]
+        start = time.time()
+        for rows in batches:
+            self.server.publish(["a"], rows)
+        self.assertTrue(time.time() - start < self.server.timeout)
+        self.assertEqual(self.server.clients, 0)
+        slow.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of the shared column file: rows written by an NSharedColumns as a
+## listener of an NDatabaseLiveUpdater, read back by an NSharedReader.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 07:11:52
+
+from array import array
+import datetime
+import math
+import os
+import shutil
+import StringIO
+import sys
+import tempfile
+import unittest
+
+from NCARFlightMonitor.data import NVarSet, toEpoch
+from NCARFlightMonitor.database import NDatabaseLiveUpdater
+from NCARFlightMonitor.shared import NSharedColumns, NSharedReader
+from tests.test_database import NListServer
+
+START = datetime.datetime(2011, 8, 19, 18)
+
+
+def doubles(view):
+    values = array('d')
+    values.fromstring(view)
+    return values.tolist()
+
+
+class TestSharedColumns(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "gv.columns")
+        ## b is NULL every fourth row.
+        self.rows = [(START + datetime.timedelta(seconds=pos), float(pos),
+                      None if pos % 4 == 0 else -float(pos))
+                     for pos in range(20)]
+        self.server = NListServer(self.rows[:10])
+        self.shared = None
+        self.readers = []
+
+    def tearDown(self):
+        for reader in self.readers:
+            reader.close()
+        if self.shared is not None:
+            self.shared.close()
+        shutil.rmtree(self.directory)
+
+    def start(self, capacity=100):
+        """ A new file, written to by the listener of a new updater. """
+        self.shared = NSharedColumns(self.path, ["a", "b"], capacity)
+        self.updater = NDatabaseLiveUpdater(
+                           server=self.server,
+                           variables=NVarSet(["a", "b"]),
+                           listeners=[self.shared.append],
+                           start_time=(self.rows[0][0] -
+                                       datetime.timedelta(seconds=1)))
+
+    def reader(self):
+        reader = NSharedReader(self.path)
+        self.readers.append(reader)
+        return reader
+
+    def test_rows(self):
+        self.start()
+        self.updater.update()
+        reader = self.reader()
+        self.assertEqual(reader.names, ["a", "b"])
+        self.assertEqual(len(reader), 10)
+        self.assertEqual(reader.rows(), self.rows[:10])
+
+        ## The reader sees rows written after it opened the file.
+        self.server.rows = self.rows
+        self.updater.update()
+        self.assertEqual(len(reader), 20)
+        self.assertEqual(reader.rows(start=10), self.rows[10:])
+        self.assertEqual(reader.rows(-2, names=["b"]),
+                         [(row[0], row[2]) for row in self.rows[-2:]])
+
+    def test_views(self):
+        self.start()
+        self.updater.update()
+        reader = self.reader()
+        self.assertEqual(doubles(reader.view('datetime')),
+                         [toEpoch(row[0]) for row in self.rows[:10]])
+        self.assertEqual(doubles(reader.view('a', 2, 5)),
+                         [row[1] for row in self.rows[2:5]])
+
+        ## NULLs are NaN.
+        values = doubles(reader.view('b'))
+        self.assertEqual([math.isnan(value) for value in values],
+                         [row[2] is None for row in self.rows[:10]])
+        self.assertEqual([value for value in values if value == value],
+                         [row[2] for row in self.rows[:10]
+                          if row[2] is not None])
+
+    def test_replaced_by_a_new_flight(self):
+        self.start()
+        self.updater.update()
+        reader = self.reader()
+        self.assertFalse(reader.replaced)
+
+        self.shared.close()
+        self.start()
+        self.assertTrue(reader.replaced)
+        self.assertEqual(reader.rows(), self.rows[:10])  # Still the old file
+        self.assertEqual(len(self.reader()), 0)
+
+    def test_capacity(self):
+        ## The batch that fills the file warns, the ones after it do not.
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            self.start(capacity=15)
+            self.server.rows = self.rows[:12]
+            self.updater.update()
+            self.server.rows = self.rows
+            self.updater.update()
+            full = sys.stderr.getvalue().splitlines()
+            self.shared.append(["a", "b"], self.rows[-1:])
+            warnings = sys.stderr.getvalue().splitlines()
+        finally:
+            sys.stderr = stderr
+        self.assertEqual(len(full), 1)
+        self.assertTrue("is full" in full[0])
+        self.assertEqual(warnings, full)
+        self.assertEqual(self.reader().rows(), self.rows[:15])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of the incremental aggregators and the rollups of stats.py.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:45:20
+
+import datetime
+import random
+import unittest
+
+from NCARFlightMonitor.stats import NRollingStats, NRollup
+from NCARFlightMonitor.utils import toEpoch
+
+START = datetime.datetime(2011, 8, 19, 18)
+
+
+def meanVariance(values):
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, None
+    return mean, sum([(value - mean) ** 2
+                      for value in values]) / (len(values) - 1)
+
+
+class TestRollingStats(unittest.TestCase):
+    """ Welford's update and its inverse against the window recomputed. """
+
+    def setUp(self):
+        ## Raw counts, a large offset with small changes.
+        rand = random.Random(5)
+        self.values = [1e6 + rand.gauss(0, 3) for pos in range(500)]
+
+    def assertWindow(self, stats, window):
+        mean, variance = meanVariance(window)
+        self.assertEqual(stats.count, len(window))
+        self.assertAlmostEqual(stats.mean, mean, places=6)
+        if variance is None:
+            self.assertEqual(stats.variance, None)
+        else:
+            self.assertAlmostEqual(stats.variance / variance, 1.0, places=6)
+
+    def test_size_window(self):
+        stats = NRollingStats(size=20)
+        for pos, value in enumerate(self.values):
+            stats.add(START + datetime.timedelta(seconds=pos), value)
+            self.assertWindow(stats, self.values[max(0, pos - 19):pos + 1])
+
+    def test_duration_window(self):
+        ## Samples three seconds apart leave a minute window after 20.
+        stats = NRollingStats(duration=datetime.timedelta(minutes=1))
+        for pos, value in enumerate(self.values):
+            stats.add(START + datetime.timedelta(seconds=3 * pos), value)
+            self.assertWindow(stats, self.values[max(0, pos - 19):pos + 1])
+
+    def test_window_of_one(self):
+        ## Every sample pops the one before it.
+        stats = NRollingStats(size=1)
+        for pos, value in enumerate(self.values[:50]):
+            stats.add(START + datetime.timedelta(seconds=pos), value)
+            self.assertWindow(stats, [value])
+
+    def test_missing_values_skipped(self):
+        stats = NRollingStats(size=3, missing_value=-32767.0)
+        for pos, value in enumerate([1.0, -32767.0, 2.0, None, 4.0]):
+            stats.add(START + datetime.timedelta(seconds=pos), value)
+        self.assertWindow(stats, [1.0, 2.0, 4.0])
+
+
+
+def at(seconds):
+    return START + datetime.timedelta(seconds=seconds)
+
+
+class TestRollup(unittest.TestCase):
+    """ Buckets of NRollup against their values summarised by hand. """
+
+    def test_buckets_aligned(self):
+        ## Values every four seconds from three seconds in.
+        rollup = NRollup(datetime.timedelta(seconds=10), ["a"])
+        rollup.addRows([(at(seconds), float(seconds))
+                        for seconds in range(3, 40, 4)])
+        self.assertEqual(rollup.select(),
+                         [(at(0), 3.0, 5.0, 7.0, 2),
+                          (at(10), 11.0, 15.0, 19.0, 3),
+                          (at(20), 23.0, 25.0, 27.0, 2),
+                          (at(30), 31.0, 35.0, 39.0, 3)])
+
+        ## Periods that do not divide a minute line up on the epoch too.
+        rollup = NRollup(datetime.timedelta(seconds=7), ["a"])
+        rollup.addRows([(at(seconds), 1.0) for seconds in range(0, 60, 5)])
+        self.assertEqual([toEpoch(start) % 7 for start in rollup.times],
+                         [0] * len(rollup))
+        self.assertEqual(rollup.bucketStart(at(0)), at(-(toEpoch(START) % 7)))
+        self.assertEqual(sum([row[4] for row in rollup.select()]), 12)
+
+    def test_missing_values(self):
+        rollup = NRollup(datetime.timedelta(seconds=10), ["A", "b"],
+                         missing_values={"A": -32767.0})
+        rollup.addRows([(at(0), -32767.0, None),
+                        (at(5), -32767.0, -32767.0),
+                        (at(10), 2.0, 4.0),
+                        (at(15), -32767.0, 6.0)])
+        self.assertEqual(rollup.names, ["a", "b"])
+        self.assertEqual(rollup.select(),
+                         [(at(0), None, None, None, 0,
+                           -32767.0, -32767.0, -32767.0, 1),
+                          (at(10), 2.0, 2.0, 2.0, 1, 4.0, 5.0, 6.0, 2)])
+
+    def test_out_of_order(self):
+        ## Late values go into their own bucket, earlier ones add a bucket.
+        rollup = NRollup(datetime.timedelta(seconds=10), ["a", "b"])
+        rollup.addRows([(at(30), 1.0, 2.0), (at(31), 3.0, 4.0)])
+        rollup.addRows([(at(2), 5.0, 6.0)])
+        rollup.addValues("a", [at(33), at(12)], [7.0, 8.0])
+        self.assertEqual(rollup.times, [at(0), at(10), at(30)])
+        self.assertEqual(rollup.select(names=["a"]),
+                         [(at(0), 5.0, 5.0, 5.0, 1),
+                          (at(10), 8.0, 8.0, 8.0, 1),
+                          (at(30), 1.0, 11.0 / 3, 7.0, 3)])
+        self.assertEqual(rollup.select(["b"], start=at(5), stop=at(25)),
+                         [(at(0), 6.0, 6.0, 6.0, 1),
+                          (at(10), None, None, None, 0)])
+        self.assertEqual(rollup.labels(["b"]),
+                         ('DATETIME', 'b_min', 'b_mean', 'b_max', 'b_count'))
+        self.assertRaises(KeyError, rollup.select, ["c"])
+
+    def test_columns(self):
+        rollup = NRollup(datetime.timedelta(seconds=10), ["a"])
+        rollup.addRows([(at(0), 1.0), (at(10), 2.0)])
+        rollup.addColumn("c", [at(1), at(11), at(21)], [3.0, 4.0, 5.0])
+        self.assertEqual(rollup.select(names=["c"]),
+                         [(at(0), 3.0, 3.0, 3.0, 1),
+                          (at(10), 4.0, 4.0, 4.0, 1),
+                          (at(20), 5.0, 5.0, 5.0, 1)])
+        self.assertEqual(rollup.select(names=["a"])[-1],
+                         (at(20), None, None, None, 0))
+        self.assertRaises(ValueError, rollup.addColumn, "A")
+        self.assertRaises(ValueError, NRollup, datetime.timedelta(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
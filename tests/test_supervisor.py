@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of NSupervisor restarting watchers that crash.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:32:00
+
+import os
+import sys
+import unittest
+
+from NCARFlightMonitor.database import NMemoryDatabase
+from NCARFlightMonitor.sinks import NSink
+from NCARFlightMonitor.supervisor import NSupervisor
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+                          __file__))),
+                      "samples", "HIPPO-5-rf05-2011_08_20-03_34_52.asc")
+
+
+class NFlakyDatabase(NMemoryDatabase):
+    """ An NMemoryDatabase with a connection that can go stale. """
+
+    def __init__(self, *args, **kwds):
+        NMemoryDatabase.__init__(self, *args, **kwds)
+        self.connection = object()
+        self.stale = None
+        self.reconnects = 0
+
+    def reconnect(self):
+        self.connection = object()
+        self.reconnects += 1
+
+
+class TestRestart(unittest.TestCase):
+
+    def setUp(self):
+        self.closed = []
+        self.stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+
+    def configure(self, watcher):
+        def step():
+            raise RuntimeError("crash")
+
+        def close(close=watcher.close):
+            self.closed.append(watcher)
+            close()
+
+        watcher.step = step
+        watcher.close = close
+
+    def test_crashed_watcher_closed(self):
+        supervisor = NSupervisor(sinks=[NSink()], restart_delay=0)
+        supervisor.add("GV", self.configure,
+                       server=NMemoryDatabase(simulate_file=SAMPLE))
+        supervisor.step()
+        self.assertEqual(len(self.closed), 1)
+        self.assertEqual(supervisor.watchers["GV"], None)
+        self.assertNotEqual(supervisor._sinks[0]._thread, None)  # Shared
+
+        supervisor.step()
+        self.assertEqual(len(self.closed), 2)
+        self.assertEqual(supervisor.restarts["GV"], 1)
+        supervisor.close()
+
+    def test_restart_reconnects(self):
+        ## Two watchers share a connection, which goes stale so both crash.
+        ## Each restarts with a working connection, made again only once.
+        server = NFlakyDatabase(simulate_file=SAMPLE)
+        server.stale = server.connection
+
+        def configure(watcher):
+            def step():
+                if server.connection is server.stale:
+                    raise RuntimeError("stale connection")
+                return 60
+            watcher.step = step
+
+        supervisor = NSupervisor(restart_delay=0)
+        supervisor._servers[supervisor._serverKey({'database': "GV"})] = \
+            server
+        for name in ("GV-1", "GV-2"):
+            supervisor.add(name, configure, database="GV")
+        supervisor.step()
+        supervisor.step()
+        self.assertEqual(supervisor.watchers, {"GV-1": None, "GV-2": None})
+
+        supervisor.step()
+        supervisor.step()
+        self.assertEqual(server.reconnects, 1)
+        self.assertEqual(supervisor.restarts, {"GV-1": 1, "GV-2": 1})
+        for watcher in supervisor.watchers.values():
+            self.assertTrue(watcher._server is server)
+            self.assertEqual(watcher.step(), 60)
+        supervisor.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
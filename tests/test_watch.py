@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+## Copyright 2011 Ryan Orendorff, NCAR under GPLv3
+## See README.mkd for more details.
+
+## Tests of NWatcher, replaying the sample flights in process with
+## database.NMemoryDatabase.
+##
+## Author: agent <agent@local>
+## Date: 19/10/26 06:28:00
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from NCARFlightMonitor.batch import REPLAY_TAIL
+from NCARFlightMonitor.database import NMemoryDatabase
+from NCARFlightMonitor.datafile import NRTFile
+from NCARFlightMonitor.sinks import NSink, NQueuedSink
+from NCARFlightMonitor.stats import NRollup
+from NCARFlightMonitor.watch import Logger, NWatcher, rollup_file_str
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(
+                          __file__))),
+                      "samples", "HIPPO-5-rf05-2011_08_20-03_34_52.asc")
+SHORT_SAMPLE = os.path.join(os.path.dirname(SAMPLE),
+                            "ICE-T-rf12-2011_07_30-19_38_00.asc")
+
+START = datetime.datetime(2011, 8, 19, 18)
+
+
+class NListSink(NSink):
+    """ Keeps every message delivered. """
+    def __init__(self):
+        self.messages = []
+
+    def message(self, msg, tm):
+        self.messages.append(msg)
+
+
+class TestCoalescing(unittest.TestCase):
+    """ Messages about a variable within a minute become one summary. """
+
+    def setUp(self):
+        self.delivered = []
+
+    def printMsg(self, msg, tm):
+        self.delivered.append(msg)
+        return msg
+
+    def logger(self, **kwds):
+        return Logger(self.printMsg, coalesce=datetime.timedelta(minutes=1),
+                      **kwds)
+
+    def flap(self, log):
+        """ tasx goes missing four times in half a minute. """
+        for seconds, msg, variable in ((0, "tasx missing 0", "tasx"),
+                                       (5, "ggalt missing", "ggalt"),
+                                       (10, "tasx missing 10", "tasx"),
+                                       (15, "Flight started", None),
+                                       (20, "tasx missing 20", "tasx"),
+                                       (30, "tasx missing 30", "tasx")):
+            log.print_msg(msg, START + datetime.timedelta(seconds=seconds),
+                          variable=variable)
+
+    def test_summary(self):
+        log = self.logger()
+        self.flap(log)
+        self.assertEqual(self.delivered, ["tasx missing 0", "ggalt missing",
+                                          "Flight started"])
+
+        ## The next message after the window delivers the ones held first.
+        log.print_msg("tasx missing 70", START +
+                      datetime.timedelta(seconds=70), variable="tasx")
+        self.assertEqual(self.delivered[3:],
+                         ["tasx: 3 more messages, last: tasx missing 30",
+                          "tasx missing 70"])
+        self.assertEqual(log.messages, self.delivered)
+
+        ## Every message is an event.
+        self.assertEqual(len(log.events), 7)
+        self.assertEqual(len(log.events.query(variable="tasx")), 5)
+
+    def test_flush(self):
+        log = self.logger()
+        self.flap(log)
+        log.flush(START + datetime.timedelta(seconds=59))
+        self.assertEqual(len(self.delivered), 3)
+        log.flush(START + datetime.timedelta(seconds=60))
+        self.assertEqual(self.delivered[3:],
+                         ["tasx: 3 more messages, last: tasx missing 30"])
+
+        ## A single message held is delivered as it is.
+        log.print_msg("tasx missing 61", START +
+                      datetime.timedelta(seconds=61), variable="tasx")
+        log.print_msg("tasx missing 62", START +
+                      datetime.timedelta(seconds=62), variable="tasx")
+        log.flush()
+        self.assertEqual(self.delivered[4:], ["tasx missing 61",
+                                              "tasx missing 62"])
+
+    def test_close(self):
+        ## Held and queued messages are all delivered, to the sinks too.
+        sink = NListSink()
+        log = self.logger(background=True, sinks=[sink])
+        self.flap(log)
+        log.close()
+        expected = ["tasx missing 0", "ggalt missing", "Flight started",
+                    "tasx: 3 more messages, last: tasx missing 30"]
+        self.assertEqual(self.delivered, expected)
+        self.assertEqual(log.messages, expected)
+        self.assertEqual(sink.messages, expected)
+        self.assertEqual(len(log.events), 6)
+
+
+class TestClose(unittest.TestCase):
+
+    def setUp(self):
+        self.server = NMemoryDatabase(simulate_file=SAMPLE)
+
+    def test_shared_sinks_left_open(self):
+        shared = NQueuedSink(NListSink())
+        own = NListSink()
+        watcher = NWatcher(server=self.server, sinks=[shared, own])
+        watcher.close()
+        shared.message("still open", None)
+        shared.close()
+        self.assertEqual(shared.sink.messages, ["still open"])
+        self.assertEqual(watcher._sinks[1]._thread, None)  # Closed
+
+    def test_no_mail_thread_without_email(self):
+        watcher = NWatcher(server=self.server, background_mail=True)
+        self.assertFalse(isinstance(watcher._mail_sink, NQueuedSink))
+        watcher = NWatcher(server=self.server, background_mail=True,
+                           email_fn=lambda *args: None)
+        self.assertTrue(isinstance(watcher._mail_sink, NQueuedSink))
+        watcher.close()
+
+
+class TestTieredResume(unittest.TestCase):
+    """ Resuming from a checkpoint saved before the slow tier was filled. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def watcher(self, start_time):
+        server = NMemoryDatabase(simulate_file=SAMPLE,
+                                 simulate_start_time=start_time)
+        watcher = NWatcher(server=server, print_msg_fn=lambda msg, tm: None,
+                           variables=['tasx', 'ggalt', 'coraw_al'],
+                           checkpoint_dir=self.directory,
+                           cadences={'tasx': 1}, default_cadence=0)
+        return server, watcher
+
+    def test_restored_nones_filled(self):
+        server, first = self.watcher(datetime.datetime(2011, 8, 19, 18))
+        while server.getTime() < datetime.datetime(2011, 8, 19, 18, 40):
+            first.step()
+        first._saveCheckpoint()
+
+        server, second = self.watcher(server.getTime())
+        second.step()
+        self.assertTrue(second._updater.watermark(['coraw_al']) <
+                        second._variables._time.getTimeFromPos(-1))
+
+        first._updater.fillAll()
+        second._updater.fillAll()
+        length = len(first._variables._time)
+        self.assertEqual(second._variables.sliceWithTime(0, length),
+                         first._variables.sliceWithTime(0, length))
+        self.assertFalse(None in second._variables.getNVar('coraw_al')[:])
+
+
+
+class TestBadData(unittest.TestCase):
+    """ Missing data found in a replay, with a flag keyed in mixed case. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_reported_in_variable_order(self):
+        ## ICE-T flags BUTCNTS_CLSMAI3760a, not BUTCNTS_CLSMAI3760A.
+        names = ['ch4_pic', 'butcnts_clsmai3760a', 'co2_pic']
+        messages = []
+        server = NMemoryDatabase(simulate_file=SHORT_SAMPLE)
+        self.assertTrue('BUTCNTS_CLSMAI3760a' in server.getBadDataValues())
+        watcher = NWatcher(server=server,
+                           print_msg_fn=lambda msg, tm:
+                               messages.append((tm, msg)) or msg,
+                           output_file_path=os.path.join(self.directory,
+                                                         "flight.asc"),
+                           variables=names)
+        watcher.runTillTime(datetime.datetime(2011, 7, 30, 14, 30))
+
+        missing = [(tm, msg.split()[0]) for tm, msg in messages
+                   if "MISSING DATA" in msg]
+        self.assertEqual([name for tm, name in missing],
+                         ['ch4_pic', 'co2_pic'])
+        self.assertEqual(missing[0][0], missing[1][0])
+        cleared = [msg.split()[0] for tm, msg in messages
+                   if "no longer has missing data" in msg]
+        self.assertEqual(cleared, ['ch4_pic', 'co2_pic'])
+
+
+class TestRollupFiles(unittest.TestCase):
+    """ The rollups of a replayed flight written when it lands. """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def number(self, field):
+        return None if field == "None" else float(field)
+
+    def test_written_at_landing(self):
+        periods = [datetime.timedelta(minutes=1),
+                   datetime.timedelta(minutes=10)]
+        path = os.path.join(self.directory, "flight.asc")
+        server = NMemoryDatabase(simulate_file=SHORT_SAMPLE)
+        watcher = NWatcher(server=server, print_msg_fn=lambda msg, tm: msg,
+                           output_file_path=path,
+                           variables=['tasx', 'ggalt'], rollups=periods)
+        watcher.runTillTime(server.last_time + REPLAY_TAIL)
+
+        ## The same summaries as of the rows in the output file.
+        data = [[row[0]] + [self.number(field) for field in row[1:]]
+                for row in NRTFile(path).data]
+        for period in periods:
+            expected = NRollup(period, ['tasx', 'ggalt'],
+                               server.getBadDataValues())
+            expected.addRows(data)
+            written = NRTFile(rollup_file_str(path, period))
+            self.assertEqual(written.labels,
+                             tuple([label.upper()
+                                    for label in expected.labels()]))
+            self.assertEqual(len(written.data), len(expected))
+            for row, want in zip(written.data, expected.select()):
+                self.assertEqual(row[0], want[0])
+                self.assertEqual([int(field) for field in row[4::4]],
+                                 list(want[4::4]))
+                for field, value in zip(row[1:], want[1:]):
+                    if value is None:
+                        self.assertEqual(field, "None")
+                    else:
+                        self.assertAlmostEqual(float(field), value,
+                                               places=6)
+
+
+if __name__ == '__main__':
+    unittest.main()